@@ -0,0 +1,240 @@
+"""
+Multi-year spending trends computed from the type x month rollup.
+
+``month_type_totals`` (see rollups.py) already is a compact cube with one row per
+month and expense type, kept current by triggers as expenses and recurring
+instances change. The queries here read only that cube, never the raw tables, so
+the cost of a query depends on the number of months and types it covers (a
+10-year range is at most 120 rows per type), not on how many expenses there are.
+
+Months are handled as month indexes (``recurrence.month_index``). A recursive CTE
+lays out a dense calendar, so months without any spending count as 0 and window
+frames like "the 11 preceding rows" always mean 11 calendar months. Each query
+starts the calendar early enough for the first requested month to have its full
+rolling window and year-earlier values. All amounts are integer cents.
+"""
+
+from recurrence import index_to_month, month_index
+
+# Longest range one query may cover (50 years), and the rolling windows accepted
+MAX_ANALYTICS_MONTHS = 600
+MAX_WINDOW = 120
+
+# The cube as (idx, series, total, expense_count), one row per month and series. A
+# series is an expense type, or NULL for all selected types added together
+_SOURCE_BY_TYPE = '''
+    SELECT year * 12 + month - 1 AS idx, expense_type_id AS series, total, expense_count
+    FROM month_type_totals
+    WHERE year BETWEEN ? AND ? {type_filter}
+'''
+
+_SOURCE_TOTAL = '''
+    SELECT year * 12 + month - 1 AS idx, NULL AS series, total, expense_count
+    FROM month_totals
+    WHERE year BETWEEN ? AND ?
+'''
+
+_SOURCE_TOTAL_OF_TYPES = '''
+    SELECT year * 12 + month - 1 AS idx, NULL AS series, SUM(total) AS total,
+           SUM(expense_count) AS expense_count
+    FROM month_type_totals
+    WHERE year BETWEEN ? AND ? {type_filter}
+    GROUP BY year, month
+'''
+
+_MONTHLY_QUERY = '''
+    WITH RECURSIVE calendar(idx) AS (
+        SELECT ? UNION ALL SELECT idx + 1 FROM calendar WHERE idx < ?
+    ),
+    source AS ({source}),
+    series(series) AS (
+        SELECT series FROM source WHERE idx BETWEEN ? AND ?
+        UNION SELECT NULL WHERE ?
+    ),
+    dense AS (
+        SELECT c.idx, s.series, COALESCE(src.total, 0) AS total,
+               COALESCE(src.expense_count, 0) AS expense_count
+        FROM calendar c
+        CROSS JOIN series s
+        LEFT JOIN source src ON src.idx = c.idx AND src.series IS s.series
+    ),
+    rolling AS (
+        SELECT idx, series, total, expense_count,
+               SUM(total) OVER (PARTITION BY series ORDER BY idx
+                                ROWS BETWEEN {preceding} PRECEDING AND CURRENT ROW) AS rolling_total
+        FROM dense
+    ),
+    trends AS (
+        SELECT idx, series, total, expense_count, rolling_total,
+               LAG(total, 12) OVER by_month AS previous_year_total,
+               LAG(rolling_total, 12) OVER by_month AS previous_year_rolling_total
+        FROM rolling
+        WINDOW by_month AS (PARTITION BY series ORDER BY idx)
+    )
+    SELECT * FROM trends
+    WHERE idx >= ?
+    ORDER BY series, idx
+'''
+
+_RANKING_QUERY = '''
+    WITH source AS ({source}),
+    period AS (
+        SELECT series AS expense_type_id,
+               SUM(CASE WHEN idx >= ? THEN total ELSE 0 END) AS total,
+               SUM(CASE WHEN idx >= ? THEN expense_count ELSE 0 END) AS expense_count,
+               SUM(CASE WHEN idx <= ? THEN total ELSE 0 END) AS previous_year_total
+        FROM source
+        WHERE idx BETWEEN ? AND ?
+        GROUP BY series
+    )
+    SELECT expense_type_id, total, expense_count, previous_year_total,
+           RANK() OVER (ORDER BY total DESC) AS rank,
+           SUM(total) OVER () AS period_total
+    FROM period
+    WHERE total != 0
+    ORDER BY rank, expense_type_id
+'''
+
+_YEARLY_QUERY = '''
+    WITH source AS ({source}),
+    years AS (
+        SELECT idx / 12 AS year, SUM(total) AS total, SUM(expense_count) AS expense_count
+        FROM source
+        GROUP BY idx / 12
+    ),
+    trends AS (
+        SELECT year, total, expense_count,
+               CASE WHEN LAG(year) OVER by_year = year - 1
+                    THEN LAG(total) OVER by_year ELSE 0 END AS previous_year_total
+        FROM years
+        WINDOW by_year AS (ORDER BY year)
+    )
+    SELECT * FROM trends
+    WHERE year >= ?
+    ORDER BY year
+'''
+
+
+def _type_filter(expense_type_ids):
+    """WHERE fragment and parameters restricting the cube to some expense types"""
+    if not expense_type_ids:
+        return '', []
+    placeholders = ', '.join('?' * len(expense_type_ids))
+    return f' AND expense_type_id IN ({placeholders})', list(expense_type_ids)
+
+
+def _source(first_index, last_index, expense_type_ids, by_type):
+    """SQL and parameters for the cube rows between two month indexes"""
+    type_filter, type_params = _type_filter(expense_type_ids)
+    if by_type:
+        sql = _SOURCE_BY_TYPE.format(type_filter=type_filter)
+    elif expense_type_ids:
+        sql = _SOURCE_TOTAL_OF_TYPES.format(type_filter=type_filter)
+    else:
+        sql = _SOURCE_TOTAL
+    # Whole years are selected, so the primary key range scan does the filtering
+    return sql, [first_index // 12, last_index // 12] + type_params
+
+
+def check_range(start, end, window=12):
+    """Validate a (year, month) range and rolling window; returns (start, end) indexes"""
+    start_index, end_index = month_index(*start), month_index(*end)
+    if end_index < start_index:
+        raise ValueError('The end month is before the start month')
+    if end_index - start_index + 1 > MAX_ANALYTICS_MONTHS:
+        raise ValueError(f'At most {MAX_ANALYTICS_MONTHS} months can be analyzed at once')
+    if not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f'The window must be between 1 and {MAX_WINDOW} months')
+    return start_index, end_index
+
+
+def monthly_trends(conn, start, end, window=12, expense_type_ids=None, by_type=False):
+    """Monthly totals with rolling sums and year-over-year values
+
+    Args:
+        conn: Database connection
+        start, end: Inclusive (year, month) range
+        window: Months in the rolling sum (12 for trailing-12-month totals)
+        expense_type_ids: Optional expense types to include (all types otherwise)
+        by_type: One series per expense type instead of one for all of them
+
+    Returns:
+        List of dicts ordered by series and month, with year, month,
+        expense_type_id (None unless by_type), total, expense_count,
+        rolling_total, rolling_average, previous_year_total and
+        previous_year_rolling_total. By-type series only include types with
+        spending in the range or in the year before it.
+    """
+    start_index, end_index = check_range(start, end, window)
+    # The first month needs its rolling window and the rolling window a year earlier
+    first_index = start_index - (window - 1) - 12
+    source, source_params = _source(first_index, end_index, expense_type_ids, by_type)
+
+    rows = conn.execute(
+        _MONTHLY_QUERY.format(source=source, preceding=int(window) - 1),
+        [first_index, end_index] + source_params + [start_index - 12, end_index, not by_type, start_index],
+    ).fetchall()
+
+    trends = []
+    for row in rows:
+        year, month = index_to_month(row['idx'])
+        trends.append({
+            'year': year,
+            'month': month,
+            'expense_type_id': row['series'],
+            'total': row['total'],
+            'expense_count': row['expense_count'],
+            'rolling_total': row['rolling_total'],
+            'rolling_average': row['rolling_total'] / window,
+            'previous_year_total': row['previous_year_total'],
+            'previous_year_rolling_total': row['previous_year_rolling_total'],
+        })
+    return trends
+
+
+def top_categories(conn, start, end, expense_type_ids=None, limit=None):
+    """Expense types ranked by their spending in a range
+
+    Returns:
+        List of dicts with expense_type_id, rank, total, expense_count,
+        monthly_average, share (of the range's total) and previous_year_total
+        (the same range a year earlier), largest total first.
+    """
+    start_index, end_index = check_range(start, end)
+    source, source_params = _source(start_index - 12, end_index, expense_type_ids, by_type=True)
+    rows = conn.execute(
+        _RANKING_QUERY.format(source=source),
+        source_params + [start_index, start_index, end_index - 12, start_index - 12, end_index],
+    ).fetchall()
+
+    months = end_index - start_index + 1
+    categories = [{
+        'expense_type_id': row['expense_type_id'],
+        'rank': row['rank'],
+        'total': row['total'],
+        'expense_count': row['expense_count'],
+        'monthly_average': row['total'] / months,
+        'share': row['total'] / row['period_total'] if row['period_total'] else None,
+        'previous_year_total': row['previous_year_total'],
+    } for row in rows]
+    return categories if limit is None else categories[:limit]
+
+
+def yearly_totals(conn, start_year, end_year, expense_type_ids=None):
+    """Calendar-year totals with the previous year's total for each
+
+    Returns:
+        List of dicts with year, total, expense_count and previous_year_total for
+        every year in the range that has spending.
+    """
+    start_index, end_index = check_range((start_year, 1), (end_year, 12))
+    source, source_params = _source(start_index - 12, end_index, expense_type_ids, by_type=False)
+    rows = conn.execute(_YEARLY_QUERY.format(source=source), source_params + [start_year]).fetchall()
+    return [dict(row) for row in rows]
+
+
+def change(current, previous):
+    """Relative change from previous to current, or None when there is no base"""
+    if not previous:
+        return None
+    return (current - previous) / abs(previous)
@@ -1,36 +1,167 @@
 from flask import Flask, render_template, request, redirect, url_for, session
 import sqlite3
 import os
+import logging
+import secrets
 from datetime import datetime
+import db
+import metrics
+from db import get_db_connection
+from metadata_cache import (get_active_expense_types, get_all_expense_types, get_latest_month, get_month,
+                            get_months, invalidate as invalidate_metadata)
 from utils import calculate_total_expenses
+import money
+from money import to_cents
+import migrations
+import assets
+import retention
+import scheduler
+import shards
+import template_cache
+from response_cache import cached_page
+from scheduler import templates_changed
 
-app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-# Set a secret key for session management
-app.secret_key = 'spending_tracker_secret_key'
 
-# Import and register blueprints
-from templateLogic.month_routes import month_routes
-from templateLogic.expense_type_routes import expense_type_routes
-from templateLogic.expense_routes import expense_routes
-app.register_blueprint(month_routes, url_prefix='/month')
-app.register_blueprint(expense_type_routes, url_prefix='/expense-types')
-app.register_blueprint(expense_routes, url_prefix='/expenses')
+def create_app(config=None):
+    """Build the Flask app
+    
+    Settings come from the environment unless given in ``config``:
+        DATABASE       SQLite file (SPENDING_TRACKER_DB)
+        DB_POOL_SIZE   read-only connections kept per process, for GET requests
+                       (SPENDING_TRACKER_DB_POOL_SIZE)
+        DB_WRITE_POOL_SIZE  writer connections kept per process (SPENDING_TRACKER_DB_WRITE_POOL_SIZE)
+        SECRET_KEY     session signing key (SPENDING_TRACKER_SECRET_KEY)
+        AUTO_MIGRATE   apply pending migrations on startup (SPENDING_TRACKER_AUTO_MIGRATE)
+        SHARD_DIR      one database per tenant in this directory (SPENDING_TRACKER_SHARD_DIR)
+        MAX_OPEN_SHARDS  tenant databases kept open (SPENDING_TRACKER_MAX_OPEN_SHARDS)
+    """
+    # Leveled logging, configurable (or silenced) with SPENDING_TRACKER_LOG_LEVEL
+    metrics.configure_logging()
+    
+    app = Flask(__name__)
+    pool, read_pool = db.get_pool(), db.get_pool(read_only=True)
+    app.config.from_mapping(
+        DATABASE=pool.db_path,
+        DB_POOL_SIZE=read_pool.max_size,
+        DB_WRITE_POOL_SIZE=pool.max_size,
+        SECRET_KEY=os.environ.get('SPENDING_TRACKER_SECRET_KEY'),
+        AUTO_MIGRATE=os.environ.get('SPENDING_TRACKER_AUTO_MIGRATE', '1') != '0',
+        SHARD_DIR=shards.SHARD_DIR,
+        MAX_OPEN_SHARDS=shards.MAX_OPEN_SHARDS,
+    )
+    if config:
+        app.config.from_mapping(config)
+    
+    if not app.config['SECRET_KEY']:
+        # Sessions then only last as long as this process
+        logger.warning("SPENDING_TRACKER_SECRET_KEY is not set; using a random session key")
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+    
+    # Share one pooled connection per request across all blueprints
+    sizes = (app.config['DATABASE'], app.config['DB_POOL_SIZE'], app.config['DB_WRITE_POOL_SIZE'])
+    if sizes != (pool.db_path, read_pool.max_size, pool.max_size):
+        db.configure(*sizes)
+    db.init_app(app)
+    
+    # With a shard directory, each tenant's requests use its own database
+    if app.config['SHARD_DIR']:
+        db.set_router(shards.ShardRouter(app.config['SHARD_DIR'], app.config['MAX_OPEN_SHARDS'],
+                                         app.config['DB_POOL_SIZE'], app.config['AUTO_MIGRATE'],
+                                         app.config['DB_WRITE_POOL_SIZE']))
+    
+    # Per-request timing, SQL and template metrics, served at /metrics
+    metrics.init_app(app)
+    
+    # Template filters for amounts stored as integer cents
+    money.init_app(app)
+    
+    # Compiled templates shared across workers and restarts, and the {% cache %} tag
+    template_cache.init_app(app)
+    
+    # Hashed, precompressed static assets and gzipped HTML/JSON responses
+    assets.init_app(app)
+    
+    # Bring the schema up to date on startup, unless AUTO_MIGRATE is off
+    # (then run `python manage.py migrate` when deploying); tenant shards other
+    # than the default one are migrated when first opened
+    with db.pooled_connection() as conn:
+        if app.config['AUTO_MIGRATE']:
+            migrations.migrate(conn)
+        elif migrations.pending_migrations(conn):
+            logger.warning("Database schema is at version %d of %d; run `python manage.py migrate`",
+                           migrations.current_version(conn), migrations.LATEST_VERSION)
+    
+    # Import and register blueprints
+    from templateLogic.month_routes import month_routes
+    from templateLogic.expense_type_routes import expense_type_routes
+    from templateLogic.expense_routes import expense_routes
+    from templateLogic.analytics_routes import analytics_routes
+    from templateLogic.forecast_routes import forecast_routes
+    from templateLogic.tenant_routes import tenant_routes
+    app.register_blueprint(month_routes, url_prefix='/month')
+    app.register_blueprint(expense_type_routes, url_prefix='/expense-types')
+    app.register_blueprint(expense_routes, url_prefix='/expenses')
+    app.register_blueprint(analytics_routes, url_prefix='/analytics')
+    app.register_blueprint(forecast_routes, url_prefix='/forecast')
+    app.register_blueprint(tenant_routes, url_prefix='/tenant')
+    
+    # The app's own pages
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/add_expense', 'add_expense', add_expense, methods=['GET', 'POST'])
+    app.add_url_rule('/reset_data', 'reset_data', reset_data, methods=['POST'])
+    app.add_url_rule('/seed_data', 'seed_data', seed_data, methods=['POST'])
+    app.context_processor(inject_current_year)
+    return app
+
+
+def warm_up(app):
+    """Load what the first requests would otherwise pay for: a database connection,
+    the metadata caches and the compiled templates. Servers call this in each worker."""
+    with app.app_context():
+        conn = get_db_connection()
+        get_active_expense_types(conn)
+        get_all_expense_types(conn)
+        get_months(conn)
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+
+def start_background_tasks(app):
+    """Start this process's background threads (the deleted-expense archiver and the
+    recurring instance scheduler). Servers call this in each worker, after forking;
+    both write under the write lock, so workers running them at the same time never
+    move a row twice or insert an instance twice."""
+    archiver = retention.start_archiver()
+    if archiver is not None:
+        logger.info("Archiving expenses deleted over %d days ago every %gs",
+                    archiver.older_than_days, archiver.interval)
+    instance_scheduler = scheduler.start_scheduler()
+    if instance_scheduler is not None:
+        logger.info("Keeping recurring instances in sync from %d months back to %d ahead, refreshed every %gs",
+                    instance_scheduler.past_months, instance_scheduler.future_months,
+                    instance_scheduler.interval)
 
-# Database configuration
-DB_NAME = 'spending_tracker.db'
-DB_PATH = os.path.join(os.path.dirname(__file__), DB_NAME)
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+_default_app = None
 
-@app.route('/')
+
+def __getattr__(name):
+    """``app.app`` builds the app from the environment on first use, so importing this
+    module has no side effects while ``from app import app`` and ``flask run`` work"""
+    global _default_app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _default_app is None:
+        _default_app = create_app()
+    return _default_app
+
+@cached_page
 def index():
     conn = get_db_connection()
     # Fetch expense types to display
-    expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
+    expense_types = get_active_expense_types(conn)
     
     # Get current_month_id from request args or session
     current_month_id = request.args.get('current_month_id', None)
@@ -44,16 +175,16 @@ def index():
     
     # Fetch current month's details based on current_month_id if provided
     if current_month_id:
-        current_month_data = conn.execute('SELECT * FROM months WHERE id = ?', (current_month_id,)).fetchone()
+        current_month_data = get_month(conn, current_month_id)
         # If month not found, fall back to default behavior
         if not current_month_data:
-            current_month_data = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+            current_month_data = get_latest_month(conn)
             # Update session with the fallback month id
             if current_month_data:
                 session['current_month_id'] = current_month_data['id']
     else:
         # Default behavior - get most recent month
-        current_month_data = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+        current_month_data = get_latest_month(conn)
         # Store the default month id in session
         if current_month_data:
             session['current_month_id'] = current_month_data['id']
@@ -69,21 +200,17 @@ def index():
     ''').fetchall()
     
     # Calculate total expenses for the current month using the consistent calculation function
-    total_amount = 0.0
+    total_amount = 0
     if current_month_data:
         total_amount = calculate_total_expenses(current_month_data['month'], current_month_data['year'], conn)
 
-    conn.close()
     return render_template('index.html', expense_types=expense_types, current_month=current_month_data, 
                            recent_expenses=recent_expenses, month_error=None, show_month_modal=False, total_amount=total_amount)
 
-@app.route('/add_expense', methods=['GET', 'POST'])
 def add_expense():
-    print("--- Accessing /add_expense route ---") # New log
     conn = get_db_connection()
     if request.method == 'POST':
-        print("--- /add_expense: POST request received ---") # New log
-        print(f"Form data: {request.form}") # New log
+        logger.debug("add_expense form data: %s", request.form.to_dict())
         amount = request.form.get('amount') # Use .get() to avoid KeyError if field is missing
         description = request.form.get('description')
         expense_type_id = request.form.get('expense_type_id')
@@ -104,11 +231,17 @@ def add_expense():
                 except ValueError:
                     pass
 
+        # Amounts are stored as integer cents
+        try:
+            amount = to_cents(amount) if amount else None
+        except ValueError:
+            amount = None
+
         # Basic validation (can be expanded)
-        if not amount or not expense_type_id or not date:
+        if amount is None or not expense_type_id or not date:
             # Handle error - return to index with error message to display in modal
-            expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
-            current_month_data = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+            expense_types = get_active_expense_types(conn)
+            current_month_data = get_latest_month(conn)
             # Fetch recent expenses for the template
             recent_expenses = conn.execute('''
                 SELECT e.id, e.amount, e.description, e.date, et.name as expense_type_name, e.created_at
@@ -118,7 +251,6 @@ def add_expense():
                 ORDER BY e.created_at DESC
                 LIMIT 10
             ''').fetchall()
-            conn.close()
             return render_template('index.html', expense_types=expense_types, current_month=current_month_data, 
                                    recent_expenses=recent_expenses, error='Missing required fields', show_modal=True)
 
@@ -126,13 +258,12 @@ def add_expense():
             cursor = conn.cursor()
             
             # For recurring expenses, we only create the recurring expense template
-            # The actual instances will be generated by the get_recurring_expenses_for_month function
-            # when viewing a specific month
+            # The instance scheduler then adds its instances to the existing months
             
             # Check if this is a recurring expense
             if recurring_interval != 'none':
                 # This is a recurring expense - create it as a template only
-                print(f"Creating recurring expense template with interval: {recurring_interval}")
+                logger.info("Creating recurring expense template with interval: %s", recurring_interval)
                 
                 # Set is_recurring_template flag to TRUE for recurring expenses
                 # This will help distinguish between the template and actual instances
@@ -143,7 +274,7 @@ def add_expense():
                 ''', (amount, description, expense_type_id, date, recurring_interval, recurring_day))
             else:
                 # This is a regular non-recurring expense
-                print("Creating regular non-recurring expense")
+                logger.debug("Creating regular non-recurring expense")
                 cursor.execute('''
                     INSERT INTO expenses (amount, description, expense_type_id, date, 
                                          recurring_interval, recurring_day, is_recurring_template)
@@ -151,10 +282,14 @@ def add_expense():
                 ''', (amount, description, expense_type_id, date, recurring_interval, recurring_day))
             
             conn.commit()
+            if recurring_interval != 'none':
+                templates_changed(conn, [cursor.lastrowid])
         except sqlite3.Error as e:
+            # Discard the failed insert before re-rendering on the same connection
+            conn.rollback()
             # Handle error - return to index with error message to display in modal
-            expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
-            current_month_data = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+            expense_types = get_active_expense_types(conn)
+            current_month_data = get_latest_month(conn)
             # Fetch recent expenses for the template
             recent_expenses = conn.execute('''
                 SELECT e.id, e.amount, e.description, e.date, et.name as expense_type_name, e.created_at
@@ -164,24 +299,18 @@ def add_expense():
                 ORDER BY e.created_at DESC
                 LIMIT 10
             ''').fetchall()
-            conn.close()
             return render_template('index.html', expense_types=expense_types, current_month=current_month_data, 
                                    recent_expenses=recent_expenses, error=f'Database error: {e}', show_modal=True)
-        finally:
-            conn.close()
         
         return redirect(url_for('index')) # Redirect to homepage after adding
 
     # GET request: we no longer need this since we're using a modal
     # Just redirect to index
-    conn.close()
     return redirect(url_for('index'))
 
-@app.context_processor
 def inject_current_year():
     return {'current_year': datetime.utcnow().year}
 
-@app.route('/reset_data', methods=['POST'])
 def reset_data():
     """Reset all data in the database except for expense types"""
     from flask import jsonify
@@ -199,16 +328,17 @@ def reset_data():
         cursor.execute('DELETE FROM months')
         cursor.execute('''
             INSERT INTO months (month, year, starting_bank_value, monthly_income)
-            VALUES (?, ?, 0.00, 0.00)
+            VALUES (?, ?, 0, 0)
         ''', (current_date.month, current_date.year))
         
         conn.commit()
-        conn.close()
+        invalidate_metadata(conn)
+        # Goes through the same sync as any other template change
+        templates_changed(conn)
         return jsonify({'success': True, 'message': 'All data has been reset successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error resetting data: {str(e)}'}), 500
 
-@app.route('/seed_data', methods=['POST'])
 def seed_data():
     """Generate random expense data for the currently selected month"""
     from flask import jsonify
@@ -228,18 +358,16 @@ def seed_data():
         conn = get_db_connection()
         
         # Get the current month details
-        current_month = conn.execute('SELECT * FROM months WHERE id = ?', (current_month_id,)).fetchone()
+        current_month = get_month(conn, current_month_id)
         if not current_month:
-            conn.close()
             return jsonify({
                 'success': False, 
                 'message': 'Selected month not found. Please select a valid month.'
             }), 404
         
         # Get all active expense types
-        expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE').fetchall()
+        expense_types = get_active_expense_types(conn)
         if not expense_types:
-            conn.close()
             return jsonify({
                 'success': False, 
                 'message': 'No expense types found. Please ensure the database is set up correctly.'
@@ -299,8 +427,8 @@ def seed_data():
             
             # Get a random amount based on expense type
             min_amount, max_amount = expense_amounts.get(expense_type_name, (10, 100))
-            # Generate a random amount with 2 decimal places
-            amount = round(random.uniform(min_amount, max_amount), 2)
+            # Generate a random amount in whole cents
+            amount = random.randint(to_cents(min_amount), to_cents(max_amount))
             
             # Get a random description based on expense type
             descriptions = expense_descriptions.get(expense_type_name, ['Expense'])
@@ -326,7 +454,7 @@ def seed_data():
             cursor.execute('''
                 INSERT INTO expenses (amount, description, expense_type_id, date, is_recurring_template, recurring_interval, recurring_day)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (90.00, 'Internet', internet_type_id, date_str, True, 'monthly', 1))
+            ''', (to_cents(90), 'Internet', internet_type_id, date_str, True, 'monthly', 1))
         
         # 2. Car Insurance - $550 monthly
         insurance_type_id = None
@@ -341,7 +469,7 @@ def seed_data():
             cursor.execute('''
                 INSERT INTO expenses (amount, description, expense_type_id, date, is_recurring_template, recurring_interval, recurring_day)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (550.00, 'Car Insurance', insurance_type_id, date_str, True, 'monthly', 5))
+            ''', (to_cents(550), 'Car Insurance', insurance_type_id, date_str, True, 'monthly', 5))
         
         # 3. Amazon - $105 yearly
         amazon_type_id = None
@@ -356,10 +484,11 @@ def seed_data():
             cursor.execute('''
                 INSERT INTO expenses (amount, description, expense_type_id, date, is_recurring_template, recurring_interval, recurring_day)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (105.00, 'Amazon Prime Subscription', amazon_type_id, date_str, True, 'yearly', 15))
+            ''', (to_cents(105), 'Amazon Prime Subscription', amazon_type_id, date_str, True, 'yearly', 15))
         
         conn.commit()
-        conn.close()
+        # Add the new recurring expenses to the other months
+        templates_changed(conn)
         
         return jsonify({
             'success': True, 
@@ -385,4 +514,8 @@ if __name__ == '__main__':
             # with open(os.path.join(css_dir, 'style.css'), 'a') as f:
             #     pass 
 
+    app = create_app()
+    # The reloader runs the app in a child process; only that one archives
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks(app)
     app.run(debug=True)
@@ -0,0 +1,326 @@
+"""
+Self-hosted static assets with content-hashed URLs, precompressed variants and
+compressed HTML responses.
+
+Third-party libraries (Bootstrap, Bootstrap Icons, Chart.js and the Google Fonts
+the pages use) are served from ``static/vendor/``, so a page never waits on a CDN.
+They are not in the repository: ``python manage.py vendor-assets`` downloads the
+pinned versions in ``VENDOR_ASSETS``, including the font files their stylesheets
+point to, and runs at deploy time before ``build-assets``. Until it has run,
+pages load those libraries from their CDN URLs; the app logs a warning at
+startup naming the missing files, and ``python manage.py vendor-assets --check``
+lists them and exits with status 1.
+
+``python manage.py build-assets`` runs at deploy time. It copies every file under
+``static/`` to ``static/dist/`` with a hash of its contents in the name
+(``css/style.css`` -> ``css/style.3f2a9c41d0e7.css``), rewrites ``url()``
+references in stylesheets to the hashed names, writes ``.gz`` (and, when the
+``brotli`` package is installed, ``.br``) variants next to each text file and
+records the mapping in ``static/dist/manifest.json``.
+
+Templates link assets with ``asset_url('css/style.css')``. With a manifest the
+URL is the hashed file under ``/assets/``, served with
+``Cache-Control: immutable`` and a one-year lifetime and in the best encoding the
+client accepts, so a repeat visit fetches nothing until an asset changes (and
+with it, its URL). Without a manifest, and in debug mode, assets come from the
+plain ``/static/`` route; a vendored library that hasn't been downloaded falls
+back to its CDN URL.
+
+Dynamic responses (HTML and JSON of at least ``MIN_COMPRESS_SIZE`` bytes) are
+gzipped when the client accepts it. Their ETags become weak, since the
+compressed body differs from the uncompressed one byte for byte.
+
+Environment variables:
+    SPENDING_TRACKER_COMPRESS  set to 0 to leave dynamic responses uncompressed
+                               (e.g. behind a proxy that compresses them)
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Hashed copies and the manifest, relative to the static folder
+BUILD_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Local path (under static/) -> pinned source URL
+VENDOR_ASSETS = {
+    'vendor/bootstrap/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-icons/bootstrap-icons.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.1/font/bootstrap-icons.css',
+    'vendor/chart.js/chart.min.js':
+        'https://cdn.jsdelivr.net/npm/chart.js@3.9.1/dist/chart.min.js',
+    'vendor/fonts/fonts.css':
+        'https://fonts.googleapis.com/css2?family=Montserrat:wght@700&family=Roboto:wght@400;500&display=swap',
+}
+
+# Google Fonts serves WOFF2 only to browsers it recognizes
+FETCH_HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0'}
+
+# Files worth storing compressed; fonts and images are compressed already
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.ttf', '.eot')
+
+# Cache lifetime of hashed assets: their URL changes whenever their contents do
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+COMPRESS_RESPONSES = os.environ.get('SPENDING_TRACKER_COMPRESS', '1') != '0'
+COMPRESSIBLE_MIMETYPES = ('text/html', 'application/json', 'text/css', 'application/javascript')
+# Smaller bodies don't gain enough to pay for the gzip header and the CPU
+MIN_COMPRESS_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+# url(...) references in stylesheets
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+# Vendoring
+
+def _fetch(url):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=FETCH_HEADERS), timeout=30) as response:
+        return response.read()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def vendor_assets(static_dir=STATIC_DIR, fetch=_fetch):
+    """Download VENDOR_ASSETS into static/, with the files their stylesheets use
+
+    Relative ``url()`` references are fetched to the same relative path; absolute
+    ones (Google's font files) are saved in a ``fonts/`` folder next to the
+    stylesheet, which is rewritten to point there.
+
+    Returns:
+        List of the paths written, relative to static_dir
+    """
+    written = []
+    for local_path, source in VENDOR_ASSETS.items():
+        data = fetch(source)
+        if local_path.endswith('.css'):
+            css_dir = posixpath.dirname(local_path)
+            text = data.decode('utf-8')
+            references = {}
+            for _, ref in _CSS_URL.findall(text):
+                if ref.startswith('data:') or ref in references:
+                    continue
+                ref_path = urlsplit(ref).path
+                if urlsplit(ref).scheme:
+                    references[ref] = ('fonts/' + posixpath.basename(ref_path), urljoin(source, ref))
+                else:
+                    references[ref] = (ref, urljoin(source, ref))
+            for ref, (local_ref, url) in references.items():
+                target = posixpath.normpath(posixpath.join(css_dir, urlsplit(local_ref).path))
+                _write(os.path.join(static_dir, target), fetch(url))
+                written.append(target)
+                text = text.replace(ref, local_ref)
+            data = text.encode('utf-8')
+        _write(os.path.join(static_dir, local_path), data)
+        written.append(local_path)
+    return written
+
+
+# Building
+
+def _hashed_name(path, data):
+    stem, extension = posixpath.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+
+
+def _rewrite_css(path, text, manifest):
+    """Point a stylesheet's relative url() references at the hashed files"""
+    css_dir = posixpath.dirname(path)
+
+    def replace(match):
+        quote, ref = match.groups()
+        parts = urlsplit(ref)
+        if parts.scheme or ref.startswith(('data:', '/', '#')):
+            return match.group(0)
+        target = manifest.get(posixpath.normpath(posixpath.join(css_dir, parts.path)))
+        if target is None:
+            return match.group(0)
+        # The stylesheet's hashed copy is in the same folder under BUILD_DIR
+        hashed = posixpath.relpath(target, posixpath.join(BUILD_DIR, css_dir))
+        return f'url({quote}{hashed}{"#" + parts.fragment if parts.fragment else ""}{quote})'
+    return _CSS_URL.sub(replace, text)
+
+
+def _compress(path, data):
+    """Write .gz and .br variants of a file where they are smaller"""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            _write(path + suffix, compressed)
+
+
+def build_assets(static_dir=STATIC_DIR, clean=False):
+    """Write content-hashed, precompressed copies of the static files and the manifest
+
+    Files from earlier builds are kept, so pages rendered before a deploy can still
+    load their assets, unless ``clean`` is set.
+
+    Returns:
+        The manifest: dict of static path -> hashed path, both relative to static_dir
+    """
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    sources = []
+    for directory, subdirectories, files in os.walk(static_dir):
+        relative = os.path.relpath(directory, static_dir)
+        if relative == BUILD_DIR or relative.startswith(BUILD_DIR + os.sep):
+            subdirectories[:] = []
+            continue
+        for name in files:
+            sources.append(posixpath.normpath(posixpath.join(relative.replace(os.sep, '/'), name)))
+
+    # Stylesheets last, so the files they reference already have their hashed names
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+    if clean and os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            data = f.read()
+        if path.endswith('.css'):
+            # Hash the rewritten text, so a stylesheet's name changes with its fonts'
+            data = _rewrite_css(path, data.decode('utf-8'), manifest).encode('utf-8')
+        hashed = posixpath.join(BUILD_DIR, _hashed_name(path, data))
+        manifest[path] = hashed
+        target = os.path.join(static_dir, hashed)
+        if not os.path.exists(target):
+            _write(target, data)
+            if path.endswith(COMPRESSIBLE_EXTENSIONS):
+                _compress(target, data)
+
+    _write(os.path.join(build_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def missing_vendor_assets(static_dir=STATIC_DIR):
+    """Paths in VENDOR_ASSETS that haven't been downloaded into static_dir"""
+    return [path for path in VENDOR_ASSETS if not os.path.exists(os.path.join(static_dir, path))]
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    """The manifest of the last build, or {} if assets haven't been built"""
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# Serving
+
+def asset_url(path):
+    """URL of a static asset: its hashed copy if built, else the plain static file
+    (or, for a vendored library that hasn't been downloaded, its CDN)"""
+    state = current_app.extensions['assets']
+    # Never while editing assets in debug mode, when the build would be stale
+    hashed = None if current_app.debug else state['manifest'].get(path)
+    if hashed is not None:
+        return url_for('serve_asset', filename=posixpath.relpath(hashed, BUILD_DIR))
+    if path in VENDOR_ASSETS and not os.path.exists(os.path.join(current_app.static_folder, path)):
+        if path not in state['missing']:
+            state['missing'].add(path)
+            logger.warning("%s is not vendored; loading it from %s (run `python manage.py vendor-assets`)",
+                           path, VENDOR_ASSETS[path])
+        return VENDOR_ASSETS[path]
+    return url_for('static', filename=path)
+
+
+def serve_asset(filename):
+    """Serve a hashed asset, precompressed if the client accepts it"""
+    build_dir = os.path.join(current_app.static_folder, BUILD_DIR)
+    path = safe_join(build_dir, filename)
+    if path is None or not os.path.isfile(path) or filename == MANIFEST_NAME:
+        raise NotFound()
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    served, encoding = filename, None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            served, encoding = filename + suffix, candidate
+            break
+
+    response = send_from_directory(build_dir, served, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response):
+    """Gzip a dynamic HTML or JSON response for clients that accept it"""
+    if response.status_code == 304:
+        # Keep the validator the same as on the compressed 200 it stands for
+        if request.endpoint not in ('static', 'serve_asset') and request.accept_encodings['gzip']:
+            _weaken_etag(response)
+        return response
+    if (not COMPRESS_RESPONSES or response.status_code < 200 or response.status_code >= 300
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    _weaken_etag(response)
+    return response
+
+
+def _weaken_etag(response):
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def init_app(app):
+    """Add asset_url() to templates, the /assets/ route and response compression"""
+    missing = missing_vendor_assets(app.static_folder)
+    if missing:
+        # Once here rather than per path on the first page that links them
+        logger.warning("%d vendored assets are missing, so pages load them from their CDNs "
+                       "(run `python manage.py vendor-assets`): %s", len(missing), ', '.join(missing))
+    app.extensions['assets'] = {'manifest': load_manifest(app.static_folder), 'missing': set(missing)}
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.add_url_rule('/assets/<path:filename>', 'serve_asset', serve_asset)
+    app.after_request(compress_response)
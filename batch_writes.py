@@ -0,0 +1,221 @@
+"""
+Batched expense writes: many creates, updates and deletes in one transaction.
+
+Used by ``POST /expenses/api/batch`` for scripted clients and mobile sync, which
+send hundreds of changes at once. Every operation is validated before anything is
+written; if any is invalid, none are applied and the result of each one says why.
+A valid batch is written with one ``executemany`` per kind of statement inside a
+single ``BEGIN IMMEDIATE`` transaction, so the whole batch costs one commit (one
+fsync) instead of one per row.
+
+An operation is a dict with ``op`` set to:
+    create  amount, expense_type_id and date are required; description,
+            recurring_interval and recurring_day are optional (as in /add_expense)
+    update  id plus any of the fields above; the others keep their values
+    delete  id; a soft delete, like /expenses/delete
+
+Updates and deletes only apply to active expenses, and each id may appear once per
+batch. Operations are applied deletes first, then updates, then creates, which
+gives the same result as applying them in order because no two touch the same row.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from metadata_cache import get_expense_type_names
+from money import to_cents
+
+# Operations accepted in one request
+MAX_BATCH_OPERATIONS = 1000
+
+OPERATIONS = ('create', 'update', 'delete')
+RECURRING_INTERVALS = ('none', 'monthly', 'biannual', 'yearly')
+
+# Fields a create or update may set, in column order
+EXPENSE_FIELDS = ('amount', 'description', 'expense_type_id', 'date', 'recurring_interval', 'recurring_day')
+
+# The error of valid operations in a rejected batch
+NOT_APPLIED = 'Not applied: another operation in the batch is invalid'
+
+BatchResult = namedtuple('BatchResult', [
+    'results',  # one dict per operation, in request order
+    'applied',  # False if the batch was rejected and nothing was written
+])
+
+
+class BatchOperationError(ValueError):
+    """A single operation of a batch is invalid"""
+
+
+def _expense_id(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit():
+        raise BatchOperationError(f"Invalid expense ID '{value}'")
+    return int(value)
+
+
+def _validate_fields(operation, expense_type_names):
+    """The expense columns an operation sets, validated and converted for storage"""
+    fields = {}
+    if 'amount' in operation:
+        try:
+            fields['amount'] = to_cents(operation['amount'])
+        except ValueError as e:
+            raise BatchOperationError(str(e))
+    if 'description' in operation:
+        description = operation['description']
+        if description is not None and not isinstance(description, str):
+            raise BatchOperationError('Description must be a string')
+        fields['description'] = description
+    if 'expense_type_id' in operation:
+        try:
+            expense_type_id = int(operation['expense_type_id'])
+        except (TypeError, ValueError):
+            expense_type_id = None
+        if expense_type_id not in expense_type_names:
+            raise BatchOperationError(f"Unknown expense type '{operation['expense_type_id']}'")
+        fields['expense_type_id'] = expense_type_id
+    if 'date' in operation:
+        try:
+            fields['date'] = datetime.strptime(str(operation['date']), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            raise BatchOperationError(f"Invalid date '{operation['date']}', use YYYY-MM-DD")
+
+    if 'recurring_interval' in operation:
+        interval = operation['recurring_interval'] or 'none'
+        if interval not in RECURRING_INTERVALS:
+            raise BatchOperationError(f"Invalid recurring interval '{interval}'")
+        fields['recurring_interval'] = interval
+        # Only monthly recurrences have a day; it defaults to the day of the date
+        if interval != 'monthly':
+            fields['recurring_day'] = None
+        elif operation.get('recurring_day') is not None:
+            try:
+                fields['recurring_day'] = int(operation['recurring_day'])
+            except (TypeError, ValueError):
+                raise BatchOperationError(f"Invalid recurring day '{operation['recurring_day']}'")
+            if not 1 <= fields['recurring_day'] <= 31:
+                raise BatchOperationError('Recurring day must be between 1 and 31')
+        elif 'date' in fields:
+            fields['recurring_day'] = int(fields['date'][8:])
+    return fields
+
+
+def _validate(operation, expense_type_names):
+    """Check one operation; returns (op, expense id or None, fields)"""
+    if not isinstance(operation, dict):
+        raise BatchOperationError('Each operation must be an object')
+    op = operation.get('op')
+    if op not in OPERATIONS:
+        raise BatchOperationError(f"Unknown operation '{op}', use one of {', '.join(OPERATIONS)}")
+
+    if op == 'delete':
+        return op, _expense_id(operation.get('id')), {}
+
+    fields = _validate_fields(operation, expense_type_names)
+    if op == 'create':
+        missing = [name for name in ('amount', 'expense_type_id', 'date') if name not in fields]
+        if missing:
+            raise BatchOperationError(f"Missing required fields: {', '.join(missing)}")
+        fields.setdefault('description', None)
+        fields.setdefault('recurring_interval', 'none')
+        fields.setdefault('recurring_day', None)
+        return op, None, fields
+
+    if not fields:
+        raise BatchOperationError('Nothing to update')
+    return op, _expense_id(operation.get('id')), fields
+
+
+def apply_batch(conn, operations):
+    """Validate a list of operations and apply them in one transaction
+
+    Args:
+        conn: Database connection with no transaction open
+        operations: List of operation dicts (see the module docstring)
+
+    Returns:
+        BatchResult. Each result has index, op and success, plus the expense id
+        (for a create, the new one) or the error. If any operation is invalid,
+        nothing is written and ``applied`` is False.
+    """
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f'At most {MAX_BATCH_OPERATIONS} operations can be sent at once')
+    if conn.in_transaction:
+        raise RuntimeError('apply_batch() needs a connection without an open transaction')
+
+    expense_type_names = get_expense_type_names(conn)
+    results, validated = [], []
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        try:
+            op, expense_id, fields = _validate(operation, expense_type_names)
+        except BatchOperationError as e:
+            results.append({'index': index, 'op': op, 'success': False, 'error': str(e)})
+            validated.append(None)
+            continue
+        results.append({'index': index, 'op': op, 'success': True, 'id': expense_id})
+        validated.append((op, expense_id, fields))
+
+    # Each row may only be touched once, so the order of the statements doesn't matter
+    seen = set()
+    for result, item in zip(results, validated):
+        if item and item[1] is not None:
+            if item[1] in seen:
+                result.update(success=False, error=f'Expense {item[1]} appears more than once in the batch')
+            seen.add(item[1])
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Checked under the write lock, so the rows can't be deleted before we write
+        if seen:
+            placeholders = ', '.join('?' * len(seen))
+            active = {row[0] for row in conn.execute(
+                f'SELECT id FROM expenses WHERE id IN ({placeholders}) AND is_active = TRUE', list(seen)
+            )}
+            for result, item in zip(results, validated):
+                if result['success'] and item[1] is not None and item[1] not in active:
+                    result.update(success=False, error=f'No active expense with ID {item[1]}')
+
+        if not all(result['success'] for result in results):
+            conn.rollback()
+            for result in results:
+                if result['success']:
+                    result.update(success=False, error=NOT_APPLIED)
+            return BatchResult(results, False)
+
+        deletes = [(expense_id,) for op, expense_id, _ in validated if op == 'delete']
+        if deletes:
+            conn.executemany('UPDATE expenses SET is_active = FALSE WHERE id = ?', deletes)
+
+        # Updates setting the same columns share one statement
+        updates = {}
+        for op, expense_id, fields in validated:
+            if op == 'update':
+                columns = tuple(name for name in EXPENSE_FIELDS if name in fields)
+                updates.setdefault(columns, []).append(tuple(fields[name] for name in columns) + (expense_id,))
+        for columns, rows in updates.items():
+            assignments = ', '.join(f'{name} = ?' for name in columns)
+            conn.executemany(f'UPDATE expenses SET {assignments} WHERE id = ?', rows)
+
+        creates = [index for index, item in enumerate(validated) if item[0] == 'create']
+        if creates:
+            conn.executemany('''
+                INSERT INTO expenses (amount, description, expense_type_id, date,
+                                      recurring_interval, recurring_day, is_recurring_template)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                tuple(validated[index][2][name] for name in EXPENSE_FIELDS)
+                + (validated[index][2]['recurring_interval'] != 'none',)
+                for index in creates
+            ])
+            # AUTOINCREMENT hands out consecutive ids, and we hold the write lock,
+            # so the new rows are the last len(creates) ids, in insertion order
+            last_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'expenses'").fetchone()[0]
+            for offset, index in enumerate(creates):
+                results[index]['id'] = last_id - len(creates) + 1 + offset
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return BatchResult(results, True)
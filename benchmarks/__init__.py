@@ -0,0 +1,11 @@
+"""
+Benchmarks for the Spending Tracker's hot routes and helpers.
+
+    python -m benchmarks.run --scale small medium --output results.json
+    python -m benchmarks.run --scale medium --compare results.json
+    python -m benchmarks.throughput --scale small
+
+See benchmarks/fixtures.py for the synthetic datasets and benchmarks/run.py for the
+cases and the JSON report format. benchmarks/throughput.py compares the
+development server with serve.py over real HTTP.
+"""
@@ -0,0 +1,176 @@
+"""
+Deterministic synthetic databases for the benchmarks.
+
+Each scale is built with the real schema from ``setup_db.create_database`` and then
+filled from a seeded random generator, so the same scale and seed always produce
+the same rows. Built fixtures are kept in a cache directory and reused by later runs.
+"""
+
+import contextlib
+import io
+import os
+import random
+import sqlite3
+
+from recurrence import expand_occurrences, load_templates
+from setup_db import create_database
+
+# Bump when the generated data changes so stale cached fixtures are rebuilt
+FIXTURE_VERSION = 3
+
+# The ten years the data covers (months.year must be >= 2020)
+FIRST_YEAR = 2020
+YEARS = 10
+
+# expenses: regular expense rows; templates: recurring templates (each also an expense)
+SCALES = {
+    'small': {'expenses': 1_000, 'templates': 20},
+    'medium': {'expenses': 100_000, 'templates': 200},
+    'large': {'expenses': 5_000_000, 'templates': 500},
+}
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.fixtures')
+
+# Rows per executemany() call / transaction while building
+_BATCH_SIZE = 50_000
+
+_DESCRIPTIONS = (
+    'Coffee', 'Lunch', 'Groceries run', 'Fuel', 'Movie tickets', 'Pharmacy', 'Books',
+    'Hardware store', 'Takeout', 'Parking', 'Online order', 'Gift', 'Haircut', None,
+)
+
+_INTERVALS = ('monthly', 'monthly', 'monthly', 'biannual', 'yearly')
+
+
+def fixture_path(scale, seed=0, cache_dir=DEFAULT_CACHE_DIR):
+    """Path of the cached fixture database for a scale and seed"""
+    return os.path.join(cache_dir, f'{scale}-seed{seed}-v{FIXTURE_VERSION}.db')
+
+
+def _months():
+    """(year, month) for every month the fixture covers, oldest first"""
+    return [(FIRST_YEAR + i // 12, i % 12 + 1) for i in range(YEARS * 12)]
+
+
+def _batched(rows, size=_BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _regular_expenses(rng, count, type_ids):
+    """Generate (amount, description, expense_type_id, date) for regular expenses"""
+    months = _months()
+    for _ in range(count):
+        year, month = months[rng.randrange(len(months))]
+        yield (
+            round(rng.lognormvariate(3.0, 1.0) * 100),
+            rng.choice(_DESCRIPTIONS),
+            rng.choice(type_ids),
+            f'{year:04d}-{month:02d}-{rng.randint(1, 28):02d}',
+        )
+
+
+def populate(conn, expenses, templates, seed=0):
+    """Fill a freshly created database with deterministic data
+
+    Creates a months row for every month in the fixture range, ``templates``
+    recurring templates dated in the first year, their instances in every month
+    (as month creation would), and ``expenses`` regular expenses spread uniformly.
+    """
+    rng = random.Random(seed)
+    type_ids = [row[0] for row in conn.execute('SELECT id FROM expense_types ORDER BY id')]
+
+    # setup_db seeds the current month; replace it with the fixture's range
+    conn.execute('DELETE FROM months')
+    conn.executemany(
+        'INSERT INTO months (month, year, starting_bank_value, monthly_income) VALUES (?, ?, ?, ?)',
+        [(month, year, 500000, 400000) for year, month in _months()]
+    )
+
+    conn.executemany('''
+        INSERT INTO expenses (amount, description, expense_type_id, date,
+                              recurring_interval, recurring_day, is_recurring_template)
+        VALUES (?, ?, ?, ?, ?, ?, TRUE)
+    ''', [
+        (
+            round(rng.uniform(5, 500) * 100),
+            f'Recurring #{i}',
+            rng.choice(type_ids),
+            f'{FIRST_YEAR:04d}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            interval,
+            rng.randint(1, 31) if interval == 'monthly' and rng.random() < 0.5 else None,
+        )
+        for i, interval in ((i, rng.choice(_INTERVALS)) for i in range(templates))
+    ])
+    conn.commit()
+
+    # Instances for every month, the way month creation generates them
+    month_ids = {(row[1], row[2]): row[0] for row in conn.execute('SELECT id, year, month FROM months')}
+    occurrences = expand_occurrences(load_templates(conn), _months(), skip_origin_month=True)
+    conn.executemany('''
+        INSERT INTO recurring_expense_instances
+        (expense_id, month_id, instance_date, amount, description, expense_type_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (occ.template.id, month_ids[(occ.year, occ.month)], occ.date,
+         occ.template.amount, occ.template.description, occ.template.expense_type_id)
+        for ym in _months() for occ in occurrences[ym]
+    ])
+    conn.commit()
+
+    for batch in _batched(_regular_expenses(rng, expenses, type_ids)):
+        conn.executemany('''
+            INSERT INTO expenses (amount, description, expense_type_id, date,
+                                  recurring_interval, recurring_day, is_recurring_template)
+            VALUES (?, ?, ?, ?, 'none', NULL, FALSE)
+        ''', batch)
+        conn.commit()
+
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
+def build_fixture(scale, seed=0, cache_dir=DEFAULT_CACHE_DIR, rebuild=False):
+    """Return the path of the fixture database for a scale, building it if needed
+
+    Args:
+        scale: A key of SCALES
+        seed: Random seed; the same scale and seed always give the same data
+        cache_dir: Directory the built databases are kept in
+        rebuild: Build again even if a cached fixture exists
+    """
+    path = fixture_path(scale, seed, cache_dir)
+    if os.path.exists(path) and not rebuild:
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    building = path + '.building'
+    for leftover in (building + '-wal', building + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    # create_database() reports what it did; keep benchmark output clean
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_database(building, reset=True)
+
+    conn = sqlite3.connect(building)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.row_factory = sqlite3.Row
+    try:
+        populate(conn, seed=seed, **SCALES[scale])
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+    # Only a completely built fixture gets the cached name
+    os.replace(building, path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(building + suffix):
+            os.remove(building + suffix)
+    return path
@@ -0,0 +1,199 @@
+"""
+Read throughput while a write-heavy job runs, with and without the read-only pool.
+
+Usage:
+    python -m benchmarks.read_scaling [--scale small] [--threads 2 4 8 16] [--modes shared split]
+                                      [--duration SECONDS] [--clients N] [--client-processes N]
+                                      [--writers N] [--write-rows N] [--output FILE]
+
+For every thread count T, ``serve.py --workers 1 --threads T`` is started twice, each
+time on a fresh copy of the fixture database:
+
+``split``   GET requests read through the read-only pool and everything else goes
+            through the one-connection writer pool (the default)
+``shared``  every request uses one pool of T read-write connections, as before the
+            pools were split (SPENDING_TRACKER_DB_READ_POOL=0)
+
+While ``--clients`` connections cycle through the hot pages, a separate process keeps
+writing ``--write-rows`` expenses per transaction (like an import or /seed_data)
+and ``--writers`` clients POST batches to /expenses/api/batch. Reads per second
+and read latency are reported with the writes that got through.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+# Make the repository's top-level modules importable when run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import DEFAULT_CACHE_DIR, FIRST_YEAR, SCALES, build_fixture
+from benchmarks.run import PERCENTILES, git_revision, percentile
+from benchmarks.throughput import free_port, generate_load, route_urls, start_server, stop_server
+
+MODES = {
+    'split': {},
+    'shared': {'SPENDING_TRACKER_DB_READ_POOL': '0'},
+}
+
+# Expenses created by each POSTed batch
+POST_BATCH_SIZE = 50
+
+
+def write_job(path, deadline, rows):
+    """Write ``rows`` expenses per transaction until the deadline; returns the transactions"""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode = WAL')
+    expense_type_id = conn.execute('SELECT MIN(id) FROM expense_types').fetchone()[0]
+    date = f'{FIRST_YEAR + 5}-06-15'
+    transactions = 0
+    while time.monotonic() < deadline:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(
+            'INSERT INTO expenses (amount, description, expense_type_id, date) VALUES (?, ?, ?, ?)',
+            [(1000 + i, 'Write job', expense_type_id, date) for i in range(rows)],
+        )
+        conn.commit()
+        transactions += 1
+    conn.close()
+    return transactions
+
+
+def _post_writer(port, expense_type_id, deadline, results):
+    """POST batches of creates over one keep-alive connection until the deadline"""
+    body = json.dumps([
+        {'op': 'create', 'amount': 12.5, 'expense_type_id': expense_type_id,
+         'date': f'{FIRST_YEAR + 5}-06-20', 'description': 'Posted batch'}
+    ] * POST_BATCH_SIZE)
+    ok = errors = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.monotonic() < deadline:
+        try:
+            conn.request('POST', '/expenses/api/batch', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        if response.status == 200:
+            ok += 1
+        else:
+            errors += 1
+    conn.close()
+    results.append((ok, errors))
+
+
+def benchmark_run(mode, threads, fixture, args):
+    """One server configuration under the read and write load"""
+    workdir = tempfile.mkdtemp(prefix='read-scaling-')
+    path = os.path.join(workdir, 'db.sqlite')
+    shutil.copy(fixture, path)
+    with sqlite3.connect(path) as conn:
+        expense_type_id = conn.execute('SELECT MIN(id) FROM expense_types').fetchone()[0]
+
+    env = dict(MODES[mode])
+    if mode == 'shared':
+        env['SPENDING_TRACKER_DB_WRITE_POOL_SIZE'] = str(threads)
+    port = free_port()
+    urls = route_urls(path)
+    process = start_server(f'1x{threads}', port, path, page_cache=False, env=env)
+    try:
+        generate_load(port, urls, args.clients, args.client_processes, args.warmup)
+
+        deadline = time.monotonic() + args.duration
+        post_results = []
+        posters = [threading.Thread(target=_post_writer, args=(port, expense_type_id, deadline, post_results))
+                   for _ in range(args.writers)]
+        with ProcessPoolExecutor(1) as executor:
+            job = executor.submit(write_job, path, deadline, args.write_rows)
+            for poster in posters:
+                poster.start()
+            latencies, errors = generate_load(port, urls, args.clients, args.client_processes, args.duration)
+            for poster in posters:
+                poster.join()
+            transactions = job.result()
+    finally:
+        stop_server(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    stats = {f'p{pct}_ms': round(percentile(latencies, pct), 2) if latencies else None
+             for pct in PERCENTILES}
+    stats.update(
+        mode=mode,
+        threads=threads,
+        reads=len(latencies),
+        read_errors=errors,
+        reads_per_second=round(len(latencies) / args.duration, 1),
+        write_job_transactions=transactions,
+        posted_batches=sum(ok for ok, _ in post_results),
+        post_errors=sum(failed for _, failed in post_results),
+    )
+    print(f"{mode:>6} 1x{threads:<3} {stats['reads_per_second']:>8.1f} reads/s  p50 {stats['p50_ms']:>8} ms  "
+          f"p99 {stats['p99_ms']:>8} ms  {errors} read errors  {transactions} job transactions  "
+          f"{stats['posted_batches']} batches ({stats['post_errors']} failed)", file=sys.stderr)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure read scaling under a write-heavy load')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='fixture scale (default: small)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[2, 4, 8, 16],
+                        help='server thread counts to run (default: 2 4 8 16)')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['shared', 'split'],
+                        help='pool configurations to compare')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds per run first')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent reading connections')
+    parser.add_argument('--client-processes', type=int, default=2, help='processes the readers run in')
+    parser.add_argument('--writers', type=int, default=2, help='clients POSTing write batches')
+    parser.add_argument('--write-rows', type=int, default=5000,
+                        help='expenses written per transaction by the write job')
+    parser.add_argument('--seed', type=int, default=0, help='fixture random seed')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where fixture databases are kept')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    args = parser.parse_args(argv)
+
+    fixture = build_fixture(args.scale, seed=args.seed, cache_dir=args.cache_dir)
+    print(f"Fixture {args.scale}: {fixture}; {args.clients} readers, {args.writers} POST writers, "
+          f"{args.write_rows} rows per job transaction, {os.cpu_count()} CPUs", file=sys.stderr)
+
+    results = [benchmark_run(mode, threads, fixture, args)
+               for threads in args.threads for mode in args.modes]
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+            'scale': args.scale,
+            'clients': args.clients,
+            'writers': args.writers,
+            'write_rows': args.write_rows,
+            'duration': args.duration,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
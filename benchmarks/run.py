@@ -0,0 +1,260 @@
+"""
+Run the benchmark suite and write the results as JSON.
+
+Usage:
+    python -m benchmarks.run [--scale small medium ...] [--iterations N] [--output FILE]
+                             [--compare BASELINE.json] [--seed N] [--rebuild] [--page-cache]
+
+For every scale a fixture database is built (or reused), the hot routes are driven
+through Flask's test client and the helpers are called directly. Each case reports
+latency percentiles, SQL statements per call and peak Python memory.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# Make the repository's top-level modules importable when run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import DEFAULT_CACHE_DIR, FIRST_YEAR, SCALES, build_fixture
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class QueryCounter:
+    """Counts SQL statements run on a connection via its trace callback"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        # Statements run by triggers are reported as '-- TRIGGER ...' comments
+        if not statement.lstrip().startswith('--'):
+            self.count += 1
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def measure(func, iterations, warmup, counter):
+    """Time ``func`` and return latency, query and memory statistics"""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        counter.count = 0
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+
+    # Memory is measured in a separate call; tracemalloc would distort the timings
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    stats = {f'p{pct}_ms': round(percentile(timings, pct), 3) for pct in PERCENTILES}
+    stats.update(
+        iterations=iterations,
+        mean_ms=round(sum(timings) / len(timings), 3),
+        min_ms=round(timings[0], 3),
+        max_ms=round(timings[-1], 3),
+        queries_per_call=round(sum(queries) / len(queries), 2),
+        peak_memory_kb=round(peak / 1024, 1),
+    )
+    return stats
+
+
+def route_case(client, url):
+    """Benchmark case that GETs a URL and fails loudly on an error response"""
+    def call():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url} returned {response.status_code}')
+        response.get_data()
+    return call
+
+
+def benchmark_scale(scale, path, args):
+    """Run every case against one scale's fixture database"""
+    import db
+    import metadata_cache
+    import response_cache
+
+    from app import create_app
+    from templateLogic.expense_routes import get_recurring_expenses_for_months
+    from utils import calculate_total_expenses
+
+    # One connection per pool, so every request runs on a traced connection
+    app = create_app({'DATABASE': path, 'DB_POOL_SIZE': 1, 'DB_WRITE_POOL_SIZE': 1,
+                      'SECRET_KEY': 'benchmark', 'TESTING': True})
+    metadata_cache.invalidate()
+    counter = QueryCounter()
+    for pool in (db.get_pool(), db.get_pool(read_only=True)):
+        conn = pool.acquire()
+        conn.set_trace_callback(counter)
+        pool.release(conn)
+
+    # A busy month in the middle of the range
+    year, month = FIRST_YEAR + 5, 6
+    with db.pooled_connection() as conn:
+        month_id = conn.execute('SELECT id FROM months WHERE year = ? AND month = ?', (year, month)).fetchone()[0]
+        expense_count = conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+        instance_count = conn.execute('SELECT COUNT(*) FROM recurring_expense_instances').fetchone()[0]
+
+    # Repeating the same request would otherwise only measure rendered-page cache hits
+    response_cache.CACHE_ENABLED = args.page_cache
+    response_cache.cache.clear()
+
+    client = app.test_client()
+    cases = {
+        'index': route_case(client, f'/?current_month_id={month_id}'),
+        'view_expenses': route_case(client, f'/expenses/view?month_id={month_id}'),
+        'view_expenses_sorted_page': route_case(
+            client, f'/expenses/view?month_id={month_id}&sort_by=amount&sort_order=asc&page=3'),
+        'view_expenses_type_filter': route_case(
+            client, f'/expenses/view?month_id={month_id}&expense_type_id=7'),
+        'list_months': route_case(client, '/month/months'),
+        'expense_summary_api': route_case(client, f'/expenses/api/summary?month_id={month_id}'),
+        'analytics_10_years': route_case(client, f'/analytics?start={FIRST_YEAR}-01&end={FIRST_YEAR + 9}-12'),
+        'analytics_10_years_by_type': route_case(
+            client, f'/analytics?start={FIRST_YEAR}-01&end={FIRST_YEAR + 9}-12&by_type=1'),
+        'search_common_term': route_case(client, '/expenses/search?q=coffee'),
+        'search_rare_term': route_case(client, '/expenses/search?q=Recurring+%2342'),
+        'search_filtered': route_case(
+            client, f'/expenses/search?q=groc&start_date={year}-{month:02d}-01&end_date={year}-{month:02d}-28'),
+    }
+
+    def total_expenses():
+        with db.pooled_connection() as conn:
+            calculate_total_expenses(month, year, conn)
+
+    def recurring_year():
+        with db.pooled_connection() as conn:
+            get_recurring_expenses_for_months(conn, [(year, m) for m in range(1, 13)])
+
+    cases['calculate_total_expenses'] = total_expenses
+    cases['recurring_expenses_12_months'] = recurring_year
+
+    results = []
+    for name, func in cases.items():
+        if args.case and name not in args.case:
+            continue
+        stats = measure(func, args.iterations, args.warmup, counter)
+        stats.update(scale=scale, case=name)
+        results.append(stats)
+        print(f"{scale:>8} {name:<30} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+              f"{stats['queries_per_call']:>6} queries  {stats['peak_memory_kb']:>9.1f} KB", file=sys.stderr)
+
+    db.get_pool().close_all()
+    db.get_pool(read_only=True).close_all()
+    fixture = {'scale': scale, 'path': path, 'expenses': expense_count,
+               'recurring_instances': instance_count}
+    return fixture, results
+
+
+def git_revision():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, results):
+    """Print the p50/p95 change of every case against a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {(r['scale'], r['case']): r for r in json.load(f)['results']}
+
+    print(f"\nCompared with {baseline_path}:", file=sys.stderr)
+    for result in results:
+        before = baseline.get((result['scale'], result['case']))
+        if before is None:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'queries_per_call'):
+            if before[key]:
+                changes.append(f"{key} {result[key] / before[key]:.2f}x")
+        print(f"{result['scale']:>8} {result['case']:<30} " + '  '.join(changes), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes and helpers')
+    parser.add_argument('--scale', nargs='+', choices=sorted(SCALES), default=['small', 'medium'],
+                        help='fixture scales to run (default: small medium)')
+    parser.add_argument('--case', nargs='+', help='only run these cases')
+    parser.add_argument('--iterations', type=int, default=30, help='timed calls per case')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed calls per case first')
+    parser.add_argument('--seed', type=int, default=0, help='fixture random seed')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where fixture databases are kept')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild fixtures even if cached')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='leave the rendered-page cache on (measures cache hits for the routes)')
+    parser.add_argument('--output', help='write the JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='previous results file to compare with')
+    args = parser.parse_args(argv)
+
+    paths = {}
+    for scale in args.scale:
+        started = time.perf_counter()
+        paths[scale] = build_fixture(scale, seed=args.seed, cache_dir=args.cache_dir, rebuild=args.rebuild)
+        print(f"Fixture {scale}: {paths[scale]} ({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+
+    fixtures, results = [], []
+    for scale in args.scale:
+        fixture, scale_results = benchmark_scale(scale, paths[scale], args)
+        fixtures.append(fixture)
+        results.extend(scale_results)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'seed': args.seed,
+            'page_cache': args.page_cache,
+        },
+        'fixtures': fixtures,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(args.compare, results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Throughput of the real HTTP servers on the project's own routes.
+
+Usage:
+    python -m benchmarks.throughput [--scale small] [--duration SECONDS] [--clients N]
+                                    [--client-processes N] [--serve 1x8 2x4 ...]
+                                    [--no-dev] [--page-cache] [--output FILE]
+
+Each configuration is started as a separate server process on a fixture database:
+``dev`` is ``app.run(debug=True)`` (Flask's development server, reloader off) and
+``WxT`` is ``serve.py --workers W --threads T``. Client processes then keep
+``--clients`` keep-alive connections busy for ``--duration`` seconds, cycling through
+the hot pages, and the requests per second and latency percentiles are reported.
+
+The rendered-page cache is off by default so every request renders; clients and
+servers share the machine, so compare configurations from the same run.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Make the repository's top-level modules importable when run as a script
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fixtures import DEFAULT_CACHE_DIR, FIRST_YEAR, SCALES, build_fixture
+from benchmarks.run import PERCENTILES, git_revision, percentile
+
+DEV_SERVER = ('from app import create_app; '
+              'create_app().run(host="127.0.0.1", port={port}, debug=True, use_reloader=False)')
+
+# Seconds to wait for a server to answer its first request
+STARTUP_TIMEOUT = 60
+
+
+def route_urls(path):
+    """The pages requested, for a busy month in the middle of the fixture"""
+    with sqlite3.connect(path) as conn:
+        month_id = conn.execute('SELECT id FROM months WHERE year = ? AND month = ?',
+                                (FIRST_YEAR + 5, 6)).fetchone()[0]
+    return [
+        f'/?current_month_id={month_id}',
+        f'/expenses/view?month_id={month_id}',
+        f'/expenses/view?month_id={month_id}&sort_by=amount&sort_order=asc&page=3',
+        '/month/months',
+        f'/expenses/api/summary?month_id={month_id}',
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(config, port, path, page_cache, env=None):
+    """Start a server process for a configuration ('dev' or 'WxT'), with extra environment variables"""
+    env = dict(os.environ,
+               SPENDING_TRACKER_DB=path,
+               SPENDING_TRACKER_PAGE_CACHE='1' if page_cache else '0',
+               SPENDING_TRACKER_LOG_LEVEL='WARNING',
+               SPENDING_TRACKER_SECRET_KEY='benchmark',
+               **(env or {}))
+    if config == 'dev':
+        command = [sys.executable, '-c', DEV_SERVER.format(port=port)]
+    else:
+        workers, threads = config.split('x')
+        command = [sys.executable, os.path.join(ROOT, 'serve.py'), '--port', str(port),
+                   '--workers', workers, '--threads', threads]
+    # The dev server logs every request to stderr
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/month/months', timeout=5).read()
+            return process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                stop_server(process)
+                raise RuntimeError(f'Server {config} did not start')
+            time.sleep(0.2)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _client_thread(port, urls, offset, deadline):
+    """Request urls in turn over one keep-alive connection until the deadline"""
+    latencies, errors = [], 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    i = offset
+    while time.monotonic() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', url)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        if response.status != 200:
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return latencies, errors
+
+
+def _client_process(port, urls, threads, offset, deadline):
+    """Run ``threads`` client connections in one process"""
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(_client_thread, port, urls, offset + i, deadline)
+                   for i in range(threads)]
+        latencies, errors = [], 0
+        for future in futures:
+            thread_latencies, thread_errors = future.result()
+            latencies.extend(thread_latencies)
+            errors += thread_errors
+    return latencies, errors
+
+
+def generate_load(port, urls, clients, processes, duration):
+    """Keep ``clients`` connections busy for ``duration`` seconds"""
+    processes = min(processes, clients)
+    deadline = time.monotonic() + duration
+    latencies, errors = [], 0
+    with ProcessPoolExecutor(processes) as executor:
+        futures = []
+        for i in range(processes):
+            threads = clients // processes + (i < clients % processes)
+            futures.append(executor.submit(_client_process, port, urls, threads, i * clients, deadline))
+        for future in futures:
+            process_latencies, process_errors = future.result()
+            latencies.extend(process_latencies)
+            errors += process_errors
+    return latencies, errors
+
+
+def benchmark_config(config, path, urls, args):
+    port = free_port()
+    process = start_server(config, port, path, args.page_cache)
+    try:
+        # Warm up connections, caches and the SQLite page cache
+        generate_load(port, urls, args.clients, args.client_processes, args.warmup)
+        latencies, errors = generate_load(port, urls, args.clients, args.client_processes, args.duration)
+    finally:
+        stop_server(process)
+
+    latencies.sort()
+    stats = {f'p{pct}_ms': round(percentile(latencies, pct), 2) if latencies else None
+             for pct in PERCENTILES}
+    stats.update(
+        config=config,
+        requests=len(latencies),
+        errors=errors,
+        requests_per_second=round(len(latencies) / args.duration, 1),
+    )
+    print(f"{config:>6} {stats['requests_per_second']:>8.1f} req/s  p50 {stats['p50_ms']:>8} ms  "
+          f"p99 {stats['p99_ms']:>8} ms  {errors} errors", file=sys.stderr)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare server throughput on the hot routes')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='fixture scale (default: small)')
+    parser.add_argument('--serve', nargs='+', default=['1x8', '2x4', '4x4'], metavar='WxT',
+                        help='serve.py workers x threads to run (default: 1x8 2x4 4x4)')
+    parser.add_argument('--no-dev', action='store_true', help="skip the development server")
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per configuration')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds per configuration first')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client connections')
+    parser.add_argument('--client-processes', type=int, default=2, help='processes the clients run in')
+    parser.add_argument('--seed', type=int, default=0, help='fixture random seed')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='where fixture databases are kept')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='leave the rendered-page cache on (measures cache hits)')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    args = parser.parse_args(argv)
+
+    for config in args.serve:
+        workers, _, threads = config.partition('x')
+        if not (workers.isdigit() and threads.isdigit()):
+            parser.error(f"--serve takes WORKERSxTHREADS, not '{config}'")
+
+    path = build_fixture(args.scale, seed=args.seed, cache_dir=args.cache_dir)
+    urls = route_urls(path)
+    configs = ([] if args.no_dev else ['dev']) + args.serve
+    print(f"Fixture {args.scale}: {path}; {args.clients} clients, {args.duration:g}s per configuration, "
+          f"{os.cpu_count()} CPUs", file=sys.stderr)
+
+    results = [benchmark_config(config, path, urls, args) for config in configs]
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': args.scale,
+            'clients': args.clients,
+            'duration': args.duration,
+            'page_cache': args.page_cache,
+            'urls': urls,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
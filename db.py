@@ -0,0 +1,391 @@
+"""
+Shared SQLite connection management for the Spending Tracker.
+
+Every route and helper gets its connection from here instead of opening its own.
+Inside a request the connection is bound to ``flask.g`` so that all blueprints and
+helpers such as ``calculate_total_expenses`` share one connection per request; it is
+handed back to a bounded pool when the app context is torn down. Code running outside
+a request (CLI commands, worker threads) borrows from the same pool through
+``pooled_connection()``. A forked worker process starts with a fresh, empty pool.
+
+There are two pools per database. GET and HEAD requests read through read-only
+connections (``mode=ro`` URIs with ``PRAGMA query_only``) from a pool sized for the
+server's threads; in WAL mode they read the last committed snapshot and never wait
+for a writer. Every other request, and all code outside a request, uses the writer
+pool, which by default holds a single connection: SQLite only lets one connection
+write at a time anyway, so writers queue for the pool in the order they arrived
+instead of retrying against each other's locks, and a long write (``/seed_data``,
+an import) leaves the read pool free for the dashboards.
+
+With a router installed (``set_router``, see shards.py) each request's connection
+comes from the pool of the database its tenant is routed to instead.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from flask import g, has_app_context, has_request_context, request
+
+# Database configuration
+DB_NAME = 'spending_tracker.db'
+DB_PATH = os.environ.get('SPENDING_TRACKER_DB', os.path.join(os.path.dirname(__file__), DB_NAME))
+
+# Maximum number of open connections kept by the read pool, and by the writer pool
+POOL_SIZE = int(os.environ.get('SPENDING_TRACKER_DB_POOL_SIZE', '8'))
+WRITE_POOL_SIZE = int(os.environ.get('SPENDING_TRACKER_DB_WRITE_POOL_SIZE', '1'))
+
+# Set SPENDING_TRACKER_DB_READ_POOL=0 to serve GET requests from the writer pool too
+READ_POOL_ENABLED = os.environ.get('SPENDING_TRACKER_DB_READ_POOL', '1') != '0'
+
+# Requests served from the read-only pool
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+# Seconds a caller waits for a free pooled connection (and SQLite waits for a lock)
+BUSY_TIMEOUT = 5.0
+
+# Pragmas that configure the database file, which read-only connections can't change
+FILE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+)
+
+# Pragmas applied to every new connection
+PRAGMAS = FILE_PRAGMAS + (
+    'PRAGMA foreign_keys = ON',
+    f'PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}',
+    'PRAGMA cache_size = -20000',      # ~20 MB page cache per connection
+    'PRAGMA mmap_size = 268435456',    # 256 MB memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Read-only connections also refuse writes at the statement level
+READ_ONLY_PRAGMAS = PRAGMAS[len(FILE_PRAGMAS):] + ('PRAGMA query_only = ON',)
+
+
+# Called as observer(sql, seconds, statement_seconds, new_statement) for every
+# execute and fetch when instrumentation is on (see metrics.py); None turns it off
+_query_observer = None
+
+
+def set_query_observer(observer):
+    """Install (or with None, remove) the callable that is told about every statement"""
+    global _query_observer
+    _query_observer = observer
+
+
+class Cursor(sqlite3.Cursor):
+    """Cursor that reports statement and fetch times to the query observer.
+
+    SQLite does most of a query's work lazily while rows are fetched, so fetch calls
+    are timed too and added to the statement's running total. Rows read by iterating
+    over the cursor directly are not timed.
+    """
+
+    _sql = None
+    _statement_seconds = 0.0
+
+    def _report(self, sql, started, new_statement):
+        observer = _query_observer
+        if observer is None:
+            return
+        seconds = time.perf_counter() - started
+        if new_statement:
+            self._sql, self._statement_seconds = sql, seconds
+        else:
+            self._statement_seconds += seconds
+        observer(sql, seconds, self._statement_seconds, new_statement)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._report(sql, started, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._report(sql, started, True)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._report(sql_script, started, True)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._report(self._sql, started, False)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._report(self._sql, started, False)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._report(self._sql, started, False)
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that can carry per-connection state as attributes
+    (plain sqlite3.Connection objects accept neither attributes nor weak references).
+
+    While a query observer is installed, statements run through ``Cursor`` so they
+    can be counted and timed; otherwise the plain C implementation is used.
+    """
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = Cursor if _query_observer is not None else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if _query_observer is None:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if _query_observer is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        if _query_observer is None:
+            return super().executescript(sql_script)
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        observer = _query_observer
+        if observer is None:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            seconds = time.perf_counter() - started
+            observer('COMMIT', seconds, seconds, True)
+
+
+def connect(db_path=None, read_only=False):
+    """Open a new connection with row factory and the tuned pragmas applied
+
+    A read-only connection needs the database to exist already.
+    """
+    db_path = db_path or DB_PATH
+    if read_only:
+        uri = f'file:{urllib.request.pathname2url(os.path.abspath(db_path))}?mode=ro'
+        conn = sqlite3.connect(uri, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               factory=Connection, uri=True)
+    else:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               factory=Connection)
+    conn.row_factory = sqlite3.Row
+    # Which database this is, for caches that keep entries per database
+    conn.db_path = db_path
+    for pragma in READ_ONLY_PRAGMAS if read_only else PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """A bounded pool of SQLite connections that can be shared between threads.
+
+    Connections are created lazily up to ``max_size``. Once that many are checked out,
+    ``acquire()`` blocks until one is released or ``timeout`` seconds pass.
+    """
+
+    def __init__(self, db_path, max_size=POOL_SIZE, timeout=BUSY_TIMEOUT, read_only=False):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.read_only = read_only
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.closed = False
+
+    def acquire(self):
+        """Check out a connection, opening a new one if the pool has spare capacity"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(
+                f'Timed out waiting for a {"read-only" if self.read_only else "writer"} database '
+                f'connection (pool size {self.max_size})'
+            )
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect(self.db_path, self.read_only)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        try:
+            if self.closed:
+                conn.close()
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except sqlite3.Error:
+            # The connection is unusable (e.g. already closed); drop it
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Close every idle connection (checked-out connections are closed on release)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def close(self):
+        """Close the pool for good: idle connections now, checked-out ones on release"""
+        self.closed = True
+        self.close_all()
+
+
+_pool = ConnectionPool(DB_PATH, WRITE_POOL_SIZE)
+_read_pool = ConnectionPool(DB_PATH, POOL_SIZE, read_only=True)
+
+
+# Chooses the pool for each request when the data is sharded (see shards.py)
+_router = None
+
+
+def get_pool(read_only=False):
+    """Return the process-wide writer pool, or the read-only pool"""
+    return _read_pool if read_only else _pool
+
+
+def set_router(router):
+    """Route connections through ``router.pool_for_request(read_only)`` (None to stop)"""
+    global _router
+    if _router is not None and _router is not router:
+        _router.close_all()
+    _router = router
+
+
+def get_router():
+    """The installed shard router, or None"""
+    return _router
+
+
+def _current_pool(read_only=False):
+    if _router is not None:
+        return _router.pool_for_request(read_only)
+    return _read_pool if read_only else _pool
+
+
+# Pools inherited from the parent process, kept referenced so their connections are
+# never used or closed (finalized) in a forked child
+_inherited_pools = []
+
+
+def _reset_pool_after_fork():
+    """Give a forked child a fresh, empty pool for the same database.
+
+    SQLite connections must not cross a fork: the child would share the parent's
+    file descriptors and locks. Each worker process therefore opens its own.
+    """
+    global _pool, _read_pool
+    _inherited_pools.extend((_pool, _read_pool))
+    _pool = ConnectionPool(_pool.db_path, _pool.max_size, _pool.timeout)
+    _read_pool = ConnectionPool(_read_pool.db_path, _read_pool.max_size, _read_pool.timeout, read_only=True)
+    if _router is not None:
+        _router.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def configure(db_path=None, pool_size=None, write_pool_size=None):
+    """Point the connection subsystem at a different database file or pool sizes.
+
+    ``pool_size`` is the read pool's and ``write_pool_size`` the writer pool's. Used by
+    tests, benchmarks and the app factory. Idle connections to the previous database
+    are closed.
+    """
+    global _pool, _read_pool
+    _pool.close_all()
+    _read_pool.close_all()
+    db_path = db_path or _pool.db_path
+    _pool = ConnectionPool(db_path, write_pool_size or _pool.max_size)
+    _read_pool = ConnectionPool(db_path, pool_size or _read_pool.max_size, read_only=True)
+    return _pool
+
+
+def _read_only_request():
+    """Whether the current request only reads, and so gets a read-only connection"""
+    return READ_POOL_ENABLED and has_request_context() and request.method in READ_ONLY_METHODS
+
+
+def get_db_connection():
+    """Get the database connection for the current request.
+
+    The first call in a request checks a connection out of the pool and stores it on
+    ``flask.g``; later calls in the same request (from any blueprint or helper) get the
+    same connection back. It is returned to the pool by ``close_db_connection`` when
+    the app context is torn down, so callers must not close it themselves. GET and
+    HEAD requests get a read-only connection; others, and app contexts without a
+    request, get the writer's.
+    """
+    if 'db' not in g:
+        g.db_pool = _current_pool(_read_only_request())
+        g.db = g.db_pool.acquire()
+    return g.db
+
+
+def close_db_connection(exception=None):
+    """Teardown handler: roll back anything left uncommitted and release the connection"""
+    conn = g.pop('db', None)
+    pool = g.pop('db_pool', _pool)
+    if conn is not None:
+        pool.release(conn)
+
+
+@contextmanager
+def pooled_connection(read_only=False):
+    """Borrow a connection for code that may run outside a request.
+
+    Inside an app context this yields the request's connection; otherwise a connection
+    is checked out of the writer pool (or with ``read_only``, the read pool) for the
+    duration of the ``with`` block.
+    """
+    if has_app_context():
+        yield get_db_connection()
+        return
+
+    pool = _current_pool(read_only and READ_POOL_ENABLED)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def init_app(app):
+    """Register the connection teardown handler on the Flask app"""
+    app.teardown_appcontext(close_db_connection)
@@ -0,0 +1,233 @@
+"""
+Cash-flow forecast for the months after the latest month in the database.
+
+Future spending has three parts, all per expense type and in integer cents:
+- recurring: every active recurring template's occurrences (same rules as
+  recurrence.py; a template's own month is left out, where its row already counts)
+- scheduled: expenses already entered with a date in the forecast range
+- discretionary: the average non-recurring spending of the months in the
+  ``history`` months up to the latest one, with its standard deviation
+Income is the latest month's ``monthly_income`` unless another is given, and
+balances carry on from what the latest month ends with (starting bank value plus
+income minus its spending).
+
+The inputs are read with three small queries into NumPy arrays, and the whole
+horizon is computed in one pass: a templates x months occurrence mask, summed per
+type with ``bincount``. A 10-year forecast over thousands of templates takes
+milliseconds, without creating any month.
+
+Confidence bands only cover discretionary spending. Types and months are taken as
+independent, so a month's spread is the root of the summed type variances and a
+balance's spread grows with the square root of the months elapsed.
+"""
+
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+
+from metadata_cache import get_months
+from recurrence import RECURRING_TEMPLATES_SQL, index_to_month, month_index
+from rollups import get_month_total
+
+# Longest forecast (50 years) and history accepted
+MAX_FORECAST_MONTHS = 600
+MAX_HISTORY_MONTHS = 120
+
+Forecast = namedtuple('Forecast', [
+    'base',              # (year, month) of the latest month, which the forecast follows
+    'base_balance',      # balance at the end of the base month
+    'months',            # (year, month) of each forecast month
+    'history_months',    # number of months the discretionary averages come from
+    'income',            # income per forecast month
+    'expense_type_ids',  # (types,) the rows of the per-type arrays, ascending
+    'recurring',         # (types, months) recurring template occurrences
+    'scheduled',         # (types, months) expenses already dated in the forecast months
+    'discretionary',     # (types,) average non-recurring spending per month
+    'discretionary_std', # (types,) its standard deviation
+    'expected',          # (types, months) recurring + scheduled + discretionary
+    'expected_low',      # (types, months) lower bound, never below recurring + scheduled
+    'expected_high',     # (types, months)
+    'spending',          # (months,) expected spending of all types
+    'spending_low',      # (months,)
+    'spending_high',     # (months,)
+    'balance',           # (months,) expected balance at the end of each month
+    'balance_low',       # (months,)
+    'balance_high',      # (months,)
+])
+
+_TEMPLATES_QUERY = f'''
+    SELECT expense_type_id, amount, origin_index, interval_months
+    FROM ({RECURRING_TEMPLATES_SQL})
+'''
+
+# Month index from an expense date, as in the rollups
+_DATE_INDEX = 'CAST(substr(date, 1, 4) AS INTEGER) * 12 + CAST(substr(date, 6, 2) AS INTEGER) - 1'
+
+# Spending per history month and type less the recurring instances, from the rollup
+# (see rollups.py) so the cost doesn't grow with the number of expenses; the
+# templates' own rows are taken off from the templates array
+_HISTORY_QUERY = '''
+    SELECT idx, expense_type_id, SUM(total) FROM (
+        SELECT year * 12 + month - 1 AS idx, expense_type_id, total
+        FROM month_type_totals
+        WHERE year BETWEEN ? AND ?
+        UNION ALL
+        SELECT m.year * 12 + m.month - 1, rei.expense_type_id, -rei.amount
+        FROM months m
+        JOIN recurring_expense_instances rei ON rei.month_id = m.id
+        WHERE m.year BETWEEN ? AND ?
+    )
+    GROUP BY idx, expense_type_id
+'''
+
+_SCHEDULED_QUERY = f'''
+    SELECT {_DATE_INDEX} AS idx, expense_type_id, SUM(amount)
+    FROM expenses
+    WHERE is_active = TRUE AND date >= ? AND date < ?
+    GROUP BY idx, expense_type_id
+'''
+
+
+def _first_day(index):
+    year, month = index_to_month(index)
+    return f'{year:04d}-{month:02d}-01'
+
+
+def _rows(conn, query, params=()):
+    """Integer query results as an (n, columns) array"""
+    cursor = conn.cursor()
+    # Plain tuples go into an array much faster than sqlite3.Row objects
+    cursor.row_factory = None
+    rows = cursor.execute(query, params).fetchall()
+    # An empty result still needs the query's width for the column slices below
+    return np.array(rows, dtype=np.int64).reshape(-1, len(cursor.description))
+
+
+def _per_type(type_positions, column_positions, values, types, columns):
+    """Sum values into a (types, columns) array, one bincount for all of them"""
+    flat = type_positions * columns + column_positions
+    return np.bincount(flat.ravel(), weights=values.ravel(), minlength=types * columns).reshape(types, columns)
+
+
+def check_parameters(months, history, confidence):
+    """Raise ValueError if the forecast parameters are out of range"""
+    if not 1 <= months <= MAX_FORECAST_MONTHS:
+        raise ValueError(f'The forecast must cover between 1 and {MAX_FORECAST_MONTHS} months')
+    if not 1 <= history <= MAX_HISTORY_MONTHS:
+        raise ValueError(f'The history must be between 1 and {MAX_HISTORY_MONTHS} months')
+    if not 0 < confidence < 1:
+        raise ValueError('The confidence must be between 0 and 1')
+
+
+def forecast(conn, months=12, history=12, confidence=0.8, income=None):
+    """Project spending and balances for the months after the latest month
+
+    Args:
+        conn: Database connection
+        months: Number of months to forecast
+        history: Months (up to and including the latest) whose non-recurring
+            spending gives the discretionary averages; only months that exist in
+            the database count
+        confidence: Probability covered by the low/high bands, e.g. 0.8
+        income: Income per forecast month in cents (default: the latest month's)
+
+    Returns:
+        Forecast, or None if the database has no months
+
+    Raises:
+        ValueError: if a parameter is out of range (see check_parameters)
+    """
+    check_parameters(months, history, confidence)
+
+    existing = get_months(conn)
+    if not existing:
+        return None
+    base = existing[0]
+    base_index = month_index(base['year'], base['month'])
+    base_balance = (base['starting_bank_value'] + base['monthly_income']
+                    - get_month_total(conn, base['month'], base['year']))
+    if income is None:
+        income = base['monthly_income']
+
+    first, last = base_index + 1, base_index + months
+    # History months that exist, oldest first
+    history_indexes = np.array(sorted(
+        index for index in (month_index(row['year'], row['month']) for row in existing)
+        if base_index - history < index <= base_index
+    ), dtype=np.int64)
+
+    templates = _rows(conn, _TEMPLATES_QUERY)
+    years = (int(history_indexes[0]) // 12, base_index // 12) * 2
+    past = _rows(conn, _HISTORY_QUERY, years)
+    scheduled_rows = _rows(conn, _SCHEDULED_QUERY, (_first_day(first), _first_day(last + 1)))
+    # Non-recurring spending: take off the template rows dated in the history months,
+    # and keep only months that exist
+    in_history = np.isin(templates[:, 2], history_indexes)
+    past = np.concatenate([past, np.stack([
+        templates[in_history, 2], templates[in_history, 0], -templates[in_history, 1],
+    ], axis=1)])
+    past = past[np.isin(past[:, 0], history_indexes)]
+
+    type_ids = np.unique(np.concatenate([templates[:, 0], past[:, 1], scheduled_rows[:, 1]]))
+    types = len(type_ids)
+
+    # Occurrence mask: templates x forecast months
+    forecast_indexes = np.arange(first, last + 1, dtype=np.int64)
+    elapsed = forecast_indexes[None, :] - templates[:, 2:3]
+    occurs = (elapsed > 0) & (elapsed % templates[:, 3:4] == 0)
+    recurring = _per_type(
+        np.searchsorted(type_ids, templates[:, 0])[:, None], np.arange(months)[None, :],
+        occurs * templates[:, 1:2].astype(np.float64), types, months,
+    )
+    scheduled = _per_type(
+        np.searchsorted(type_ids, scheduled_rows[:, 1]), scheduled_rows[:, 0] - first,
+        scheduled_rows[:, 2].astype(np.float64), types, months,
+    )
+
+    # Type x history month spending, with months that had none as 0
+    past_spending = _per_type(
+        np.searchsorted(type_ids, past[:, 1]), np.searchsorted(history_indexes, past[:, 0]),
+        past[:, 2].astype(np.float64), types, len(history_indexes),
+    )
+    discretionary = past_spending.mean(axis=1)
+    if len(history_indexes) > 1:
+        discretionary_std = past_spending.std(axis=1, ddof=1)
+    else:
+        discretionary_std = np.zeros(types)
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    known = recurring + scheduled
+    expected = known + discretionary[:, None]
+    expected_low = np.maximum(expected - z * discretionary_std[:, None], known)
+    expected_high = expected + z * discretionary_std[:, None]
+
+    spending = expected.sum(axis=0)
+    month_spread = z * np.sqrt(np.square(discretionary_std).sum())
+    spending_low = np.maximum(spending - month_spread, known.sum(axis=0))
+    spending_high = spending + month_spread
+
+    balance = base_balance + np.cumsum(income - spending)
+    balance_spread = month_spread * np.sqrt(np.arange(1, months + 1))
+
+    return Forecast(
+        base=(base['year'], base['month']),
+        base_balance=base_balance,
+        months=[index_to_month(int(index)) for index in forecast_indexes],
+        history_months=len(history_indexes),
+        income=income,
+        expense_type_ids=type_ids,
+        recurring=recurring,
+        scheduled=scheduled,
+        discretionary=discretionary,
+        discretionary_std=discretionary_std,
+        expected=expected,
+        expected_low=expected_low,
+        expected_high=expected_high,
+        spending=spending,
+        spending_low=spending_low,
+        spending_high=spending_high,
+        balance=balance,
+        balance_low=balance - balance_spread,
+        balance_high=balance + balance_spread,
+    )
@@ -0,0 +1,311 @@
+"""
+Streaming bulk import of expenses from CSV or OFX bank exports.
+
+Files are read incrementally from a text stream, so memory stays flat regardless of
+file size. Rows are normalized, mapped onto expense types and written with
+``executemany`` in batches of ``BATCH_SIZE``, one transaction per batch. Months rows
+for every imported date are created on the way (recurring instances are not
+generated for them, since bank exports already contain those payments).
+
+Only money going out is imported. In a CSV file expenses are positive, as the
+export writes them, and negative or parenthesized amounts are credits (refunds,
+deposits); in OFX debits are the negative amounts. Credits are skipped and counted
+in ``rows_skipped`` either way, so a statement imports the same in both formats.
+
+Used by the ``/expenses/import`` endpoint and ``python manage.py import``.
+"""
+
+import csv
+import re
+import time
+from datetime import date, datetime
+
+from metadata_cache import get_all_expense_types, invalidate as invalidate_metadata
+from money import to_cents
+
+# Rows per executemany() batch and per transaction
+BATCH_SIZE = 10000
+
+# Only the first errors are kept in the report; the rest are just counted
+MAX_REPORTED_ERRORS = 100
+
+# Default CSV column names for each expense field
+DEFAULT_COLUMNS = {
+    'date': 'date',
+    'amount': 'amount',
+    'description': 'description',
+    'expense_type': 'expense_type',
+}
+
+# Date formats tried in order when no explicit format is given
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%Y%m%d', '%d.%m.%Y', '%Y/%m/%d')
+
+
+class ImportRowError(ValueError):
+    """A single input row could not be imported"""
+
+
+class ImportResult:
+    """Summary of an import run"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.rows_skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.months_created = 0
+        self.types_created = 0
+        self.elapsed = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    @property
+    def rows_per_second(self):
+        return self.rows_imported / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            'rows_read': self.rows_read,
+            'rows_imported': self.rows_imported,
+            'rows_skipped': self.rows_skipped,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'months_created': self.months_created,
+            'types_created': self.types_created,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def parse_date(value, date_format=None):
+    """Normalize a date string to YYYY-MM-DD"""
+    value = (value or '').strip()
+    if len(value) > 8 and value[:8].isdigit():
+        # OFX timestamps: 20240131120000[-5:EST]
+        value = value[:8]
+    if date_format is None and len(value) == 10 and value[4] == '-':
+        # Fast path for ISO dates, much cheaper than strptime
+        try:
+            return date.fromisoformat(value).isoformat()
+        except ValueError:
+            pass
+    formats = (date_format,) if date_format else DATE_FORMATS
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ImportRowError(f"Unrecognized date '{value}'")
+
+
+def is_credit(value):
+    """Whether a CSV amount is money coming in: negative ('-45.00') or in parentheses ('(45.00)')
+
+    Amounts that don't parse are not credits; parse_amount() reports them.
+    """
+    text = (value or '').strip()
+    if text.startswith('(') and text.endswith(')'):
+        return True
+    try:
+        return to_cents(text) < 0
+    except ValueError:
+        return False
+
+
+def parse_amount(value):
+    """Parse an expense amount like '1,234.56' or '$12' into integer cents"""
+    try:
+        amount = to_cents((value or '').strip())
+    except ValueError:
+        raise ImportRowError(f"Invalid amount '{value}'")
+    if amount == 0:
+        raise ImportRowError('Amount must not be zero')
+    if amount < 0:
+        raise ImportRowError(f"Negative amount '{value}' is a credit, not an expense")
+    return amount
+
+
+def iter_csv_records(stream, columns=None):
+    """Yield (line_number, {'date', 'amount', 'description', 'expense_type'}) from a CSV stream
+
+    Credits (see is_credit) are yielded with a None record, to be counted as skipped.
+    """
+    columns = dict(DEFAULT_COLUMNS, **(columns or {}))
+    reader = csv.DictReader(stream)
+    missing = [columns[field] for field in ('date', 'amount') if columns[field] not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+
+    for row in reader:
+        record = {field: row.get(column) for field, column in columns.items()}
+        yield reader.line_num, None if is_credit(record['amount']) else record
+
+
+_OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.IGNORECASE | re.DOTALL)
+_OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def iter_ofx_records(stream, chunk_size=65536):
+    """Yield (transaction_number, record) for each debit in an OFX/QFX stream.
+
+    OFX is SGML and may put a whole statement on one line, so the stream is read in
+    chunks and scanned for complete <STMTTRN> blocks. Debits are negative in OFX and
+    are yielded with the sign dropped. Credits (deposits) are not expenses and are
+    yielded with a None record so they can be counted as skipped.
+    """
+    buffer = ''
+    number = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        last_end = 0
+        for match in _OFX_TRANSACTION.finditer(buffer):
+            last_end = match.end()
+            number += 1
+            fields = {tag.upper(): value.strip() for tag, value in _OFX_FIELD.findall(match.group(1))}
+            amount = fields.get('TRNAMT', '')
+            if amount and not amount.startswith('-'):
+                yield number, None
+                continue
+            yield number, {
+                'date': fields.get('DTPOSTED'),
+                'amount': amount[1:],
+                'description': fields.get('NAME') or fields.get('MEMO'),
+                'expense_type': fields.get('CATEGORY'),
+            }
+        buffer = buffer[last_end:]
+        if not chunk:
+            break
+
+
+class _TypeResolver:
+    """Maps expense type names from the input onto expense_types ids"""
+
+    def __init__(self, conn, type_map=None, default_type='Other', create_types=False):
+        self.conn = conn
+        self.type_map = {k.lower(): v for k, v in (type_map or {}).items()}
+        self.create_types = create_types
+        self.ids = {row['name'].lower(): row['id'] for row in get_all_expense_types(conn)}
+        self.default_id = self.ids.get((default_type or '').lower())
+        self.created = 0
+
+    def resolve(self, name):
+        name = (name or '').strip()
+        if not name:
+            if self.default_id is None:
+                raise ImportRowError('Missing expense type and no default type configured')
+            return self.default_id
+
+        name = self.type_map.get(name.lower(), name)
+        type_id = self.ids.get(name.lower())
+        if type_id is not None:
+            return type_id
+        if self.create_types:
+            cursor = self.conn.execute('INSERT INTO expense_types (name) VALUES (?)', (name,))
+            self.ids[name.lower()] = cursor.lastrowid
+            self.created += 1
+            return cursor.lastrowid
+        if self.default_id is not None:
+            return self.default_id
+        raise ImportRowError(f"Unknown expense type '{name}'")
+
+
+def _flush(conn, batch, months, result):
+    """Write one batch of expenses and the months they fall in, in one transaction"""
+    if months:
+        # rowcount leaves out ignored duplicates and rows written by triggers
+        result.months_created += conn.executemany(
+            'INSERT OR IGNORE INTO months (month, year) VALUES (?, ?)',
+            sorted(months, key=lambda ym: (ym[1], ym[0]))
+        ).rowcount
+    conn.executemany('''
+        INSERT INTO expenses (amount, description, expense_type_id, date,
+                              recurring_interval, recurring_day, is_recurring_template)
+        VALUES (?, ?, ?, ?, 'none', NULL, FALSE)
+    ''', batch)
+    conn.commit()
+    result.rows_imported += len(batch)
+
+
+def import_records(conn, records, type_map=None, default_type='Other', create_types=False,
+                   date_format=None, batch_size=BATCH_SIZE):
+    """Import an iterable of (line_number, record) pairs
+
+    Args:
+        conn: Database connection
+        records: Iterable from iter_csv_records() or iter_ofx_records()
+        type_map: Optional dict mapping input category names to expense type names
+        default_type: Expense type used when a row has none (or an unknown one and
+            create_types is off); None makes such rows errors
+        create_types: Create expense types that don't exist yet
+        date_format: strptime format for dates; common formats are tried if None
+        batch_size: Rows per executemany batch / transaction
+
+    Returns:
+        ImportResult
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+    types = _TypeResolver(conn, type_map, default_type, create_types)
+
+    batch = []
+    months = set()
+    try:
+        for line, record in records:
+            result.rows_read += 1
+            if record is None:
+                result.rows_skipped += 1
+                continue
+            try:
+                expense_date = parse_date(record.get('date'), date_format)
+                amount = parse_amount(record.get('amount'))
+                expense_type_id = types.resolve(record.get('expense_type'))
+            except ImportRowError as e:
+                result.add_error(line, str(e))
+                continue
+
+            batch.append((amount, (record.get('description') or '').strip() or None, expense_type_id, expense_date))
+            months.add((int(expense_date[5:7]), int(expense_date[:4])))
+
+            if len(batch) >= batch_size:
+                _flush(conn, batch, months, result)
+                batch = []
+                months = set()
+
+        if batch:
+            _flush(conn, batch, months, result)
+        elif conn.in_transaction:
+            # Expense types created for rows that all failed
+            conn.commit()
+    finally:
+        result.types_created = types.created
+        result.elapsed = time.perf_counter() - started
+        if result.months_created or result.types_created:
+            invalidate_metadata(conn)
+
+    return result
+
+
+def import_stream(conn, stream, file_format='csv', columns=None, **options):
+    """Import expenses from a text stream in 'csv' or 'ofx' format
+
+    ``columns`` overrides the CSV column names (see DEFAULT_COLUMNS); the remaining
+    options are passed to import_records().
+    """
+    if file_format == 'csv':
+        records = iter_csv_records(stream, columns)
+    elif file_format in ('ofx', 'qfx'):
+        records = iter_ofx_records(stream)
+    else:
+        raise ValueError(f"Unsupported import format '{file_format}'")
+    return import_records(conn, records, **options)
+
+
+def detect_format(filename, default='csv'):
+    """Guess the import format from a file name"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    return extension if extension in ('csv', 'ofx', 'qfx') else default
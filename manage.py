@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the Spending Tracker database.
+
+Usage:
+    python manage.py migrate [--status] [--target VERSION] [--explain]
+    python manage.py rebuild-totals [--check-only]
+    python manage.py rebuild-search
+    python manage.py archive [--older-than-days N] [--batch-size N]
+    python manage.py restore EXPENSE_ID
+    python manage.py sync-instances [--past-months N] [--future-months N] [--all]
+    python manage.py vendor-assets [--check]
+    python manage.py build-assets [--clean]
+    python manage.py import FILE [--format csv|ofx] [--date-column NAME] [--amount-column NAME]
+                                 [--description-column NAME] [--type-column NAME]
+                                 [--date-format FMT] [--default-type NAME] [--create-types]
+                                 [--map CATEGORY=TYPE ...] [--batch-size N]
+    python manage.py add-months START END [--income AMOUNT] [--starting-bank-value AMOUNT]
+    python manage.py shards list|TASK [--shard-dir DIR] [--jobs N] [--tenant ID ...]
+    python manage.py add-tenant TENANT_ID [--shard-dir DIR]
+"""
+
+import argparse
+import sys
+import urllib.error
+
+import assets
+from db import pooled_connection
+from importer import BATCH_SIZE, detect_format, import_stream
+import migrations
+import shards
+from money import format_money, to_cents
+from months import create_months, month_range, parse_year_month
+from rollups import check_month_totals, create_month_totals, rebuild_month_totals
+from retention import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, archive_deleted_expenses, restore_expense
+from scheduler import INSTANCE_FUTURE_MONTHS, INSTANCE_PAST_MONTHS, sync_window, templates_changed
+from search import create_search_index, rebuild_search_index
+
+
+def migrate(args):
+    """Apply pending schema migrations, or report the schema status"""
+    with pooled_connection() as conn:
+        if args.status:
+            applied = migrations.applied_versions(conn)
+            for migration in migrations.MIGRATIONS:
+                state = 'applied' if migration.version in applied else 'pending'
+                print(f"{migration.version:>4}  {state:<8} {migration.name}")
+        else:
+            applied = migrations.migrate(conn, target=args.target)
+            for migration in applied:
+                print(f"Applied migration {migration.version}: {migration.name}")
+            print(f"Schema is at version {migrations.current_version(conn)}"
+                  + ("" if applied else " (nothing to apply)"))
+
+        if not args.explain:
+            return 0
+
+        # Show how SQLite runs the hot queries, and fail if one misses its indexes
+        failed = 0
+        for check in migrations.check_query_plans(conn):
+            used = ', '.join(check.indexes) or 'no index'
+            note = '' if check.allowed[0] in check.indexes else f" (written for {', '.join(check.allowed)})"
+            print(f"\n{check.name}: {'ok' if check.ok else 'FAIL'}, uses {used}{note}")
+            for line in check.plan:
+                print(f"  {line}")
+            failed += not check.ok
+    return 1 if failed else 0
+
+
+def rebuild_totals(args):
+    """Check the month_totals rollup against the raw tables and rebuild it"""
+    with pooled_connection() as conn:
+        create_month_totals(conn)
+        mismatches = check_month_totals(conn)
+
+        if mismatches:
+            print(f"Found {len(mismatches)} mismatched rollup rows:")
+            for year, month, expense_type_id, stored, actual in mismatches:
+                scope = f"type {expense_type_id}" if expense_type_id is not None else "month total"
+                print(f"  {year}-{month:02d} {scope}: stored {format_money(stored)}, actual {format_money(actual)}")
+        else:
+            print("Rollup matches the raw tables")
+
+        if args.check_only:
+            return 1 if mismatches else 0
+
+        rebuild_month_totals(conn)
+        print("Rebuilt month_totals and month_type_totals")
+    return 0
+
+
+def rebuild_search(args):
+    """Re-index every expense and recurring instance for search"""
+    with pooled_connection() as conn:
+        create_search_index(conn)
+        rebuild_search_index(conn)
+        count = conn.execute('SELECT COUNT(*) FROM expense_search').fetchone()[0]
+    print(f"Rebuilt the search index ({count} rows)")
+    return 0
+
+
+def archive(args):
+    """Move expenses deleted more than --older-than-days ago to expenses_archive"""
+    with pooled_connection() as conn:
+        archived = archive_deleted_expenses(conn, args.older_than_days, args.batch_size)
+        remaining = conn.execute('SELECT COUNT(*) FROM expenses WHERE is_active = FALSE').fetchone()[0]
+    print(f"Archived {archived} deleted expenses ({remaining} deleted expenses not archived yet)")
+    return 0
+
+
+def restore(args):
+    """Undelete an expense, from the expenses table or the archive"""
+    with pooled_connection() as conn:
+        restored = restore_expense(conn, args.expense_id)
+        if restored is not None:
+            templates_changed(conn, [args.expense_id])
+    if restored is None:
+        print(f"No deleted expense with ID {args.expense_id}")
+        return 1
+    print(f"Restored expense {args.expense_id}" + (" from the archive" if restored == 'restored' else ""))
+    return 0
+
+
+def sync_instances(args):
+    """Bring the recurring instances of existing months in line with the templates"""
+    past_months, future_months = (None, None) if args.all else (args.past_months, args.future_months)
+    with pooled_connection() as conn:
+        result = sync_window(conn, past_months=past_months, future_months=future_months)
+    print(f"Recurring instances: {result.inserted} inserted, {result.updated} updated, {result.deleted} deleted")
+    return 0
+
+
+def vendor_assets(args):
+    """Download the pinned third-party libraries and fonts into static/vendor/"""
+    if args.check:
+        missing = assets.missing_vendor_assets()
+        for path in missing:
+            print(f"  missing: static/{path} (pages load {assets.VENDOR_ASSETS[path]})")
+        print(f"{len(missing)} of {len(assets.VENDOR_ASSETS)} vendored assets missing"
+              if missing else "All vendored assets are present")
+        return 1 if missing else 0
+    try:
+        written = assets.vendor_assets()
+    except (OSError, urllib.error.URLError) as e:
+        print(f"Could not download the vendored assets: {e}")
+        return 1
+    for path in written:
+        print(f"  static/{path}")
+    print(f"Vendored {len(written)} files; now run `python manage.py build-assets`")
+    return 0
+
+
+def build_assets(args):
+    """Write content-hashed, precompressed copies of static/ for long-lived caching"""
+    manifest = assets.build_assets(clean=args.clean)
+    print(f"Built {len(manifest)} assets into static/{assets.BUILD_DIR}/"
+          + ("" if assets.brotli else " (gzip only; install brotli for .br variants)"))
+    return 0
+
+
+def import_file(args):
+    """Stream a CSV or OFX file into the expenses table"""
+    columns = {
+        'date': args.date_column,
+        'amount': args.amount_column,
+        'description': args.description_column,
+        'expense_type': args.type_column,
+    }
+    columns = {field: column for field, column in columns.items() if column}
+
+    type_map = {}
+    for mapping in args.map:
+        category, _, type_name = mapping.partition('=')
+        type_map[category.strip()] = type_name.strip()
+
+    with open(args.file, encoding='utf-8-sig', errors='replace', newline='') as stream, \
+            pooled_connection() as conn:
+        try:
+            result = import_stream(
+                conn, stream, args.format or detect_format(args.file), columns,
+                type_map=type_map,
+                default_type=args.default_type or None,
+                create_types=args.create_types,
+                date_format=args.date_format,
+                batch_size=args.batch_size,
+            )
+        except ValueError as e:
+            print(f"Import failed: {e}")
+            return 1
+
+    print(f"Read {result.rows_read} rows, imported {result.rows_imported}, "
+          f"skipped {result.rows_skipped}, {result.error_count} errors")
+    print(f"Created {result.months_created} months and {result.types_created} expense types")
+    print(f"{result.elapsed:.2f}s ({result.rows_per_second:,.0f} rows/sec)")
+    for error in result.errors:
+        print(f"  line {error['line']}: {error['error']}")
+    if result.error_count > len(result.errors):
+        print(f"  ... and {result.error_count - len(result.errors)} more errors")
+    return 1 if result.error_count else 0
+
+
+def add_months(args):
+    """Create every month from START to END with their recurring expenses"""
+    try:
+        year_months = month_range(*parse_year_month(args.start), *parse_year_month(args.end))
+        with pooled_connection() as conn:
+            result = create_months(conn, year_months, monthly_income=args.income,
+                                   starting_bank_value=args.starting_bank_value)
+    except ValueError as e:
+        print(f"Could not create months: {e}")
+        return 1
+
+    print(f"Created {result.months_created} of {len(result.months)} months "
+          f"and {result.instances_created} recurring expense instances")
+    return 0
+
+
+def shard_tasks(args):
+    """List the tenant databases, or run a maintenance task on all of them in parallel"""
+    shard_dir = args.shard_dir or shards.SHARD_DIR
+    if not shard_dir:
+        print("No shard directory; pass --shard-dir or set SPENDING_TRACKER_SHARD_DIR")
+        return 1
+
+    if args.task == 'list':
+        tenants = shards.list_tenants(shard_dir)
+        for tenant in tenants:
+            print(f"  {tenant}")
+        print(f"{len(tenants)} tenant databases in {shard_dir}")
+        return 0
+
+    try:
+        results = shards.run_maintenance(shard_dir, args.task, tenants=args.tenant, jobs=args.jobs)
+    except ValueError as e:
+        print(f"Could not run {args.task}: {e}")
+        return 1
+    for result in results:
+        print(f"  {'ok    ' if result.ok else 'FAILED'} {result.tenant}: {result.message} ({result.seconds:.2f}s)")
+    failed = sum(1 for result in results if not result.ok)
+    print(f"Ran {args.task} on {len(results)} tenant databases, {failed} failed")
+    return 1 if failed else 0
+
+
+def add_tenant(args):
+    """Create a tenant's database if needed and print a new access key for it"""
+    shard_dir = args.shard_dir or shards.SHARD_DIR
+    if not shard_dir:
+        print("No shard directory; pass --shard-dir or set SPENDING_TRACKER_SHARD_DIR")
+        return 1
+    try:
+        existed = args.tenant_id in shards.list_tenants(shard_dir)
+        access_key = shards.create_tenant(shard_dir, args.tenant_id)
+    except ValueError as e:
+        print(f"Could not add tenant: {e}")
+        return 1
+    print(f"{'Issued a new key for' if existed else 'Created'} tenant {args.tenant_id}; access key: {access_key}")
+    if existed:
+        print("The previous key no longer works")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help='apply pending schema migrations')
+    migrate_parser.add_argument('--status', action='store_true', help='list migrations without applying them')
+    migrate_parser.add_argument('--target', type=int, help='stop after this migration version')
+    migrate_parser.add_argument('--explain', action='store_true',
+                                help='check the hot queries use their indexes and scan no table in full')
+    migrate_parser.set_defaults(func=migrate)
+
+    rebuild = subparsers.add_parser('rebuild-totals', help='verify and rebuild the per-month totals rollup')
+    rebuild.add_argument('--check-only', action='store_true', help='only report mismatches, do not rebuild')
+    rebuild.set_defaults(func=rebuild_totals)
+
+    reindex = subparsers.add_parser('rebuild-search', help='rebuild the description search index')
+    reindex.set_defaults(func=rebuild_search)
+
+    archiver = subparsers.add_parser('archive', help='move long-deleted expenses to the archive table')
+    archiver.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                          help=f'only expenses deleted at least this many days ago (default {ARCHIVE_AFTER_DAYS})')
+    archiver.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='expenses moved per transaction')
+    archiver.set_defaults(func=archive)
+
+    restorer = subparsers.add_parser('restore', help='undelete an expense, including an archived one')
+    restorer.add_argument('expense_id', type=int, help='ID of the deleted expense')
+    restorer.set_defaults(func=restore)
+
+    syncer = subparsers.add_parser('sync-instances',
+                                   help='materialize recurring instances in existing months (as the scheduler does)')
+    syncer.add_argument('--past-months', type=int, default=INSTANCE_PAST_MONTHS,
+                        help=f'past months to fill in (default {INSTANCE_PAST_MONTHS})')
+    syncer.add_argument('--future-months', type=int, default=INSTANCE_FUTURE_MONTHS,
+                        help=f'future months to keep in sync (default {INSTANCE_FUTURE_MONTHS})')
+    syncer.add_argument('--all', action='store_true',
+                        help='every existing month; past ones only get the instances they are missing')
+    syncer.set_defaults(func=sync_instances)
+
+    vendor = subparsers.add_parser('vendor-assets', help='download the third-party CSS, JS and fonts into static/vendor/')
+    vendor.add_argument('--check', action='store_true',
+                        help='only list the files not downloaded yet; exit 1 if there are any')
+    vendor.set_defaults(func=vendor_assets)
+
+    builder = subparsers.add_parser('build-assets', help='write hashed, precompressed static files for deployment')
+    builder.add_argument('--clean', action='store_true', help='remove files from earlier builds')
+    builder.set_defaults(func=build_assets)
+
+    importer = subparsers.add_parser('import', help='bulk import expenses from a CSV or OFX file')
+    importer.add_argument('file', help='CSV, OFX or QFX file to import')
+    importer.add_argument('--format', choices=('csv', 'ofx', 'qfx'), help='file format (default: from extension)')
+    importer.add_argument('--date-column', help="CSV column holding the date (default 'date')")
+    importer.add_argument('--amount-column', help="CSV column holding the amount (default 'amount')")
+    importer.add_argument('--description-column', help="CSV column holding the description (default 'description')")
+    importer.add_argument('--type-column', help="CSV column holding the expense type (default 'expense_type')")
+    importer.add_argument('--date-format', help='strptime format of the dates, e.g. %%d/%%m/%%Y')
+    importer.add_argument('--default-type', default='Other',
+                          help="expense type for rows without a known type (default 'Other')")
+    importer.add_argument('--create-types', action='store_true', help='create unknown expense types')
+    importer.add_argument('--map', action='append', default=[], metavar='CATEGORY=TYPE',
+                          help='map a category in the file to an expense type (repeatable)')
+    importer.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per insert batch and transaction')
+    importer.set_defaults(func=import_file)
+
+    months = subparsers.add_parser('add-months', help='create a range of months and their recurring expenses')
+    months.add_argument('start', help='first month, e.g. 2024-01')
+    months.add_argument('end', help='last month (inclusive), e.g. 2024-12')
+    months.add_argument('--income', type=to_cents, default=0, help='monthly income for the new months')
+    months.add_argument('--starting-bank-value', type=to_cents, default=0,
+                        help='starting bank value for the new months')
+    months.set_defaults(func=add_months)
+
+    sharded = subparsers.add_parser('shards', help='list the tenant databases or run a task on all of them')
+    sharded.add_argument('task', choices=('list',) + tuple(shards.MAINTENANCE_TASKS), help='what to do')
+    sharded.add_argument('--shard-dir', help='directory of the tenant databases (default SPENDING_TRACKER_SHARD_DIR)')
+    sharded.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    sharded.add_argument('--tenant', action='append', help='only this tenant (repeatable)')
+    sharded.set_defaults(func=shard_tasks)
+
+    tenant = subparsers.add_parser('add-tenant', help='create a tenant database, or issue a new access key for one')
+    tenant.add_argument('tenant_id', help='tenant ID (letters, digits, "-" and "_")')
+    tenant.add_argument('--shard-dir', help='directory of the tenant databases (default SPENDING_TRACKER_SHARD_DIR)')
+    tenant.set_defaults(func=add_tenant)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+In-process cache for the small, rarely changing tables: expense types and months.
+
+Nearly every page needs the active expense types and the list of months. Instead of
+querying them on every request (and looking up type names once per recurring
+template), routes read them from here.
+
+Entries are dropped when:
+- a route that changes expense_types or months calls ``invalidate(conn)`` after
+  its commit, or
+- ``PRAGMA data_version`` on the connection used for a lookup shows that another
+  connection (in this or another process) has committed since that connection last
+  looked. SQLite answers this pragma without touching any table, so checking it is
+  far cheaper than re-running the queries.
+
+Entries are kept per database file, so tenants on different shards (see shards.py)
+never see each other's types and months, and a change in one shard only drops that
+shard's entries.
+"""
+
+import threading
+
+
+class MetadataCache:
+    """Thread-safe cache of query results per database, invalidated a database at a time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+
+    def invalidate(self, database=None):
+        """Drop the cached entries of one database file, or with None, of all of them"""
+        with self._lock:
+            if database is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(database, None)
+            self._generation += 1
+
+    def _check_data_version(self, conn):
+        """Invalidate if another connection committed since ``conn`` last checked.
+
+        Returns False for connections that cannot remember the version they saw
+        (plain sqlite3 connections), in which case results must not be cached.
+        """
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        try:
+            last_seen = getattr(conn, '_metadata_data_version', None)
+            conn._metadata_data_version = version
+        except AttributeError:
+            return False
+        # A connection seen for the first time can't tell what changed before it
+        # opened, so that counts as a change too
+        if last_seen != version:
+            self.invalidate(getattr(conn, 'db_path', None))
+        return True
+
+    def get(self, conn, key, loader):
+        """Return the cached value for ``key``, calling ``loader(conn)`` on a miss"""
+        if not self._check_data_version(conn):
+            return loader(conn)
+
+        database = getattr(conn, 'db_path', None)
+        with self._lock:
+            entries = self._entries.get(database)
+            if entries is not None and key in entries:
+                return entries[key]
+            generation = self._generation
+
+        value = loader(conn)
+        with self._lock:
+            # Don't store a value loaded while an invalidation happened
+            if generation == self._generation:
+                self._entries.setdefault(database, {})[key] = value
+        return value
+
+
+cache = MetadataCache()
+
+
+def invalidate(conn=None):
+    """Call after committing changes to expense_types or months on ``conn``
+
+    Only the entries of ``conn``'s database are dropped; without a connection (or
+    with one that doesn't know its file), every database's are.
+    """
+    cache.invalidate(getattr(conn, 'db_path', None))
+
+
+def get_active_expense_types(conn):
+    """Active expense types ordered by name"""
+    return cache.get(conn, 'active_expense_types', lambda c: tuple(
+        c.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
+    ))
+
+
+def get_all_expense_types(conn):
+    """All expense types, including inactive ones, ordered by name"""
+    return cache.get(conn, 'all_expense_types', lambda c: tuple(
+        c.execute('SELECT * FROM expense_types ORDER BY name').fetchall()
+    ))
+
+
+def get_expense_type_names(conn):
+    """Dict mapping every expense type id to its name"""
+    return cache.get(conn, 'expense_type_names', lambda c: {
+        row['id']: row['name'] for row in get_all_expense_types(c)
+    })
+
+
+def get_months(conn):
+    """All months, most recent first"""
+    return cache.get(conn, 'months', lambda c: tuple(
+        c.execute('SELECT * FROM months ORDER BY year DESC, month DESC').fetchall()
+    ))
+
+
+def get_latest_month(conn):
+    """The most recent month, or None if there are no months"""
+    months = get_months(conn)
+    return months[0] if months else None
+
+
+def get_month(conn, month_id):
+    """The months row with the given id, or None"""
+    months_by_id = cache.get(conn, 'months_by_id', lambda c: {
+        row['id']: row for row in get_months(c)
+    })
+    try:
+        return months_by_id.get(int(month_id))
+    except (TypeError, ValueError):
+        return None
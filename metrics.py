@@ -0,0 +1,254 @@
+"""
+Per-request performance instrumentation, Prometheus metrics and logging setup.
+
+``init_app(app)`` hooks into the request lifecycle and the shared SQLite connection
+class (see ``db.set_query_observer``) to record, for every request:
+- wall time per endpoint, method and status
+- the number of SQL statements and their cumulative time (execute + fetch)
+- template render time per template
+
+Statements slower than ``SLOW_QUERY_MS`` are logged with their SQL to the
+``spending_tracker.slow_queries`` logger. Aggregated histograms are served in the
+Prometheus text format at ``/metrics``; each response also carries a
+``Server-Timing`` header with the same numbers for the browser's dev tools.
+
+Metrics are kept per process. Environment variables:
+    SPENDING_TRACKER_LOG_LEVEL      DEBUG, INFO (default), WARNING, ERROR or OFF
+    SPENDING_TRACKER_SLOW_QUERY_MS  slow-query threshold in ms (default 100)
+    SPENDING_TRACKER_METRICS        set to 0 to turn instrumentation off
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+import db
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger('spending_tracker.slow_queries')
+
+LOG_LEVEL = os.environ.get('SPENDING_TRACKER_LOG_LEVEL', 'INFO')
+SLOW_QUERY_MS = float(os.environ.get('SPENDING_TRACKER_SLOW_QUERY_MS', '100'))
+METRICS_ENABLED = os.environ.get('SPENDING_TRACKER_METRICS', '1') != '0'
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+
+def configure_logging(level=None):
+    """Set up leveled logging for the app; 'OFF' silences it completely"""
+    level = (level or LOG_LEVEL).upper()
+    if level in ('OFF', 'NONE'):
+        logging.disable(logging.CRITICAL)
+        return
+    logging.disable(logging.NOTSET)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger().setLevel(level)
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}_total{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in the Prometheus sense"""
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    labels = _format_labels(self.labelnames + ('le',), key + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {series[-1]:.6f}')
+                lines.append(f'{self.name}_count{labels} {series[-2]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'spending_tracker_request_duration_seconds', 'Wall time per request',
+    SECONDS_BUCKETS, ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'spending_tracker_request_sql_statements', 'SQL statements run per request',
+    COUNT_BUCKETS, ('endpoint',))
+REQUEST_SQL_SECONDS = Histogram(
+    'spending_tracker_request_sql_seconds', 'Cumulative SQL time per request',
+    SECONDS_BUCKETS, ('endpoint',))
+TEMPLATE_SECONDS = Histogram(
+    'spending_tracker_template_render_seconds', 'Template render time',
+    SECONDS_BUCKETS, ('template',))
+SLOW_QUERIES = Counter(
+    'spending_tracker_slow_queries', 'SQL statements slower than the slow-query threshold',
+    ('endpoint',))
+
+ALL_METRICS = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, TEMPLATE_SECONDS, SLOW_QUERIES)
+
+
+class RequestStats:
+    """Counters for the request being handled"""
+
+    __slots__ = ('started', 'queries', 'query_seconds', 'template_seconds', 'template_starts')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_starts = []
+
+
+# Stats of the request running in the current thread/context, if any
+_current_stats = contextvars.ContextVar('spending_tracker_request_stats', default=None)
+
+
+def record_query(sql, seconds, statement_seconds, new_statement):
+    """Query observer installed on db connections (see db.set_query_observer)"""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.query_seconds += seconds
+        if new_statement:
+            stats.queries += 1
+
+    # Log a statement once, when its running total first crosses the threshold
+    threshold = SLOW_QUERY_MS / 1000
+    if statement_seconds >= threshold > statement_seconds - seconds:
+        endpoint = _endpoint() if stats is not None else 'none'
+        SLOW_QUERIES.inc(endpoint=endpoint)
+        slow_query_logger.warning('Slow query (%.1f ms, endpoint %s): %s',
+                                  statement_seconds * 1000, endpoint, ' '.join(str(sql).split()))
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _before_request():
+    g.request_stats = RequestStats()
+    g.request_stats_token = _current_stats.set(g.request_stats)
+
+
+def _after_request(response):
+    stats = g.get('request_stats')
+    if stats is None:
+        return response
+
+    elapsed = time.perf_counter() - stats.started
+    endpoint = _endpoint()
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_QUERIES.observe(stats.queries, endpoint=endpoint)
+    REQUEST_SQL_SECONDS.observe(stats.query_seconds, endpoint=endpoint)
+
+    response.headers['Server-Timing'] = (
+        f'app;dur={elapsed * 1000:.1f}, '
+        f'db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f'tpl;dur={stats.template_seconds * 1000:.1f}'
+    )
+    logger.debug('%s %s -> %s in %.1f ms (%d queries, %.1f ms SQL, %.1f ms templates)',
+                 request.method, request.full_path.rstrip('?'), response.status_code, elapsed * 1000,
+                 stats.queries, stats.query_seconds * 1000, stats.template_seconds * 1000)
+    return response
+
+
+def _teardown_request(exception=None):
+    token = g.pop('request_stats_token', None)
+    if token is not None:
+        _current_stats.reset(token)
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.template_starts.append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    stats = _current_stats.get()
+    if stats is None or not stats.template_starts:
+        return
+    seconds = time.perf_counter() - stats.template_starts.pop()
+    # Only count the outermost render; included templates are part of it
+    if not stats.template_starts:
+        stats.template_seconds += seconds
+    TEMPLATE_SECONDS.observe(seconds, template=template.name or 'string')
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Install the request hooks, the query observer and the /metrics endpoint"""
+    if not METRICS_ENABLED:
+        return
+    db.set_query_observer(record_query)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
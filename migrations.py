@@ -0,0 +1,763 @@
+"""
+Versioned, non-destructive schema migrations.
+
+The schema is built by the numbered migrations in ``MIGRATIONS``, applied in order.
+``schema_version`` records each applied migration, so the runner only applies the
+ones a database is missing. It runs at app startup (see app.py) and from
+``python manage.py migrate``.
+
+Each migration runs in its own ``BEGIN IMMEDIATE`` transaction together with its
+``schema_version`` row. The pending list is re-read after the write lock is taken,
+so processes starting at the same time never apply a migration twice, and a failed
+migration leaves the database at the previous version.
+
+Migration 1 is the original schema, written with ``IF NOT EXISTS``. Databases created
+before migrations existed therefore adopt it without changes and carry on from there.
+Never edit a migration that has shipped; add a new one instead.
+
+Every statement a migration runs lives in this file, as it was when the migration
+shipped. The modules that own those tables (rollups.py, revision.py, search.py,
+retention.py, months.py) keep their own copies for rebuilds and day-to-day use, so
+changing them never changes what an old migration does.
+"""
+
+import logging
+import re
+from collections import namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply'])
+
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+UPDATE_TIMESTAMP_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS update_expense_timestamp
+    AFTER UPDATE ON expenses
+    BEGIN
+        UPDATE expenses SET updated_at = CURRENT_TIMESTAMP
+        WHERE id = NEW.id;
+    END
+'''
+
+# The amount columns keep their DECIMAL declaration, but hold integer cents since
+# migration 5; their NUMERIC affinity stores whole numbers as exact integers
+BASELINE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS expense_types (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS months (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        month INTEGER NOT NULL CHECK (month >= 1 AND month <= 12),
+        year INTEGER NOT NULL CHECK (year >= 2020),
+        starting_bank_value DECIMAL(10, 2) DEFAULT 0.00,
+        monthly_income DECIMAL(10, 2) DEFAULT 0.00,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(month, year)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount DECIMAL(10, 2) NOT NULL,
+        description TEXT,
+        expense_type_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        recurring_interval TEXT CHECK (recurring_interval IN ('none', 'monthly', 'biannual', 'yearly') OR recurring_interval IS NULL),
+        recurring_day INTEGER CHECK (recurring_day >= 1 AND recurring_day <= 31),
+        is_recurring_template BOOLEAN DEFAULT FALSE,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (expense_type_id) REFERENCES expense_types(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS recurring_expense_instances (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        expense_id INTEGER NOT NULL,
+        month_id INTEGER NOT NULL,
+        instance_date DATE NOT NULL,
+        amount DECIMAL(10, 2) NOT NULL,
+        description TEXT,
+        expense_type_id INTEGER NOT NULL,
+        is_paid BOOLEAN DEFAULT FALSE,
+        paid_date DATE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (expense_id) REFERENCES expenses(id) ON DELETE CASCADE,
+        FOREIGN KEY (month_id) REFERENCES months(id) ON DELETE CASCADE,
+        FOREIGN KEY (expense_type_id) REFERENCES expense_types(id),
+        UNIQUE(expense_id, month_id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date)',
+    'CREATE INDEX IF NOT EXISTS idx_expenses_type ON expenses(expense_type_id)',
+    'CREATE INDEX IF NOT EXISTS idx_expenses_recurring ON expenses(recurring_interval)',
+    'CREATE INDEX IF NOT EXISTS idx_months_date ON months(year, month)',
+    UPDATE_TIMESTAMP_TRIGGER,
+]
+
+# Indexes for the hot read paths. The partial ones only hold active rows, which is
+# what every page filters on, and their WHERE clauses match the queries' exactly so
+# SQLite can use them (checked by check_query_plans()).
+HOT_PATH_INDEXES = [
+    # Recent expenses on the index and month pages: ORDER BY created_at DESC LIMIT 10
+    '''
+    CREATE INDEX IF NOT EXISTS idx_expenses_active_created
+    ON expenses(created_at) WHERE is_active = TRUE
+    ''',
+    # A month's active expenses by date range; covers the per-type sums
+    '''
+    CREATE INDEX IF NOT EXISTS idx_expenses_active_date
+    ON expenses(date, expense_type_id, amount) WHERE is_active = TRUE
+    ''',
+    # Recurring templates, read whenever recurring occurrences are expanded
+    '''
+    CREATE INDEX IF NOT EXISTS idx_expenses_recurring_templates
+    ON expenses(recurring_interval) WHERE is_active = TRUE AND is_recurring_template = TRUE
+    ''',
+    # Every active recurring expense, read when instances are generated for new months
+    '''
+    CREATE INDEX IF NOT EXISTS idx_expenses_active_recurring
+    ON expenses(recurring_interval) WHERE is_active = TRUE AND recurring_interval != 'none'
+    ''',
+    # Instances of a month: the join to months, the month rollup triggers and the
+    # ON DELETE CASCADE from months all look them up by month_id
+    '''
+    CREATE INDEX IF NOT EXISTS idx_instances_month
+    ON recurring_expense_instances(month_id, expense_type_id, amount)
+    ''',
+    # Exports read instances in date order
+    '''
+    CREATE INDEX IF NOT EXISTS idx_instances_date
+    ON recurring_expense_instances(instance_date)
+    ''',
+    # Superseded by the partial indexes above, which every query filters on
+    'DROP INDEX IF EXISTS idx_expenses_date',
+    'DROP INDEX IF EXISTS idx_expenses_recurring',
+]
+
+# Migration 2: the month totals rollup. The triggers apply a signed
+# (year, month, expense_type_id, amount, count) delta to both tables
+_V2_UPSERT_TYPE_TOTALS = '''
+    INSERT INTO month_type_totals (year, month, expense_type_id, total, expense_count)
+    {select}
+    ON CONFLICT (year, month, expense_type_id) DO UPDATE SET
+        total = total + excluded.total,
+        expense_count = expense_count + excluded.expense_count;
+'''
+
+_V2_UPSERT_MONTH_TOTALS = '''
+    INSERT INTO month_totals (year, month, total, expense_count)
+    SELECT year, month, SUM(amount), SUM(cnt) FROM ({select}) GROUP BY year, month
+    ON CONFLICT (year, month) DO UPDATE SET
+        total = total + excluded.total,
+        expense_count = expense_count + excluded.expense_count;
+'''
+
+
+def _v2_apply(select):
+    return _V2_UPSERT_TYPE_TOTALS.format(select=select) + _V2_UPSERT_MONTH_TOTALS.format(select=select)
+
+
+def _v2_expense_row(ref, sign):
+    return f'''
+        SELECT CAST(substr({ref}.date, 1, 4) AS INTEGER) AS year,
+               CAST(substr({ref}.date, 6, 2) AS INTEGER) AS month,
+               {ref}.expense_type_id AS expense_type_id,
+               {sign}{ref}.amount AS amount, {sign}1 AS cnt
+        WHERE {ref}.is_active
+    '''
+
+
+def _v2_instance_row(ref, sign):
+    return f'''
+        SELECT m.year AS year, m.month AS month, {ref}.expense_type_id AS expense_type_id,
+               {sign}{ref}.amount AS amount, {sign}1 AS cnt
+        FROM months m WHERE m.id = {ref}.month_id
+    '''
+
+
+def _v2_month_instances(ref, sign):
+    return f'''
+        SELECT {ref}.year AS year, {ref}.month AS month, expense_type_id,
+               {sign}SUM(amount) AS amount, {sign}COUNT(*) AS cnt
+        FROM recurring_expense_instances WHERE month_id = {ref}.id
+        GROUP BY expense_type_id
+    '''
+
+
+V2_MONTH_TOTALS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS month_totals (
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (year, month)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS month_type_totals (
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        expense_type_id INTEGER NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (year, month, expense_type_id)
+    ) WITHOUT ROWID
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_expense_insert
+    AFTER INSERT ON expenses WHEN NEW.is_active
+    BEGIN {_v2_apply(_v2_expense_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_expense_update
+    AFTER UPDATE OF amount, date, expense_type_id, is_active ON expenses
+    BEGIN {_v2_apply(_v2_expense_row('OLD', '-'))} {_v2_apply(_v2_expense_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_expense_delete
+    AFTER DELETE ON expenses WHEN OLD.is_active
+    BEGIN {_v2_apply(_v2_expense_row('OLD', '-'))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_instance_insert
+    AFTER INSERT ON recurring_expense_instances
+    BEGIN {_v2_apply(_v2_instance_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_instance_update
+    AFTER UPDATE OF amount, month_id, expense_type_id ON recurring_expense_instances
+    BEGIN {_v2_apply(_v2_instance_row('OLD', '-'))} {_v2_apply(_v2_instance_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_instance_delete
+    AFTER DELETE ON recurring_expense_instances
+    BEGIN {_v2_apply(_v2_instance_row('OLD', '-'))} END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS month_totals_month_delete
+    BEFORE DELETE ON months
+    BEGIN
+        DELETE FROM recurring_expense_instances WHERE month_id = OLD.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_month_update
+    AFTER UPDATE OF month, year ON months
+    BEGIN {_v2_apply(_v2_month_instances('OLD', '-'))} {_v2_apply(_v2_month_instances('NEW', ''))} END
+    ''',
+]
+
+# Fills both rollup tables from the raw tables (they must be empty)
+V2_POPULATE_MONTH_TOTALS = [
+    '''
+    INSERT INTO month_type_totals (year, month, expense_type_id, total, expense_count)
+    SELECT year, month, expense_type_id, SUM(amount), COUNT(*)
+    FROM (
+        SELECT CAST(substr(e.date, 1, 4) AS INTEGER) AS year,
+               CAST(substr(e.date, 6, 2) AS INTEGER) AS month,
+               e.expense_type_id, e.amount
+        FROM expenses e
+        WHERE e.is_active = TRUE
+        UNION ALL
+        SELECT m.year, m.month, rei.expense_type_id, rei.amount
+        FROM recurring_expense_instances rei
+        JOIN months m ON rei.month_id = m.id
+    )
+    GROUP BY year, month, expense_type_id
+    ''',
+    '''
+    INSERT INTO month_totals (year, month, total, expense_count)
+    SELECT year, month, SUM(total), SUM(expense_count)
+    FROM month_type_totals
+    GROUP BY year, month
+    ''',
+]
+
+# Migration 3: the revision row and the triggers that bump it
+V3_REVISION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS db_revision (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        epoch TEXT NOT NULL,
+        revision INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "INSERT OR IGNORE INTO db_revision (id, epoch, revision) VALUES (1, lower(hex(randomblob(8))), 0)",
+] + [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS db_revision_{table}_{operation.lower()}
+    AFTER {operation} ON {table}
+    BEGIN
+        UPDATE db_revision SET revision = revision + 1 WHERE id = 1;
+    END
+    '''
+    for table in ('expense_types', 'months', 'expenses', 'recurring_expense_instances')
+    for operation in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Migration 6: the description search index
+_V6_TYPE_NAME = '(SELECT name FROM expense_types WHERE id = {ref}.expense_type_id)'
+
+V6_SEARCH_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS expense_search USING fts5(
+        description, type_name, tokenize = 'trigram'
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_expense_insert
+    AFTER INSERT ON expenses WHEN NEW.is_active
+    BEGIN
+        INSERT INTO expense_search (rowid, description, type_name)
+        VALUES (NEW.id * 2, NEW.description, {_V6_TYPE_NAME.format(ref='NEW')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_expense_update
+    AFTER UPDATE OF description, expense_type_id, is_active ON expenses
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2;
+        INSERT INTO expense_search (rowid, description, type_name)
+        SELECT NEW.id * 2, NEW.description, {_V6_TYPE_NAME.format(ref='NEW')}
+        WHERE NEW.is_active;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_expense_delete
+    AFTER DELETE ON expenses
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_instance_insert
+    AFTER INSERT ON recurring_expense_instances
+    BEGIN
+        INSERT INTO expense_search (rowid, description, type_name)
+        VALUES (NEW.id * 2 + 1, NEW.description, {_V6_TYPE_NAME.format(ref='NEW')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_instance_update
+    AFTER UPDATE OF description, expense_type_id ON recurring_expense_instances
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2 + 1;
+        INSERT INTO expense_search (rowid, description, type_name)
+        VALUES (NEW.id * 2 + 1, NEW.description, {_V6_TYPE_NAME.format(ref='NEW')});
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_instance_delete
+    AFTER DELETE ON recurring_expense_instances
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2 + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_type_rename
+    AFTER UPDATE OF name ON expense_types
+    BEGIN
+        UPDATE expense_search SET type_name = NEW.name
+        WHERE rowid IN (
+            SELECT id * 2 FROM expenses WHERE expense_type_id = NEW.id AND is_active = TRUE
+            UNION ALL
+            SELECT id * 2 + 1 FROM recurring_expense_instances WHERE expense_type_id = NEW.id
+        );
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_type_delete
+    AFTER DELETE ON expense_types
+    BEGIN
+        UPDATE expense_search SET type_name = NULL
+        WHERE rowid IN (
+            SELECT id * 2 FROM expenses WHERE expense_type_id = OLD.id AND is_active = TRUE
+            UNION ALL
+            SELECT id * 2 + 1 FROM recurring_expense_instances WHERE expense_type_id = OLD.id
+        );
+    END
+    ''',
+]
+
+V6_POPULATE_SEARCH = [
+    '''
+    INSERT INTO expense_search (rowid, description, type_name)
+    SELECT e.id * 2, e.description, et.name
+    FROM expenses e
+    LEFT JOIN expense_types et ON e.expense_type_id = et.id
+    WHERE e.is_active = TRUE
+    ''',
+    '''
+    INSERT INTO expense_search (rowid, description, type_name)
+    SELECT rei.id * 2 + 1, rei.description, et.name
+    FROM recurring_expense_instances rei
+    LEFT JOIN expense_types et ON rei.expense_type_id = et.id
+    ''',
+    # Merge the index segments written above into one
+    "INSERT INTO expense_search (expense_search) VALUES ('optimize')",
+]
+
+# Migration 7: the archive table, deletion stamps and the index of rows to archive
+V7_ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS expenses_archive (
+        id INTEGER PRIMARY KEY,
+        amount DECIMAL(10, 2) NOT NULL,
+        description TEXT,
+        expense_type_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        recurring_interval TEXT,
+        recurring_day INTEGER,
+        is_recurring_template BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        deleted_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_expenses_archive_deleted ON expenses_archive(deleted_at)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expenses_deleted_at
+    AFTER UPDATE OF is_active ON expenses
+    WHEN OLD.is_active IS NOT NEW.is_active
+    BEGIN
+        UPDATE expenses
+        SET deleted_at = CASE WHEN NEW.is_active THEN NULL ELSE CURRENT_TIMESTAMP END
+        WHERE id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_expenses_deleted
+    ON expenses(deleted_at) WHERE is_active = FALSE
+    ''',
+]
+
+# Migration 8: every existing month gets an instance of each active template it is
+# due in, except the template's own month. Monthly templates fall on recurring_day
+# (if set), the others on their own day; days past the end of a short month are
+# clamped to its last day.
+V8_INSERT_MISSING_INSTANCES = '''
+    WITH templates AS (
+        SELECT id, amount, description, expense_type_id,
+               CASE WHEN recurring_interval = 'monthly' AND recurring_day IS NOT NULL
+                    THEN recurring_day ELSE CAST(substr(date, 9, 2) AS INTEGER) END AS day,
+               CAST(substr(date, 1, 4) AS INTEGER) * 12 + CAST(substr(date, 6, 2) AS INTEGER) - 1 AS origin,
+               CASE recurring_interval WHEN 'monthly' THEN 1 WHEN 'biannual' THEN 6 ELSE 12 END AS step
+        FROM expenses
+        WHERE is_active = TRUE AND is_recurring_template = TRUE
+          AND recurring_interval IN ('monthly', 'biannual', 'yearly')
+    ),
+    month_days AS (
+        SELECT id, year, month, year * 12 + month - 1 AS idx,
+               CAST(strftime('%d', printf('%04d-%02d-01', year, month), '+1 month', '-1 day') AS INTEGER) AS days
+        FROM months
+    )
+    INSERT INTO recurring_expense_instances
+    (expense_id, month_id, instance_date, amount, description, expense_type_id)
+    SELECT t.id, m.id, printf('%04d-%02d-%02d', m.year, m.month, min(t.day, m.days)),
+           t.amount, t.description, t.expense_type_id
+    FROM templates t
+    JOIN month_days m ON (m.idx - t.origin) % t.step = 0 AND m.idx != t.origin
+    WHERE NOT EXISTS (
+        SELECT 1 FROM recurring_expense_instances rei
+        WHERE rei.expense_id = t.id AND rei.month_id = m.id
+    )
+    ORDER BY m.id, t.id
+'''
+
+
+def _table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _execute_all(conn, statements):
+    for statement in statements:
+        conn.execute(statement)
+
+
+def _drop_triggers(conn, pattern):
+    """Drop the triggers whose names match a GLOB pattern"""
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB ?", (pattern,)
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+
+
+def _baseline(conn):
+    _execute_all(conn, BASELINE_SCHEMA)
+
+
+def _month_totals(conn):
+    # Databases that had the rollup before migrations existed keep their totals
+    populate = not _table_exists(conn, 'month_totals')
+    _execute_all(conn, V2_MONTH_TOTALS_SCHEMA)
+    if populate:
+        _execute_all(conn, V2_POPULATE_MONTH_TOTALS)
+
+
+def _revision_tracking(conn):
+    _execute_all(conn, V3_REVISION_SCHEMA)
+
+
+def _hot_path_indexes(conn):
+    _execute_all(conn, HOT_PATH_INDEXES)
+    # Without statistics for the new indexes the planner can pick one that scans
+    # every row (e.g. the date index for the recurring templates), so gather them
+    conn.execute('ANALYZE expenses')
+    conn.execute('ANALYZE recurring_expense_instances')
+
+
+def _integer_cents(conn):
+    # Converting every row would fire the rollup, revision and updated_at triggers
+    # once per row, so drop them and put them back afterwards. The rollup is derived
+    # data and is rebuilt from the converted amounts.
+    _drop_triggers(conn, 'month_totals_*')
+    conn.execute('DROP TABLE IF EXISTS month_type_totals')
+    conn.execute('DROP TABLE IF EXISTS month_totals')
+    _drop_triggers(conn, 'db_revision_*')
+    conn.execute('DROP TRIGGER IF EXISTS update_expense_timestamp')
+    # Rewriting every entry of the indexes that cover amount costs several times
+    # more than building them again afterwards
+    amount_indexes = [statement for statement in HOT_PATH_INDEXES
+                      if 'idx_expenses_active_date' in statement or 'idx_instances_month' in statement]
+    conn.execute('DROP INDEX IF EXISTS idx_expenses_active_date')
+    conn.execute('DROP INDEX IF EXISTS idx_instances_month')
+
+    conn.execute('UPDATE expenses SET amount = CAST(ROUND(amount * 100) AS INTEGER)')
+    conn.execute('UPDATE recurring_expense_instances SET amount = CAST(ROUND(amount * 100) AS INTEGER)')
+    conn.execute('''
+        UPDATE months
+        SET monthly_income = CAST(ROUND(COALESCE(monthly_income, 0) * 100) AS INTEGER),
+            starting_bank_value = CAST(ROUND(COALESCE(starting_bank_value, 0) * 100) AS INTEGER)
+    ''')
+
+    _execute_all(conn, amount_indexes)
+    conn.execute(UPDATE_TIMESTAMP_TRIGGER)
+    _execute_all(conn, V3_REVISION_SCHEMA)
+    # The triggers were off, so advance the revision by hand
+    conn.execute('UPDATE db_revision SET revision = revision + 1 WHERE id = 1')
+    _execute_all(conn, V2_MONTH_TOTALS_SCHEMA)
+    _execute_all(conn, V2_POPULATE_MONTH_TOTALS)
+
+
+def _description_search(conn):
+    _execute_all(conn, V6_SEARCH_SCHEMA)
+    _execute_all(conn, V6_POPULATE_SEARCH)
+
+
+def _expense_archive(conn):
+    # The updated_at trigger would fire for every row of the backfill below
+    conn.execute('DROP TRIGGER IF EXISTS update_expense_timestamp')
+    conn.execute('ALTER TABLE expenses ADD COLUMN deleted_at TIMESTAMP')
+    # Expenses deleted before this migration: their last update was the deletion
+    conn.execute('UPDATE expenses SET deleted_at = updated_at WHERE is_active = FALSE')
+    conn.execute(UPDATE_TIMESTAMP_TRIGGER)
+    _execute_all(conn, V7_ARCHIVE_SCHEMA)
+    # Only active expenses are looked up by type; deleting a type now checks its
+    # foreign keys with a scan, which is rare next to the reads that use this index
+    conn.execute('DROP INDEX IF EXISTS idx_expenses_type')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_active_type
+        ON expenses(expense_type_id) WHERE is_active = TRUE
+    ''')
+    conn.execute('ANALYZE expenses')
+
+
+def _materialized_instances(conn):
+    # Pages now read recurring expenses from the instances instead of expanding the
+    # templates. Month creation used to add an instance in a template's own month,
+    # where the template row already counts, so drop those; then fill in the
+    # instances of templates created after their months existed. Existing instances
+    # keep their amounts, which the month totals already include.
+    conn.execute('''
+        DELETE FROM recurring_expense_instances
+        WHERE id IN (
+            SELECT rei.id
+            FROM recurring_expense_instances rei
+            JOIN expenses t ON t.id = rei.expense_id
+            JOIN months m ON m.id = rei.month_id
+            WHERE t.is_recurring_template = TRUE
+              AND m.year = CAST(substr(t.date, 1, 4) AS INTEGER)
+              AND m.month = CAST(substr(t.date, 6, 2) AS INTEGER)
+        )
+    ''')
+    conn.execute(V8_INSERT_MISSING_INSTANCES)
+
+
+MIGRATIONS = [
+    Migration(1, 'baseline schema', _baseline),
+    Migration(2, 'month totals rollup', _month_totals),
+    Migration(3, 'revision tracking', _revision_tracking),
+    Migration(4, 'hot-path indexes', _hot_path_indexes),
+    Migration(5, 'amounts in integer cents', _integer_cents),
+    Migration(6, 'description search index', _description_search),
+    Migration(7, 'expense archive', _expense_archive),
+    Migration(8, 'materialized recurring instances', _materialized_instances),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def applied_versions(conn):
+    """Versions recorded in schema_version (empty if the table doesn't exist yet)"""
+    if not _table_exists(conn, 'schema_version'):
+        return set()
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+
+def current_version(conn):
+    """Highest applied migration version, 0 for an unmigrated database"""
+    return max(applied_versions(conn), default=0)
+
+
+def pending_migrations(conn, target=None):
+    """Migrations not yet applied, up to ``target`` (default: all)"""
+    applied = applied_versions(conn)
+    return [migration for migration in MIGRATIONS
+            if migration.version not in applied and (target is None or migration.version <= target)]
+
+
+def migrate(conn, target=None):
+    """Apply every pending migration, each in its own transaction
+
+    Args:
+        conn: Database connection with no transaction open
+        target: Stop after this version (default: the latest)
+
+    Returns:
+        List of the Migrations applied
+    """
+    if conn.in_transaction:
+        raise RuntimeError('migrate() needs a connection without an open transaction')
+
+    applied = []
+    for migration in pending_migrations(conn, target):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(SCHEMA_VERSION_TABLE)
+            # Another process may have applied it while we waited for the lock
+            if migration.version in applied_versions(conn):
+                conn.rollback()
+                continue
+            logger.info("Applying migration %d: %s", migration.version, migration.name)
+            migration.apply(conn)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)',
+                         (migration.version, migration.name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration %d (%s) failed", migration.version, migration.name)
+            raise
+        applied.append(migration)
+    return applied
+
+
+# Hot queries and the indexes each may use, for check_query_plans(). The first is
+# the one it was written for; the others are what SQLite picks without statistics.
+HOT_QUERIES = [
+    ('recent expenses', '''
+        SELECT e.id, e.amount, e.description, e.date, et.name as expense_type_name, e.created_at
+        FROM expenses e
+        JOIN expense_types et ON e.expense_type_id = et.id
+        WHERE e.is_active = TRUE
+        ORDER BY e.created_at DESC
+        LIMIT 10
+    ''', (), ('idx_expenses_active_created',)),
+    ('month expenses by date', '''
+        SELECT expense_type_id, SUM(amount)
+        FROM expenses e
+        WHERE e.is_active = TRUE AND e.date >= ? AND e.date < ?
+        GROUP BY expense_type_id
+    ''', ('2024-01-01', '2024-02-01'), ('idx_expenses_active_date',)),
+    ('recurring templates', '''
+        SELECT id, amount, description, date, expense_type_id, recurring_interval, recurring_day
+        FROM expenses
+        WHERE is_active = TRUE AND is_recurring_template = TRUE
+          AND recurring_interval IN ('monthly', 'biannual', 'yearly')
+    ''', (), ('idx_expenses_recurring_templates',)),
+    ('active recurring expenses', '''
+        SELECT id, amount, description, date, expense_type_id, recurring_interval, recurring_day
+        FROM expenses
+        WHERE is_active = TRUE AND recurring_interval != 'none'
+    ''', (), ('idx_expenses_active_recurring', 'idx_expenses_active_type')),
+    ('active expenses of a type', '''
+        SELECT id FROM expenses WHERE expense_type_id = ? AND is_active = TRUE
+    ''', (1,), ('idx_expenses_active_type',)),
+    ('deleted expenses to archive', '''
+        SELECT id FROM expenses
+        WHERE is_active = FALSE AND deleted_at < datetime('now', '-30 days')
+        ORDER BY deleted_at
+        LIMIT 500
+    ''', (), ('idx_expenses_deleted',)),
+    ('instances joined to months', '''
+        SELECT m.year, m.month, rei.expense_type_id, SUM(rei.amount)
+        FROM months m
+        JOIN recurring_expense_instances rei ON rei.month_id = m.id
+        WHERE m.year = ? AND m.month = ?
+        GROUP BY rei.expense_type_id
+    ''', (2024, 1), ('idx_instances_month',)),
+]
+
+
+QueryPlanCheck = namedtuple('QueryPlanCheck', [
+    'name',
+    'allowed',         # indexes it may use, the one it was written for first
+    'indexes',         # indexes the plan uses
+    'ok',              # True if it uses an allowed index and scans no table in full
+    'plan',            # EXPLAIN QUERY PLAN details, one string per step
+])
+
+_PLAN_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+
+def explain(conn, sql, params=()):
+    """The EXPLAIN QUERY PLAN details of a statement, one string per plan step"""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def _full_scan(step):
+    """Whether a plan step reads a whole table ("SCAN expenses", not "SCAN e USING INDEX ...")"""
+    return step.startswith('SCAN ') and ' USING ' not in step and step != 'SCAN CONSTANT ROW'
+
+
+def check_query_plans(conn):
+    """Run EXPLAIN QUERY PLAN on the hot queries
+
+    A query passes if its plan uses one of its allowed indexes and has no full
+    table scan. Which of several suitable indexes SQLite picks depends on the
+    statistics ANALYZE gathered (none on a new database), so a query can allow
+    more than one; a plan that uses none of them means an index is missing or
+    the query no longer matches it. Statistics gathered from a handful of rows
+    can also fail a query, since scanning any index is as cheap as the right
+    one there; run ANALYZE again once the tables have grown.
+
+    Returns:
+        List of QueryPlanCheck
+    """
+    results = []
+    for name, sql, params, allowed in HOT_QUERIES:
+        plan = explain(conn, sql, params)
+        indexes = [match.group(1) for step in plan for match in _PLAN_INDEX.finditer(step)]
+        ok = any(index in allowed for index in indexes) and not any(_full_scan(step) for step in plan)
+        results.append(QueryPlanCheck(name, allowed, indexes, ok, plan))
+    return results
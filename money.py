@@ -0,0 +1,53 @@
+"""
+Money amounts are stored and summed as integer cents.
+
+Every amount column (expense and instance amounts, month income and starting bank
+value, the rollup totals) holds a whole number of cents, so ``SUM()`` in SQLite is
+exact and no totals drift from float rounding. Values are converted here at the
+edges only: ``to_cents`` for form, JSON, CLI and file input, and ``from_cents`` /
+``format_money`` for JSON output and display.
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENTS_PER_UNIT = 100
+
+
+def to_cents(value):
+    """Convert an amount in dollars ('12.5', '$1,234.56', 12.5, Decimal) to integer cents
+
+    Half cents round away from zero. Raises ValueError for anything that isn't a
+    finite number.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid amount '{value}'")
+    if isinstance(value, float):
+        # repr() gives the shortest string that round-trips, so 0.1 stays 0.1
+        value = repr(value)
+    text = str(value).strip().replace(',', '').replace('$', '')
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount '{value}'")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount '{value}'")
+    return int((amount * CENTS_PER_UNIT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Integer cents as a float amount in dollars, for JSON and form values"""
+    return (cents or 0) / CENTS_PER_UNIT
+
+
+def format_money(cents):
+    """Integer cents as a '1234.56' string, formatted exactly"""
+    cents = int(cents or 0)
+    sign = '-' if cents < 0 else ''
+    units, remainder = divmod(abs(cents), CENTS_PER_UNIT)
+    return f'{sign}{units}.{remainder:02d}'
+
+
+def init_app(app):
+    """Register the ``money`` and ``units`` template filters"""
+    app.add_template_filter(format_money, 'money')
+    app.add_template_filter(from_cents, 'units')
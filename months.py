@@ -0,0 +1,221 @@
+"""
+Batched creation of months and their recurring expense instances.
+
+``create_months`` adds any number of months in one transaction: the months rows
+with one ``INSERT OR IGNORE`` executemany, then every recurring instance for all of
+them from a single template scan (see recurrence.py) with another ``INSERT OR
+IGNORE`` executemany. Existing months and instances are left alone, relying on
+``UNIQUE(month, year)`` and ``UNIQUE(expense_id, month_id)``, so re-running it over
+a range only fills in what is missing. That makes it safe for backfills.
+
+``sync_recurring_instances`` brings the instances of existing months in line with
+the templates as they are now: missing instances are added, and from a given month
+on, instances of edited templates are updated and those of deleted templates
+removed. The instance scheduler (see scheduler.py) runs it in the background.
+"""
+
+from collections import namedtuple
+
+from metadata_cache import invalidate as invalidate_metadata
+from recurrence import expand_occurrences, index_to_month, load_templates, month_index
+
+# Largest range create_months() accepts in one call (50 years)
+MAX_MONTHS = 600
+
+SyncResult = namedtuple('SyncResult', [
+    'inserted',  # instances added for occurrences that had none
+    'updated',   # instances rewritten after their template changed
+    'deleted',   # instances whose template no longer has that occurrence
+])
+
+MonthRangeResult = namedtuple('MonthRangeResult', [
+    'months',             # list of (year, month, month_id) for the whole range
+    'months_created',     # months rows that did not exist before
+    'instances_created',  # recurring instances that did not exist before
+])
+
+
+def month_range(start_year, start_month, end_year, end_month):
+    """Every (year, month) from the start month to the end month, inclusive"""
+    first = month_index(start_year, start_month)
+    last = month_index(end_year, end_month)
+    if last < first:
+        raise ValueError('The end month is before the start month')
+    if last - first + 1 > MAX_MONTHS:
+        raise ValueError(f'At most {MAX_MONTHS} months can be created at once')
+    return [index_to_month(index) for index in range(first, last + 1)]
+
+
+def parse_year_month(value):
+    """Parse 'YYYY-MM' into (year, month)"""
+    try:
+        year, month = (int(part) for part in str(value).strip().split('-'))
+    except ValueError:
+        raise ValueError(f"Expected a month like 2024-01, got '{value}'")
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month in '{value}'")
+    return year, month
+
+
+def generate_recurring_instances(conn, month_ids):
+    """Insert the recurring instances for a set of months, skipping existing ones
+
+    Args:
+        conn: Database connection (the caller commits)
+        month_ids: Dict mapping (year, month) to the months row id
+
+    Returns:
+        Number of instances inserted
+    """
+    if not month_ids:
+        return 0
+    # The occurrences the views show: a template's own month has the template row
+    occurrences = expand_occurrences(load_templates(conn), month_ids, skip_origin_month=True)
+
+    cursor = conn.executemany('''
+        INSERT OR IGNORE INTO recurring_expense_instances
+        (expense_id, month_id, instance_date, amount, description, expense_type_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (
+        (occ.template.id, month_ids[ym], occ.date, occ.template.amount,
+         occ.template.description, occ.template.expense_type_id)
+        for ym, month_occurrences in occurrences.items()
+        for occ in month_occurrences
+    ))
+    # rowcount leaves out ignored duplicates and rows written by triggers
+    return cursor.rowcount
+
+
+def sync_recurring_instances(conn, first=None, last=None, rewrite_from=None, template_ids=None):
+    """Make the recurring instances of existing months match the active templates
+
+    Instances a template should have are inserted in every month of the range. In
+    months from ``rewrite_from`` on, instances whose template changed are updated
+    (date, amount, description and type; is_paid is kept) and those with no
+    matching occurrence, because their template was deleted, stopped recurring or
+    moved, are deleted. Earlier months keep the instances they have, so editing a
+    template never rewrites history.
+
+    Args:
+        conn: Database connection (the caller commits)
+        first, last: Month indexes (see recurrence.month_index) of the range,
+            inclusive; None leaves that end open
+        rewrite_from: Month index from which instances are rewritten (default:
+            none are, only missing ones are added)
+        template_ids: Only sync the instances of these expense ids (default: all)
+
+    Returns:
+        SyncResult with the numbers of instances inserted, updated and deleted
+    """
+    bounds = (*index_to_month(first if first is not None else 0),
+              *index_to_month(last if last is not None else month_index(9999, 12)))
+    month_ids = {
+        (row['year'], row['month']): row['id']
+        for row in conn.execute('''
+            SELECT id, year, month FROM months
+            WHERE (year, month) BETWEEN (?, ?) AND (?, ?)
+        ''', bounds)
+    }
+    if not month_ids:
+        return SyncResult(0, 0, 0)
+    if template_ids is not None:
+        template_ids = {int(template_id) for template_id in template_ids}
+    rewritten = {month_id for (year, month), month_id in month_ids.items()
+                 if rewrite_from is not None and month_index(year, month) >= rewrite_from}
+
+    templates = [template for template in load_templates(conn)
+                 if template_ids is None or template.id in template_ids]
+    wanted = {
+        (occ.template.id, month_ids[ym]): (occ.date, occ.template.amount,
+                                           occ.template.description, occ.template.expense_type_id)
+        for ym, month_occurrences in expand_occurrences(templates, month_ids, skip_origin_month=True).items()
+        for occ in month_occurrences
+    }
+
+    # The range's instances as they are, keyed like ``wanted``
+    existing = {}
+    for row in conn.execute('''
+        SELECT rei.id, rei.expense_id, rei.month_id, rei.instance_date, rei.amount,
+               rei.description, rei.expense_type_id
+        FROM months m
+        JOIN recurring_expense_instances rei ON rei.month_id = m.id
+        WHERE (m.year, m.month) BETWEEN (?, ?) AND (?, ?)
+    ''', bounds):
+        if template_ids is None or row['expense_id'] in template_ids:
+            existing[(row['expense_id'], row['month_id'])] = (
+                row['id'], (row['instance_date'], row['amount'], row['description'], row['expense_type_id']))
+
+    inserts = [(*key, *values) for key, values in wanted.items() if key not in existing]
+    updates, deletes = [], []
+    for key, (instance_id, values) in existing.items():
+        if key[1] not in rewritten:
+            continue
+        if key not in wanted:
+            deletes.append((instance_id,))
+        elif wanted[key] != values:
+            updates.append((*wanted[key], instance_id))
+
+    if inserts:
+        conn.executemany('''
+            INSERT INTO recurring_expense_instances
+            (expense_id, month_id, instance_date, amount, description, expense_type_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', inserts)
+    if updates:
+        conn.executemany('''
+            UPDATE recurring_expense_instances
+            SET instance_date = ?, amount = ?, description = ?, expense_type_id = ?
+            WHERE id = ?
+        ''', updates)
+    if deletes:
+        conn.executemany('DELETE FROM recurring_expense_instances WHERE id = ?', deletes)
+    return SyncResult(len(inserts), len(updates), len(deletes))
+
+
+def create_months(conn, year_months, monthly_income=0, starting_bank_value=0):
+    """Create months and their recurring instances in one transaction
+
+    Args:
+        conn: Database connection
+        year_months: Iterable of (year, month); months that already exist are kept
+            as they are (income included) but still get missing instances
+        monthly_income, starting_bank_value: Values for newly created months, in cents
+
+    Returns:
+        MonthRangeResult
+    """
+    year_months = sorted({(int(year), int(month)) for year, month in year_months})
+    if not year_months:
+        return MonthRangeResult([], 0, 0)
+
+    try:
+        months_created = conn.executemany('''
+            INSERT OR IGNORE INTO months (month, year, starting_bank_value, monthly_income)
+            VALUES (?, ?, ?, ?)
+        ''', [(month, year, starting_bank_value, monthly_income) for year, month in year_months]).rowcount
+
+        wanted = set(year_months)
+        first, last = year_months[0], year_months[-1]
+        month_ids = {
+            (row['year'], row['month']): row['id']
+            for row in conn.execute('''
+                SELECT id, year, month FROM months
+                WHERE (year, month) BETWEEN (?, ?) AND (?, ?)
+            ''', (*first, *last))
+            if (row['year'], row['month']) in wanted
+        }
+        if len(month_ids) != len(wanted):
+            # Only rows rejected by the months CHECK constraints go missing
+            missing = sorted(wanted - set(month_ids))
+            raise ValueError(f'Invalid month(s): {", ".join(f"{y}-{m:02d}" for y, m in missing[:5])}')
+
+        instances_created = generate_recurring_instances(conn, month_ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if months_created:
+        invalidate_metadata(conn)
+    months = [(year, month, month_ids[(year, month)]) for year, month in year_months]
+    return MonthRangeResult(months, months_created, instances_created)
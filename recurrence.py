@@ -0,0 +1,159 @@
+"""
+Recurrence engine shared by month creation, the instance scheduler and the forecast.
+
+Recurring expense templates are read and parsed once, then expanded into concrete
+occurrences for any number of months in a single pass. Month lengths and
+occurrence dates are memoized, so expanding 120 months costs one template scan
+plus cheap integer arithmetic per matching month.
+
+Recurrence rules:
+- 'monthly': every month, on ``recurring_day`` (or the template's day of month)
+- 'biannual': every 6 months counted from the template's month, same day
+- 'yearly': every 12 months, i.e. the template's month each year, same day
+Days past the end of a short month are clamped to its last day.
+"""
+
+import calendar
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+# Number of months between occurrences for each recurring_interval
+INTERVAL_MONTHS = {
+    'monthly': 1,
+    'biannual': 6,
+    'yearly': 12,
+}
+
+RecurringTemplate = namedtuple('RecurringTemplate', [
+    'id', 'amount', 'description', 'expense_type_id', 'date',
+    'recurring_interval', 'recurring_day',
+    'origin_index',     # month_index() of the template's own date
+    'interval_months',  # months between occurrences
+    'day',              # day of month the occurrences fall on (before clamping)
+])
+
+Occurrence = namedtuple('Occurrence', ['template', 'year', 'month', 'date'])
+
+
+def month_index(year, month):
+    """Number of months since year 0, so month arithmetic becomes integer arithmetic"""
+    return int(year) * 12 + int(month) - 1
+
+
+def index_to_month(index):
+    """Inverse of month_index(): returns (year, month)"""
+    year, month0 = divmod(index, 12)
+    return year, month0 + 1
+
+
+@lru_cache(maxsize=None)
+def days_in_month(year, month):
+    """Length of a month in days"""
+    return calendar.monthrange(year, month)[1]
+
+
+@lru_cache(maxsize=8192)
+def occurrence_date(year, month, day):
+    """ISO date string for ``day`` in the given month, clamped to the month's length"""
+    return f"{year:04d}-{month:02d}-{min(day, days_in_month(year, month)):02d}"
+
+
+def parse_template(row):
+    """Build a RecurringTemplate from an expenses row, or None if it does not recur"""
+    interval_months = INTERVAL_MONTHS.get(row['recurring_interval'])
+    if interval_months is None:
+        return None
+
+    original_date = datetime.strptime(row['date'], '%Y-%m-%d').date()
+
+    # Only monthly recurrences honour recurring_day; the others reuse the original day
+    day = original_date.day
+    if row['recurring_interval'] == 'monthly' and row['recurring_day'] is not None:
+        day = int(row['recurring_day'])
+
+    return RecurringTemplate(
+        id=row['id'],
+        amount=row['amount'],
+        description=row['description'],
+        expense_type_id=row['expense_type_id'],
+        date=row['date'],
+        recurring_interval=row['recurring_interval'],
+        recurring_day=row['recurring_day'],
+        origin_index=month_index(original_date.year, original_date.month),
+        interval_months=interval_months,
+        day=day,
+    )
+
+
+def load_templates(conn, templates_only=True):
+    """Read and parse all active recurring expenses with a single query
+
+    Args:
+        conn: Database connection
+        templates_only: Only include rows flagged as recurring templates
+
+    Returns:
+        List of RecurringTemplate
+    """
+    query = '''
+        SELECT id, amount, description, date, expense_type_id, recurring_interval, recurring_day
+        FROM expenses
+        WHERE is_active = TRUE AND recurring_interval != 'none'
+    '''
+    if templates_only:
+        query += ' AND is_recurring_template = TRUE'
+
+    templates = []
+    for row in conn.execute(query):
+        template = parse_template(row)
+        if template is not None:
+            templates.append(template)
+    return templates
+
+
+def expand_occurrences(templates, months, skip_origin_month=False):
+    """Expand templates into occurrences for a set of months in one pass
+
+    Args:
+        templates: Iterable of RecurringTemplate (see load_templates)
+        months: Iterable of (year, month) pairs
+        skip_origin_month: Leave out the month a template itself is dated in, where
+            the template row already counts as the expense
+
+    Returns:
+        Dict mapping each requested (year, month) to its list of Occurrence, in
+        template order
+    """
+    wanted = {month_index(year, month): (int(year), int(month)) for year, month in months}
+    result = {ym: [] for ym in wanted.values()}
+    if not wanted:
+        return result
+
+    first, last = min(wanted), max(wanted)
+    for template in templates:
+        step = template.interval_months
+        # First month in range that is a whole number of intervals from the origin
+        index = first + (template.origin_index - first) % step
+        while index <= last:
+            if index in wanted and not (skip_origin_month and index == template.origin_index):
+                year, month = wanted[index]
+                result[(year, month)].append(
+                    Occurrence(template, year, month, occurrence_date(year, month, template.day))
+                )
+            index += step
+    return result
+
+
+# The active templates with the fields of RecurringTemplate computed in SQL (day,
+# origin_index, interval_months), for code that reads them without parse_template()
+RECURRING_TEMPLATES_SQL = '''
+    SELECT id, amount, description, expense_type_id, recurring_interval, recurring_day,
+           CASE WHEN recurring_interval = 'monthly' AND recurring_day IS NOT NULL
+                THEN recurring_day ELSE CAST(substr(date, 9, 2) AS INTEGER) END AS day,
+           CAST(substr(date, 1, 4) AS INTEGER) * 12 + CAST(substr(date, 6, 2) AS INTEGER) - 1 AS origin_index,
+           CASE recurring_interval WHEN 'monthly' THEN 1 WHEN 'biannual' THEN 6 ELSE 12 END AS interval_months
+    FROM expenses
+    WHERE is_active = TRUE AND is_recurring_template = TRUE
+      AND recurring_interval IN ('monthly', 'biannual', 'yearly')
+'''
@@ -0,0 +1,198 @@
+"""
+Conditional GET and rendered-page caching for the read-heavy pages.
+
+Views decorated with ``@cached_page`` get a strong ETag derived from:
+- the database (epoch, revision) from ``revision.get_revision``
+- the endpoint and its query args
+- the session's ``current_month_id``
+- a code version taken from the app's source and template files
+
+Rendered bodies are kept in a bounded in-process LRU keyed on the same values.
+A repeat request is answered from it with a single primary-key lookup on
+``db_revision``: ``304 Not Modified`` when the client's ``If-None-Match`` matches,
+otherwise the stored body. Session changes the view made on its first render
+(remembering the default month) are replayed on cache hits.
+
+Pages that display flash messages consume them, so such a page can't be served
+from the cache while messages are pending. Whether an endpoint's page displays
+them is learned the first time it renders with messages pending; until then, and
+from then on for pages that do, requests with pending messages go to the view.
+Only plain 200 HTML responses that neither consumed nor added messages are stored.
+
+Environment variables:
+    SPENDING_TRACKER_PAGE_CACHE          set to 0 to turn the cache off
+    SPENDING_TRACKER_PAGE_CACHE_ENTRIES  most pages kept (default 256)
+    SPENDING_TRACKER_PAGE_CACHE_MB       most body bytes kept, in MB (default 32)
+"""
+
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import make_response, request, session
+
+from db import get_db_connection
+from revision import get_revision
+
+CACHE_ENABLED = os.environ.get('SPENDING_TRACKER_PAGE_CACHE', '1') != '0'
+MAX_ENTRIES = int(os.environ.get('SPENDING_TRACKER_PAGE_CACHE_ENTRIES', '256'))
+MAX_BYTES = int(float(os.environ.get('SPENDING_TRACKER_PAGE_CACHE_MB', '32')) * 1024 * 1024)
+
+# Session keys a cached view may set; their new values are replayed on cache hits
+SESSION_KEYS = ('current_month_id',)
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _code_version():
+    """Fingerprint of the source and template files, so a deploy changes every ETag"""
+    digest = hashlib.sha1()
+    for directory, _, files in sorted(os.walk(_ROOT)):
+        if any(part.startswith('.') or part == '__pycache__' for part in directory.split(os.sep)):
+            continue
+        for name in sorted(files):
+            if name.endswith(('.py', '.html')):
+                stat = os.stat(os.path.join(directory, name))
+                digest.update(f'{directory}/{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()[:12]
+
+
+CODE_VERSION = _code_version()
+
+
+class PageEntry:
+    """A rendered page and the session values its view set"""
+
+    __slots__ = ('body', 'mimetype', 'etag', 'session_updates')
+
+    def __init__(self, body, mimetype, etag, session_updates):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag
+        self.session_updates = session_updates
+
+
+class PageCache:
+    """Thread-safe LRU of rendered pages, bounded by entry count and total size"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+cache = PageCache()
+
+# endpoint -> whether its page consumed pending flash messages when last rendered
+_renders_flashes = {}
+
+
+def _cache_key(revision):
+    """Everything the rendered page depends on"""
+    return (
+        request.endpoint,
+        revision,
+        str(session.get('current_month_id')),
+        tuple(sorted(request.args.items(multi=True))),
+    )
+
+
+def _make_etag(key):
+    return hashlib.sha1(repr((CODE_VERSION,) + key).encode()).hexdigest()
+
+
+def _respond(entry):
+    """Serve a cached page, or 304 if the client already has it"""
+    for name, value in entry.session_updates.items():
+        session[name] = value
+
+    if request.if_none_match.contains_weak(entry.etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(entry.body)
+        response.mimetype = entry.mimetype
+    return _add_validators(response, entry.etag)
+
+
+def _add_validators(response, etag):
+    response.set_etag(etag)
+    # Clients must revalidate every time; the ETag makes that cheap
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def cached_page(view):
+    """Serve a GET view with ETags and from the rendered-page cache"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not CACHE_ENABLED or request.method != 'GET':
+            return view(*args, **kwargs)
+
+        flashes_pending = '_flashes' in session
+        if flashes_pending and _renders_flashes.get(request.endpoint, True):
+            return _render(view, args, kwargs, None, flashes_pending)
+
+        revision = get_revision(get_db_connection())
+        if revision is None:
+            return view(*args, **kwargs)
+
+        key = _cache_key(revision)
+        entry = cache.get(key)
+        if entry is not None:
+            return _respond(entry)
+        return _render(view, args, kwargs, key, flashes_pending)
+    return wrapper
+
+
+def _render(view, args, kwargs, key, flashes_pending):
+    """Run the view and, if ``key`` is given and the page is cacheable, store it"""
+    before = {name: session.get(name) for name in SESSION_KEYS}
+    flashes_before = session.get('_flashes', [])[:]
+    response = make_response(view(*args, **kwargs))
+
+    flashes_after = session.get('_flashes', [])
+    if flashes_pending and response.status_code == 200:
+        # Remember whether this page displays (and so consumes) flash messages
+        _renders_flashes[request.endpoint] = flashes_after[:len(flashes_before)] != flashes_before
+    if (key is None or response.status_code != 200 or response.mimetype != 'text/html'
+            or response.is_streamed or flashes_after != flashes_before):
+        return response
+
+    updates = {name: session.get(name) for name in SESSION_KEYS if session.get(name) != before[name]}
+    entry = PageEntry(response.get_data(), response.mimetype, _make_etag(key), updates)
+    cache.put(key, entry)
+
+    if request.if_none_match.contains_weak(entry.etag):
+        return _add_validators(make_response('', 304), entry.etag)
+    return _add_validators(response, entry.etag)
@@ -0,0 +1,240 @@
+"""
+Archival of soft-deleted expenses.
+
+Deleting an expense only sets ``is_active = FALSE`` (and, through a trigger,
+``deleted_at``), so it can be undone. Rows that have stayed deleted for longer than
+``ARCHIVE_AFTER_DAYS`` are moved to ``expenses_archive`` in small batches, each in
+its own short write transaction, so the ``expenses`` table and its indexes only
+grow with live data. Either kind of deleted expense can be brought back with
+``restore_expense``; an archived one returns with its original id.
+
+Deleted recurring templates that still have generated instances are left in place:
+removing them would cascade to the instances, which still count in their months.
+
+``Archiver`` runs ``archive_deleted_expenses`` periodically on a background thread
+(see ``app.start_background_tasks``), on every tenant's database when they are
+sharded; ``python manage.py archive`` runs it once.
+
+Environment variables:
+    SPENDING_TRACKER_ARCHIVE_AFTER_DAYS  days a deleted expense is kept (default 30)
+    SPENDING_TRACKER_ARCHIVE_INTERVAL    seconds between background runs (default
+                                         3600, 0 turns the background run off)
+"""
+
+import logging
+import os
+import threading
+from contextlib import closing
+
+from db import connect, get_router, pooled_connection
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('SPENDING_TRACKER_ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_INTERVAL = float(os.environ.get('SPENDING_TRACKER_ARCHIVE_INTERVAL', '3600'))
+
+# Rows moved per transaction; keeps each write lock short
+ARCHIVE_BATCH_SIZE = 500
+
+# The columns copied between expenses and expenses_archive
+ARCHIVED_COLUMNS = (
+    'id', 'amount', 'description', 'expense_type_id', 'date', 'recurring_interval',
+    'recurring_day', 'is_recurring_template', 'created_at', 'updated_at', 'deleted_at',
+)
+
+# Migration 7 has a frozen copy of this in migrations.py
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS expenses_archive (
+        id INTEGER PRIMARY KEY,
+        amount DECIMAL(10, 2) NOT NULL,
+        description TEXT,
+        expense_type_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        recurring_interval TEXT,
+        recurring_day INTEGER,
+        is_recurring_template BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        deleted_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_expenses_archive_deleted ON expenses_archive(deleted_at)',
+    # Stamp deletions, and clear the stamp when an expense is undeleted
+    '''
+    CREATE TRIGGER IF NOT EXISTS expenses_deleted_at
+    AFTER UPDATE OF is_active ON expenses
+    WHEN OLD.is_active IS NOT NEW.is_active
+    BEGIN
+        UPDATE expenses
+        SET deleted_at = CASE WHEN NEW.is_active THEN NULL ELSE CURRENT_TIMESTAMP END
+        WHERE id = NEW.id;
+    END
+    ''',
+    # Deleted rows waiting to be archived, oldest deletion first
+    '''
+    CREATE INDEX IF NOT EXISTS idx_expenses_deleted
+    ON expenses(deleted_at) WHERE is_active = FALSE
+    ''',
+]
+
+_ARCHIVABLE_QUERY = '''
+    SELECT id FROM expenses e
+    WHERE is_active = FALSE AND deleted_at < datetime('now', ?)
+      AND NOT EXISTS (SELECT 1 FROM recurring_expense_instances rei WHERE rei.expense_id = e.id)
+    ORDER BY deleted_at
+    LIMIT ?
+'''
+
+_COLUMNS = ', '.join(ARCHIVED_COLUMNS)
+# The same columns read back from the archive for an undelete, which clears deleted_at
+_RESTORED_VALUES = ', '.join('NULL' if column == 'deleted_at' else column for column in ARCHIVED_COLUMNS)
+
+
+def create_archive(conn):
+    """Create the archive table, the deleted_at trigger and the deleted-rows index"""
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+
+
+def archive_deleted_expenses(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                             max_batches=None):
+    """Move expenses deleted more than ``older_than_days`` ago into expenses_archive
+
+    Args:
+        conn: Database connection with no transaction open
+        older_than_days: Minimum age of the deletion, in days
+        batch_size: Rows moved per transaction
+        max_batches: Stop after this many batches (default: until none are left)
+
+    Returns:
+        Number of expenses archived
+    """
+    if conn.in_transaction:
+        raise RuntimeError('archive_deleted_expenses() needs a connection without an open transaction')
+
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Chosen under the write lock, so concurrent archivers never pick the same rows
+            ids = [row[0] for row in conn.execute(_ARCHIVABLE_QUERY, (f'-{int(older_than_days)} days', batch_size))]
+            if ids:
+                placeholders = ', '.join('?' * len(ids))
+                conn.execute(f'''
+                    INSERT INTO expenses_archive ({_COLUMNS})
+                    SELECT {_COLUMNS} FROM expenses WHERE id IN ({placeholders})
+                ''', ids)
+                conn.execute(f'DELETE FROM expenses WHERE id IN ({placeholders})', ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        archived += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+
+    if archived:
+        logger.info("Archived %d deleted expenses", archived)
+    return archived
+
+
+def restore_expense(conn, expense_id):
+    """Undelete an expense, whether it is only soft-deleted or already archived
+
+    Returns:
+        'reactivated' or 'restored' (from the archive), or None if no deleted
+        expense has that id
+    """
+    cursor = conn.execute('UPDATE expenses SET is_active = TRUE WHERE id = ? AND is_active = FALSE',
+                          (expense_id,))
+    if cursor.rowcount:
+        conn.commit()
+        return 'reactivated'
+
+    try:
+        cursor = conn.execute(f'''
+            INSERT INTO expenses ({_COLUMNS}, is_active)
+            SELECT {_RESTORED_VALUES}, TRUE FROM expenses_archive WHERE id = ?
+        ''', (expense_id,))
+        if not cursor.rowcount:
+            conn.rollback()
+            return None
+        # Ids come from AUTOINCREMENT and are never reused, so the original one is free
+        conn.execute('DELETE FROM expenses_archive WHERE id = ?', (expense_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return 'restored'
+
+
+def list_deleted_expenses(conn, limit=50):
+    """Deleted expenses, soft-deleted and archived, most recently deleted first
+
+    Returns:
+        List of sqlite3.Row with id, date, amount, description, expense_type_id,
+        deleted_at and archived (0 or 1)
+    """
+    return conn.execute('''
+        SELECT * FROM (
+            SELECT id, date, amount, description, expense_type_id, deleted_at, 0 AS archived
+            FROM expenses WHERE is_active = FALSE
+            UNION ALL
+            SELECT id, date, amount, description, expense_type_id, deleted_at, 1 AS archived
+            FROM expenses_archive
+        )
+        ORDER BY deleted_at DESC, id DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+class Archiver(threading.Thread):
+    """Daemon thread that archives old deleted expenses every ``interval`` seconds"""
+
+    def __init__(self, interval=ARCHIVE_INTERVAL, older_than_days=ARCHIVE_AFTER_DAYS):
+        super().__init__(name='archiver', daemon=True)
+        self.interval = interval
+        self.older_than_days = older_than_days
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            router = get_router()
+            if router is None:
+                self._archive(pooled_connection())
+                continue
+            # Each shard on its own connection, so the router's open shards stay the busy ones
+            for path in router.shard_paths():
+                if self._stopped.is_set():
+                    break
+                self._archive(closing(connect(path)))
+
+    def _archive(self, connection):
+        try:
+            with connection as conn:
+                archive_deleted_expenses(conn, self.older_than_days)
+        except Exception:
+            # Try again next time; a busy database is not fatal
+            logger.exception("Archiving deleted expenses failed")
+
+    def stop(self):
+        self._stopped.set()
+
+
+_archiver = None
+_archiver_lock = threading.Lock()
+
+
+def start_archiver(interval=ARCHIVE_INTERVAL, older_than_days=ARCHIVE_AFTER_DAYS):
+    """Start the background archiver for this process (once); returns it, or None if disabled"""
+    global _archiver
+    if interval <= 0:
+        return None
+    with _archiver_lock:
+        if _archiver is None or not _archiver.is_alive():
+            _archiver = Archiver(interval, older_than_days)
+            _archiver.start()
+    return _archiver
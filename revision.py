@@ -0,0 +1,63 @@
+"""
+A database-wide change counter.
+
+``db_revision`` holds a single row whose ``revision`` is bumped by triggers on every
+insert, update and delete of the data tables, so any two reads that see the same
+revision saw the same data, whichever process or connection made the change. The
+row also carries a random ``epoch`` chosen when the table is created, so a
+recreated database never reuses an old (epoch, revision) pair.
+
+``PRAGMA data_version`` can't serve here: it only changes for commits made by
+*other* connections.
+"""
+
+# Tables whose contents pages are rendered from
+TRACKED_TABLES = ('expense_types', 'months', 'expenses', 'recurring_expense_instances')
+
+# Migration 3 has a frozen copy of this in migrations.py
+REVISION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS db_revision (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        epoch TEXT NOT NULL,
+        revision INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "INSERT OR IGNORE INTO db_revision (id, epoch, revision) VALUES (1, lower(hex(randomblob(8))), 0)",
+] + [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS db_revision_{table}_{operation.lower()}
+    AFTER {operation} ON {table}
+    BEGIN
+        UPDATE db_revision SET revision = revision + 1 WHERE id = 1;
+    END
+    '''
+    for table in TRACKED_TABLES
+    for operation in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+
+def create_revision_tracking(conn):
+    """Create the revision row and the triggers that bump it"""
+    for statement in REVISION_SCHEMA:
+        conn.execute(statement)
+
+
+def drop_revision_triggers(conn):
+    """Drop the triggers that bump the revision, e.g. around a bulk data migration"""
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB 'db_revision_*'"
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+
+
+def bump_revision(conn):
+    """Advance the revision by hand, after changes made with the triggers dropped"""
+    conn.execute('UPDATE db_revision SET revision = revision + 1 WHERE id = 1')
+
+
+def get_revision(conn):
+    """The current (epoch, revision) pair, or None if revision tracking is missing"""
+    row = conn.execute('SELECT epoch, revision FROM db_revision WHERE id = 1').fetchone()
+    return (row[0], row[1]) if row else None
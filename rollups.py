@@ -0,0 +1,240 @@
+"""
+Materialized per-month expense totals.
+
+``month_totals`` holds one row per month and ``month_type_totals`` one row per
+month and expense type. Both are kept current by triggers on ``expenses``,
+``recurring_expense_instances`` and ``months``, so reading a month's total is a
+single primary-key lookup instead of scanning and summing that month's rows.
+
+The totals follow the same rules as the original calculation: active expenses are
+counted in the month of their ``date``, and recurring instances in the month they
+are attached to through ``month_id``. Like the amounts they add up, totals are
+integer cents (see money.py), so they never drift from the raw data.
+"""
+
+# Adds a signed amount/count for a month to both rollup tables. Used as a template by
+# the triggers below: {select} must produce (year, month, expense_type_id, amount, count)
+_UPSERT_TYPE_TOTALS = '''
+    INSERT INTO month_type_totals (year, month, expense_type_id, total, expense_count)
+    {select}
+    ON CONFLICT (year, month, expense_type_id) DO UPDATE SET
+        total = total + excluded.total,
+        expense_count = expense_count + excluded.expense_count;
+'''
+
+_UPSERT_MONTH_TOTALS = '''
+    INSERT INTO month_totals (year, month, total, expense_count)
+    SELECT year, month, SUM(amount), SUM(cnt) FROM ({select}) GROUP BY year, month
+    ON CONFLICT (year, month) DO UPDATE SET
+        total = total + excluded.total,
+        expense_count = expense_count + excluded.expense_count;
+'''
+
+
+def _apply(select):
+    """Build the trigger statements that apply ``select`` to both rollup tables"""
+    return _UPSERT_TYPE_TOTALS.format(select=select) + _UPSERT_MONTH_TOTALS.format(select=select)
+
+
+def _expense_row(ref, sign):
+    """SELECT producing the rollup delta for an expenses row (NEW or OLD)"""
+    return f'''
+        SELECT CAST(substr({ref}.date, 1, 4) AS INTEGER) AS year,
+               CAST(substr({ref}.date, 6, 2) AS INTEGER) AS month,
+               {ref}.expense_type_id AS expense_type_id,
+               {sign}{ref}.amount AS amount, {sign}1 AS cnt
+        WHERE {ref}.is_active
+    '''
+
+
+def _instance_row(ref, sign):
+    """SELECT producing the rollup delta for a recurring_expense_instances row"""
+    return f'''
+        SELECT m.year AS year, m.month AS month, {ref}.expense_type_id AS expense_type_id,
+               {sign}{ref}.amount AS amount, {sign}1 AS cnt
+        FROM months m WHERE m.id = {ref}.month_id
+    '''
+
+
+def _month_instances(ref, sign):
+    """SELECT producing the rollup deltas for every instance attached to a months row"""
+    return f'''
+        SELECT {ref}.year AS year, {ref}.month AS month, expense_type_id,
+               {sign}SUM(amount) AS amount, {sign}COUNT(*) AS cnt
+        FROM recurring_expense_instances WHERE month_id = {ref}.id
+        GROUP BY expense_type_id
+    '''
+
+
+# Used by the rebuild commands. Migration 2 runs its own frozen copy (see
+# migrations.py), so a change here also needs a migration for existing databases
+MONTH_TOTALS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS month_totals (
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (year, month)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS month_type_totals (
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        expense_type_id INTEGER NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (year, month, expense_type_id)
+    ) WITHOUT ROWID
+    ''',
+    # Regular expenses: inserts, soft deletes/edits and hard deletes
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_expense_insert
+    AFTER INSERT ON expenses WHEN NEW.is_active
+    BEGIN {_apply(_expense_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_expense_update
+    AFTER UPDATE OF amount, date, expense_type_id, is_active ON expenses
+    BEGIN {_apply(_expense_row('OLD', '-'))} {_apply(_expense_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_expense_delete
+    AFTER DELETE ON expenses WHEN OLD.is_active
+    BEGIN {_apply(_expense_row('OLD', '-'))} END
+    ''',
+    # Recurring instances are attributed to the month they belong to
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_instance_insert
+    AFTER INSERT ON recurring_expense_instances
+    BEGIN {_apply(_instance_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_instance_update
+    AFTER UPDATE OF amount, month_id, expense_type_id ON recurring_expense_instances
+    BEGIN {_apply(_instance_row('OLD', '-'))} {_apply(_instance_row('NEW', ''))} END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_instance_delete
+    AFTER DELETE ON recurring_expense_instances
+    BEGIN {_apply(_instance_row('OLD', '-'))} END
+    ''',
+    # Foreign-key cascades run after the month row is gone, when the instance trigger
+    # can no longer tell which month to subtract from, so remove them up front
+    '''
+    CREATE TRIGGER IF NOT EXISTS month_totals_month_delete
+    BEFORE DELETE ON months
+    BEGIN
+        DELETE FROM recurring_expense_instances WHERE month_id = OLD.id;
+    END
+    ''',
+    # Re-dating a month moves its recurring instances to the new month
+    f'''
+    CREATE TRIGGER IF NOT EXISTS month_totals_month_update
+    AFTER UPDATE OF month, year ON months
+    BEGIN {_apply(_month_instances('OLD', '-'))} {_apply(_month_instances('NEW', ''))} END
+    ''',
+]
+
+# Totals recomputed from the raw tables, per month and expense type
+RAW_TYPE_TOTALS_QUERY = '''
+    SELECT year, month, expense_type_id, SUM(amount) AS total, COUNT(*) AS expense_count
+    FROM (
+        SELECT CAST(substr(e.date, 1, 4) AS INTEGER) AS year,
+               CAST(substr(e.date, 6, 2) AS INTEGER) AS month,
+               e.expense_type_id, e.amount
+        FROM expenses e
+        WHERE e.is_active = TRUE
+        UNION ALL
+        SELECT m.year, m.month, rei.expense_type_id, rei.amount
+        FROM recurring_expense_instances rei
+        JOIN months m ON rei.month_id = m.id
+    )
+    GROUP BY year, month, expense_type_id
+'''
+
+
+def create_month_totals(conn):
+    """Create the rollup tables and the triggers that maintain them"""
+    for statement in MONTH_TOTALS_SCHEMA:
+        conn.execute(statement)
+
+
+def drop_month_totals(conn):
+    """Drop the rollup tables and their triggers (the rollup is derived data)"""
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB 'month_totals_*'"
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.execute('DROP TABLE IF EXISTS month_type_totals')
+    conn.execute('DROP TABLE IF EXISTS month_totals')
+
+
+def rebuild_month_totals(conn, commit=True):
+    """Recompute both rollup tables from the raw expense tables"""
+    conn.execute('DELETE FROM month_type_totals')
+    conn.execute('DELETE FROM month_totals')
+    conn.execute(f'''
+        INSERT INTO month_type_totals (year, month, expense_type_id, total, expense_count)
+        {RAW_TYPE_TOTALS_QUERY}
+    ''')
+    conn.execute('''
+        INSERT INTO month_totals (year, month, total, expense_count)
+        SELECT year, month, SUM(total), SUM(expense_count)
+        FROM month_type_totals
+        GROUP BY year, month
+    ''')
+    if commit:
+        conn.commit()
+
+
+def check_month_totals(conn):
+    """Compare the rollup against the raw tables.
+
+    Returns:
+        List of (year, month, expense_type_id, stored_total, actual_total) tuples for
+        every month/type whose stored total or count differs from the raw data.
+    """
+    rows = conn.execute(f'''
+        WITH actual AS ({RAW_TYPE_TOTALS_QUERY}),
+        keys AS (
+            SELECT year, month, expense_type_id FROM actual
+            UNION
+            SELECT year, month, expense_type_id FROM month_type_totals
+            WHERE total != 0 OR expense_count != 0
+        )
+        SELECT k.year, k.month, k.expense_type_id,
+               COALESCE(s.total, 0) AS stored_total, COALESCE(a.total, 0) AS actual_total
+        FROM keys k
+        LEFT JOIN month_type_totals s
+            ON s.year = k.year AND s.month = k.month AND s.expense_type_id = k.expense_type_id
+        LEFT JOIN actual a
+            ON a.year = k.year AND a.month = k.month AND a.expense_type_id = k.expense_type_id
+        WHERE COALESCE(s.total, 0) != COALESCE(a.total, 0)
+           OR COALESCE(s.expense_count, 0) != COALESCE(a.expense_count, 0)
+        ORDER BY k.year, k.month, k.expense_type_id
+    ''').fetchall()
+    mismatches = [tuple(row) for row in rows]
+
+    # The per-month table must also agree with the per-type rows
+    rows = conn.execute('''
+        SELECT t.year, t.month, NULL, COALESCE(mt.total, 0), SUM(t.total)
+        FROM month_type_totals t
+        LEFT JOIN month_totals mt ON mt.year = t.year AND mt.month = t.month
+        GROUP BY t.year, t.month
+        HAVING COALESCE(mt.total, 0) != SUM(t.total)
+            OR COALESCE(mt.expense_count, 0) != SUM(t.expense_count)
+    ''').fetchall()
+    mismatches.extend(tuple(row) for row in rows)
+    return mismatches
+
+
+def get_month_total(conn, month, year):
+    """Return the stored total for a month in cents (0 if it has no expenses)"""
+    row = conn.execute(
+        'SELECT total FROM month_totals WHERE year = ? AND month = ?',
+        (int(year), int(month))
+    ).fetchone()
+    return row['total'] if row else 0
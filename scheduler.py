@@ -0,0 +1,211 @@
+"""
+Background materialization of recurring expense instances.
+
+Pages read a month's recurring expenses from ``recurring_expense_instances`` and
+never expand templates themselves, so the instances have to be there before the
+page is requested. ``InstanceScheduler`` is a daemon thread with a job queue that
+keeps them in step with the templates:
+
+- adding, editing, deleting or undeleting an expense (or resetting the data)
+  calls ``templates_changed``, which queues a sync of just those expenses over
+  every existing month; jobs that pile up while one runs are merged, so a burst
+  of edits costs one transaction per database
+- every ``INSTANCE_INTERVAL`` seconds (and once at start) all templates are
+  synced over a rolling window around the current month
+  (``INSTANCE_PAST_MONTHS`` before it to ``INSTANCE_FUTURE_MONTHS`` after it),
+  which picks up the month rolling over and months created by other processes
+
+In the current and future months, instances follow their template: edits are
+copied and instances of deleted templates are removed. Past months only get the
+instances they are missing, so editing a template never rewrites history. Months
+are never created here; ``python manage.py sync-instances --all`` syncs every
+template over every month, for data written outside the app.
+
+Each sync is one write transaction that commits only if an instance changed, so
+an idle refresh does not bump the data revision.
+
+Environment variables:
+    SPENDING_TRACKER_INSTANCE_PAST_MONTHS    past months the periodic sync covers (default 3)
+    SPENDING_TRACKER_INSTANCE_FUTURE_MONTHS  future months the periodic sync covers (default 12)
+    SPENDING_TRACKER_INSTANCE_INTERVAL       seconds between full syncs (default 900,
+                                             0 turns the thread off; template
+                                             changes are then synced in the request)
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import closing
+from datetime import date
+
+from db import connect, get_pool, get_router, pooled_connection
+from months import sync_recurring_instances
+from recurrence import month_index
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_PAST_MONTHS = int(os.environ.get('SPENDING_TRACKER_INSTANCE_PAST_MONTHS', '3'))
+INSTANCE_FUTURE_MONTHS = int(os.environ.get('SPENDING_TRACKER_INSTANCE_FUTURE_MONTHS', '12'))
+INSTANCE_INTERVAL = float(os.environ.get('SPENDING_TRACKER_INSTANCE_INTERVAL', '900'))
+
+
+def sync_window(conn, template_ids=None, past_months=INSTANCE_PAST_MONTHS,
+                future_months=INSTANCE_FUTURE_MONTHS, today=None):
+    """Sync the instances of the months around today's in one write transaction
+
+    Args:
+        conn: Database connection with no transaction open
+        template_ids: Only sync these expenses' instances (default: all)
+        past_months, future_months: The window around the current month; None
+            leaves that side open
+        today: Date whose month is the current one (default: today)
+
+    Returns:
+        months.SyncResult
+    """
+    if conn.in_transaction:
+        raise RuntimeError('sync_window() needs a connection without an open transaction')
+
+    today = today or date.today()
+    current = month_index(today.year, today.month)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        result = sync_recurring_instances(
+            conn,
+            first=None if past_months is None else current - past_months,
+            last=None if future_months is None else current + future_months,
+            rewrite_from=current,
+            template_ids=template_ids,
+        )
+        # Nothing changed: end the transaction without touching the revision
+        if any(result):
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+class InstanceScheduler(threading.Thread):
+    """Daemon thread that runs the instance syncs queued for changed templates, and a
+    windowed sync of all templates every ``interval`` seconds"""
+
+    def __init__(self, interval=INSTANCE_INTERVAL, past_months=INSTANCE_PAST_MONTHS,
+                 future_months=INSTANCE_FUTURE_MONTHS):
+        super().__init__(name='instance-scheduler', daemon=True)
+        self.interval = interval
+        self.past_months = past_months
+        self.future_months = future_months
+        # (db_path, template ids or None for all), or None to stop
+        self._jobs = queue.Queue()
+        self._stopped = threading.Event()
+
+    def submit(self, db_path, template_ids=None):
+        """Queue a sync over every month of one database (all of its templates if no ids are given)"""
+        self._jobs.put((db_path, None if template_ids is None else set(template_ids)))
+
+    def run(self):
+        next_refresh = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                job = self._jobs.get(timeout=max(next_refresh - time.monotonic(), 0))
+            except queue.Empty:
+                self._refresh_all()
+                next_refresh = time.monotonic() + self.interval
+                continue
+            if job is None:
+                break
+            for db_path, template_ids in self._merge(job).items():
+                self._sync(db_path, template_ids)
+
+    def _merge(self, job):
+        """The job plus any queued behind it, as one entry per database"""
+        pending = {}
+        while True:
+            db_path, template_ids = job
+            if template_ids is None or pending.get(db_path, set()) is None:
+                pending[db_path] = None
+            else:
+                pending[db_path] = pending.get(db_path, set()) | template_ids
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return pending
+            if job is None:
+                # Stop once these are done
+                self._stopped.set()
+                return pending
+
+    def _refresh_all(self):
+        router = get_router()
+        if router is None:
+            self._sync(get_pool().db_path, windowed=True)
+            return
+        for path in router.shard_paths():
+            if self._stopped.is_set():
+                break
+            self._sync(path, windowed=True)
+
+    def _sync(self, db_path, template_ids=None, windowed=False):
+        # Each shard on its own connection, so the router's open shards stay the busy ones
+        connection = pooled_connection() if get_router() is None else closing(connect(db_path))
+        window = (self.past_months, self.future_months) if windowed else (None, None)
+        try:
+            with connection as conn:
+                result = sync_window(conn, template_ids, *window)
+        except Exception:
+            # Try again with the next change or refresh; a busy database is not fatal
+            logger.exception("Syncing recurring instances of %s failed", db_path)
+            return
+        if any(result):
+            logger.info("Synced recurring instances of %s: %d inserted, %d updated, %d deleted",
+                        db_path, *result)
+
+    def stop(self):
+        self._stopped.set()
+        self._jobs.put(None)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(interval=INSTANCE_INTERVAL, past_months=INSTANCE_PAST_MONTHS,
+                    future_months=INSTANCE_FUTURE_MONTHS):
+    """Start the instance scheduler for this process (once); returns it, or None if disabled"""
+    global _scheduler
+    if interval <= 0:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = InstanceScheduler(interval, past_months, future_months)
+            _scheduler.start()
+    return _scheduler
+
+
+def templates_changed(conn, expense_ids=None):
+    """Bring the instances of these expenses up to date after a committed change
+
+    Every existing month is synced, so a new or edited template shows up in old
+    months too (past months only get missing instances). With the scheduler
+    running the sync is queued for its thread; otherwise it runs here, on
+    ``conn``. Expenses that are not recurring templates are harmless: they have no
+    occurrences, so only stale instances of theirs are removed.
+
+    Args:
+        conn: The connection the change was committed on, with no transaction open
+        expense_ids: Changed expense ids (default: every template)
+    """
+    scheduler = _scheduler
+    if scheduler is not None and scheduler.is_alive():
+        scheduler.submit(conn.db_path, expense_ids)
+        return
+    try:
+        sync_window(conn, expense_ids, past_months=None, future_months=None)
+    except Exception:
+        # The next change or a manual sync fills them in; the change itself is committed
+        logger.exception("Syncing recurring instances of expenses %s failed", expense_ids)
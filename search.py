@@ -0,0 +1,279 @@
+"""
+Full-text search over expense descriptions and type names.
+
+``expense_search`` is an FTS5 table with the trigram tokenizer, so any substring of
+three or more characters is an indexed lookup instead of a ``LIKE '%x%'`` scan of
+every row. It holds one row per active expense and per recurring instance, with
+the description and the expense type's name. The FTS rowid says which row it is:
+``2 * id`` for an expense and ``2 * id + 1`` for a recurring instance.
+
+Triggers on ``expenses``, ``recurring_expense_instances`` and ``expense_types``
+keep it current, the same way the month totals rollup is maintained (see
+rollups.py); soft-deleted expenses are removed from it.
+
+A search takes the newest matching rows (highest FTS rowids, which FTS5 returns in
+order without visiting the rest), up to MAX_RANKED_MATCHES after the date, type and
+amount filters, and ranks those: rows whose description contains every term come
+before rows matched through their type name, then shorter (closer) descriptions,
+then the most recent dates. bm25() is not used because it counts every match of
+each term to weigh them, which costs as much as the whole result set for a common
+word.
+"""
+
+from collections import namedtuple
+
+# Trigram matching needs at least this many characters per search term
+MIN_TERM_LENGTH = 3
+
+# Matches ranked per search, newest first. Filters are applied before this cap, so
+# it only limits how far back a very common term is ranked
+MAX_RANKED_MATCHES = 1000
+
+MAX_PER_PAGE = 100
+
+SearchResults = namedtuple('SearchResults', [
+    'rows',    # the requested page of sqlite3.Row results
+    'total',   # matches across all pages, at most MAX_RANKED_MATCHES
+    'capped',  # True if there were more than MAX_RANKED_MATCHES matches
+])
+
+_TYPE_NAME = '(SELECT name FROM expense_types WHERE id = {ref}.expense_type_id)'
+
+# Used by the rebuild commands; migration 6 created it from a frozen copy in migrations.py
+SEARCH_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS expense_search USING fts5(
+        description, type_name, tokenize = 'trigram'
+    )
+    ''',
+    # Expenses: only active rows are searchable
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_expense_insert
+    AFTER INSERT ON expenses WHEN NEW.is_active
+    BEGIN
+        INSERT INTO expense_search (rowid, description, type_name)
+        VALUES (NEW.id * 2, NEW.description, {_TYPE_NAME.format(ref='NEW')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_expense_update
+    AFTER UPDATE OF description, expense_type_id, is_active ON expenses
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2;
+        INSERT INTO expense_search (rowid, description, type_name)
+        SELECT NEW.id * 2, NEW.description, {_TYPE_NAME.format(ref='NEW')}
+        WHERE NEW.is_active;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_expense_delete
+    AFTER DELETE ON expenses
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2;
+    END
+    ''',
+    # Recurring instances
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_instance_insert
+    AFTER INSERT ON recurring_expense_instances
+    BEGIN
+        INSERT INTO expense_search (rowid, description, type_name)
+        VALUES (NEW.id * 2 + 1, NEW.description, {_TYPE_NAME.format(ref='NEW')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS expense_search_instance_update
+    AFTER UPDATE OF description, expense_type_id ON recurring_expense_instances
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2 + 1;
+        INSERT INTO expense_search (rowid, description, type_name)
+        VALUES (NEW.id * 2 + 1, NEW.description, {_TYPE_NAME.format(ref='NEW')});
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_instance_delete
+    AFTER DELETE ON recurring_expense_instances
+    BEGIN
+        DELETE FROM expense_search WHERE rowid = OLD.id * 2 + 1;
+    END
+    ''',
+    # Renaming or deleting a type changes the type_name of every row of that type
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_type_rename
+    AFTER UPDATE OF name ON expense_types
+    BEGIN
+        UPDATE expense_search SET type_name = NEW.name
+        WHERE rowid IN (
+            SELECT id * 2 FROM expenses WHERE expense_type_id = NEW.id AND is_active = TRUE
+            UNION ALL
+            SELECT id * 2 + 1 FROM recurring_expense_instances WHERE expense_type_id = NEW.id
+        );
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS expense_search_type_delete
+    AFTER DELETE ON expense_types
+    BEGIN
+        UPDATE expense_search SET type_name = NULL
+        WHERE rowid IN (
+            SELECT id * 2 FROM expenses WHERE expense_type_id = OLD.id AND is_active = TRUE
+            UNION ALL
+            SELECT id * 2 + 1 FROM recurring_expense_instances WHERE expense_type_id = OLD.id
+        );
+    END
+    ''',
+]
+
+# The newest matches joined back to their rows, then ranked. {filters} are extra
+# WHERE terms on the joined columns and {description_match} tests whether the
+# description contains every term. One match more than is ranked is fetched, to
+# tell whether the cap cut any off
+_SEARCH_QUERY = '''
+    WITH matches AS MATERIALIZED (
+        SELECT expense_search.rowid AS search_rowid,
+               CASE WHEN expense_search.rowid % 2 = 0 THEN 'expense' ELSE 'recurring_instance' END AS kind,
+               expense_search.rowid / 2 AS id,
+               COALESCE(e.date, rei.instance_date) AS date,
+               COALESCE(e.amount, rei.amount) AS amount,
+               COALESCE(e.description, rei.description) AS description,
+               COALESCE(e.expense_type_id, rei.expense_type_id) AS expense_type_id,
+               e.recurring_interval, rei.month_id
+        FROM expense_search
+        LEFT JOIN expenses e
+            ON expense_search.rowid % 2 = 0 AND e.id = expense_search.rowid / 2
+        LEFT JOIN recurring_expense_instances rei
+            ON expense_search.rowid % 2 = 1 AND rei.id = expense_search.rowid / 2
+        WHERE expense_search MATCH ? AND COALESCE(e.id, rei.id) IS NOT NULL {filters}
+        ORDER BY expense_search.rowid DESC
+        LIMIT ?
+    ),
+    candidates AS (
+        SELECT * FROM matches ORDER BY search_rowid DESC LIMIT ?
+    )
+    SELECT *, COALESCE({description_match}, 0) AS description_match,
+           (SELECT COUNT(*) FROM matches) AS total_count
+    FROM candidates
+    ORDER BY description_match DESC, length(description), date DESC, kind, id
+    LIMIT ? OFFSET ?
+'''
+
+
+def create_search_index(conn):
+    """Create the search table and the triggers that keep it current"""
+    for statement in SEARCH_SCHEMA:
+        conn.execute(statement)
+
+
+def drop_search_index(conn):
+    """Drop the search table and its triggers (the index is derived data)"""
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB 'expense_search_*'"
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.execute('DROP TABLE IF EXISTS expense_search')
+
+
+def rebuild_search_index(conn, commit=True):
+    """Re-index every active expense and recurring instance"""
+    conn.execute('DELETE FROM expense_search')
+    conn.execute('''
+        INSERT INTO expense_search (rowid, description, type_name)
+        SELECT e.id * 2, e.description, et.name
+        FROM expenses e
+        LEFT JOIN expense_types et ON e.expense_type_id = et.id
+        WHERE e.is_active = TRUE
+    ''')
+    conn.execute('''
+        INSERT INTO expense_search (rowid, description, type_name)
+        SELECT rei.id * 2 + 1, rei.description, et.name
+        FROM recurring_expense_instances rei
+        LEFT JOIN expense_types et ON rei.expense_type_id = et.id
+    ''')
+    # Merge the index segments written above into one
+    conn.execute("INSERT INTO expense_search (expense_search) VALUES ('optimize')")
+    if commit:
+        conn.commit()
+
+
+def search_terms(text):
+    """The terms of a search text that trigram matching can use
+
+    Raises ValueError if no term is at least MIN_TERM_LENGTH characters long.
+    """
+    terms = [term for term in str(text or '').split() if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        raise ValueError(f'Search for at least {MIN_TERM_LENGTH} characters')
+    return terms
+
+
+def match_query(terms):
+    """FTS5 query matching rows that contain every term
+
+    Each term is quoted, so FTS5 operators and punctuation in the text are searched
+    for literally.
+    """
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _filters(start_date, end_date, expense_type_ids, min_amount, max_amount):
+    """WHERE fragment and parameters for the optional result filters"""
+    clauses, params = [], []
+    if start_date:
+        clauses.append('COALESCE(e.date, rei.instance_date) >= ?')
+        params.append(start_date)
+    if end_date:
+        clauses.append('COALESCE(e.date, rei.instance_date) <= ?')
+        params.append(end_date)
+    if expense_type_ids:
+        placeholders = ', '.join('?' * len(expense_type_ids))
+        clauses.append(f'COALESCE(e.expense_type_id, rei.expense_type_id) IN ({placeholders})')
+        params.extend(expense_type_ids)
+    if min_amount is not None:
+        clauses.append('COALESCE(e.amount, rei.amount) >= ?')
+        params.append(min_amount)
+    if max_amount is not None:
+        clauses.append('COALESCE(e.amount, rei.amount) <= ?')
+        params.append(max_amount)
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def search_expenses(conn, text, start_date=None, end_date=None, expense_type_ids=None,
+                    min_amount=None, max_amount=None, page=1, per_page=25):
+    """Search expenses and recurring instances by description and type name
+
+    Args:
+        conn: Database connection
+        text: Search text; every term of 3+ characters must appear (as a substring)
+        start_date, end_date: Optional inclusive YYYY-MM-DD bounds
+        expense_type_ids: Optional list of expense type ids to include
+        min_amount, max_amount: Optional inclusive bounds in cents
+        page, per_page: 1-based page number and page size
+
+    Returns:
+        SearchResults with the page's rows (kind, id, date, amount, description,
+        expense_type_id, recurring_interval, month_id, description_match), best
+        match first, and the number of matches ranked
+    """
+    terms = search_terms(text)
+    page, per_page = max(int(page), 1), min(max(int(per_page), 1), MAX_PER_PAGE)
+    filters, filter_params = _filters(start_date, end_date, expense_type_ids, min_amount, max_amount)
+    description_match = ' AND '.join(['instr(lower(description), ?) > 0'] * len(terms))
+
+    def run(limit, offset):
+        return conn.execute(
+            _SEARCH_QUERY.format(filters=filters, description_match=f'({description_match})'),
+            [match_query(terms)] + filter_params + [MAX_RANKED_MATCHES + 1, MAX_RANKED_MATCHES]
+            + [term.lower() for term in terms] + [limit, offset],
+        ).fetchall()
+
+    rows = run(per_page, (page - 1) * per_page)
+    if rows:
+        total = rows[0]['total_count']
+    elif page > 1:
+        # Past the last page there is nothing for the window function to count
+        first = run(1, 0)
+        total = first[0]['total_count'] if first else 0
+    else:
+        total = 0
+    return SearchResults(rows, min(total, MAX_RANKED_MATCHES), total > MAX_RANKED_MATCHES)
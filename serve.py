@@ -0,0 +1,212 @@
+"""
+Production server for the Spending Tracker: a pre-forked pool of worker processes,
+each handling requests on a bounded pool of threads.
+
+Usage:
+    python serve.py [--host HOST] [--port PORT] [--workers N] [--threads N] [--access-log]
+
+The parent process builds the app once (so migrations run exactly once), binds the
+listening socket and forks the workers. Every worker opens its own database
+connections after the fork (see ``db._reset_pool_after_fork``), warms the metadata
+caches and templates, and then accepts connections from the shared socket. Workers
+that die are replaced; SIGTERM or SIGINT stops them all after in-flight requests finish.
+
+Worker and thread counts default to SPENDING_TRACKER_WORKERS (the number of CPUs)
+and SPENDING_TRACKER_THREADS (8). Each worker keeps at least one pooled database
+connection per thread. The /metrics counters are per worker process.
+
+Any other WSGI server can serve the app through the factory instead, e.g.
+``gunicorn 'app:create_app()'``.
+"""
+
+import argparse
+import logging
+import os
+import secrets
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import db
+import metrics
+from app import create_app, start_background_tasks, warm_up
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.environ.get('SPENDING_TRACKER_WORKERS', os.cpu_count() or 1))
+DEFAULT_THREADS = int(os.environ.get('SPENDING_TRACKER_THREADS', '8'))
+
+# Seconds an idle keep-alive connection may hold a request thread
+KEEPALIVE_TIMEOUT = 5
+
+# Pending connections the kernel queues for the workers
+LISTEN_BACKLOG = 1024
+
+# A worker that exits sooner than this after starting is restarted with a delay, so a
+# worker that cannot start doesn't turn into a fork loop
+MIN_WORKER_LIFETIME = 1.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Request handler that closes idle keep-alive connections"""
+
+    timeout = KEEPALIVE_TIMEOUT
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles connections on a fixed-size thread pool"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        """Same as ``socketserver.ThreadingMixIn.process_request_thread``"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # Let in-flight requests finish before the socket goes away
+        if hasattr(self, 'executor'):
+            self.executor.shutdown(wait=True)
+        super().server_close()
+
+
+def bind_socket(host, port):
+    """Open the listening socket shared by all workers"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.create_server((host, port), family=family, backlog=LISTEN_BACKLOG)
+    # Every worker waits on the same socket; one that loses the race for a connection
+    # must not block in accept()
+    sock.setblocking(False)
+    return sock
+
+
+def serve(app, sock, threads):
+    """Serve requests from ``sock`` in this process until SIGTERM or SIGINT"""
+    warm_up(app)
+    start_background_tasks(app)
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it can't run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Worker %d serving on %s:%d with %d threads", os.getpid(), host, port, threads)
+    server.serve_forever()
+
+
+def spawn_worker(app, sock, threads):
+    """Fork a worker process and return its pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    status = 0
+    try:
+        serve(app, sock, threads)
+    except BaseException:
+        logger.exception("Worker %d failed", os.getpid())
+        status = 1
+    finally:
+        logging.shutdown()
+        os._exit(status)
+
+
+def run_workers(app, sock, workers, threads):
+    """Start ``workers`` worker processes and keep that many running until stopped"""
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        children[spawn_worker(app, sock, threads)] = time.monotonic()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+
+        logger.warning("Worker %d exited with status %d; starting a new one",
+                       pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(MIN_WORKER_LIFETIME)
+        if not stopping:
+            children[spawn_worker(app, sock, threads)] = time.monotonic()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the Spending Tracker with multiple workers')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'worker processes (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help=f'request threads per worker (default: {DEFAULT_THREADS})')
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.threads < 1:
+        parser.error('--workers and --threads must be at least 1')
+    metrics.configure_logging()
+
+    config = {'DB_POOL_SIZE': max(db.get_pool(read_only=True).max_size, args.threads)}
+    if not os.environ.get('SPENDING_TRACKER_SECRET_KEY'):
+        # All workers must sign sessions with the same key
+        logger.warning("SPENDING_TRACKER_SECRET_KEY is not set; sessions end when the server restarts")
+        config['SECRET_KEY'] = secrets.token_hex(32)
+    app = create_app(config)
+
+    # Werkzeug logs every request at INFO
+    logging.getLogger('werkzeug').setLevel(logging.INFO if args.access_log else logging.WARNING)
+
+    sock = bind_socket(args.host, args.port)
+    logger.info("Listening on http://%s:%d with %d worker(s) x %d thread(s)",
+                args.host, args.port, args.workers, args.threads)
+
+    if args.workers == 1:
+        serve(app, sock, args.threads)
+        return 0
+
+    # The parent only supervises; workers open their own connections
+    db.get_pool().close_all()
+    db.get_pool(read_only=True).close_all()
+    if db.get_router() is not None:
+        db.get_router().close_all()
+    run_workers(app, sock, args.workers, args.threads)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,108 +1,48 @@
 #!/usr/bin/env python3
 """
 Database Setup Script for Spending Tracker
-Creates and initializes the SQLite database with required tables.
+Creates the SQLite database, or upgrades an existing one, with the required tables.
+
+Usage:
+    python setup_db.py [--reset]    (--reset deletes the existing database first)
 """
 
 import sqlite3
 import os
+import sys
 from datetime import datetime
 
-# Database configuration
-DB_NAME = 'spending_tracker.db'
-DB_PATH = os.path.join(os.path.dirname(__file__), DB_NAME)
+# Database configuration (shared with the app so both use the same file)
+from db import DB_PATH
+from migrations import LATEST_VERSION, migrate
 
-def create_database():
-    """Create the database and tables"""
-    
-    # Hard delete the old database if it exists
-    if os.path.exists(DB_PATH):
-        print(f"Removing existing database: {DB_PATH}")
-        os.remove(DB_PATH)
+def create_database(db_path=None, reset=False, verbose=True):
+    """Create or upgrade the database (at DB_PATH unless another path is given)
+    
+    The schema comes from the migrations in migrations.py, so running this against
+    an existing database only applies what it is missing and keeps its data. Pass
+    reset=True to delete the database and start from scratch, and verbose=False to
+    print nothing (new tenant shards are created this way, see shards.py).
+    """
+    db_path = db_path or DB_PATH
+    
+    # Hard delete the old database only when asked to
+    if reset and os.path.exists(db_path):
+        if verbose:
+            print(f"Removing existing database: {db_path}")
+        for path in (db_path, db_path + '-wal', db_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
     
     # Create new database connection
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # Enable foreign keys
     cursor.execute("PRAGMA foreign_keys = ON")
     
-    # Create expense_types table
-    cursor.execute('''
-        CREATE TABLE expense_types (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create months table
-    cursor.execute('''
-        CREATE TABLE months (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            month INTEGER NOT NULL CHECK (month >= 1 AND month <= 12),
-            year INTEGER NOT NULL CHECK (year >= 2020),
-            starting_bank_value DECIMAL(10, 2) DEFAULT 0.00,
-            monthly_income DECIMAL(10, 2) DEFAULT 0.00,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(month, year)
-        )
-    ''')
-    
-    # Create expenses table with updated recurring fields
-    cursor.execute('''
-        CREATE TABLE expenses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            amount DECIMAL(10, 2) NOT NULL,
-            description TEXT,
-            expense_type_id INTEGER NOT NULL,
-            date DATE NOT NULL,
-            recurring_interval TEXT CHECK (recurring_interval IN ('none', 'monthly', 'biannual', 'yearly') OR recurring_interval IS NULL),
-            recurring_day INTEGER CHECK (recurring_day >= 1 AND recurring_day <= 31),
-            is_recurring_template BOOLEAN DEFAULT FALSE,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (expense_type_id) REFERENCES expense_types(id)
-        )
-    ''')
-    
-    # Create recurring_expenses table (for tracking instances of recurring expenses)
-    cursor.execute('''
-        CREATE TABLE recurring_expense_instances (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            expense_id INTEGER NOT NULL,
-            month_id INTEGER NOT NULL,
-            instance_date DATE NOT NULL,
-            amount DECIMAL(10, 2) NOT NULL,
-            description TEXT,
-            expense_type_id INTEGER NOT NULL,
-            is_paid BOOLEAN DEFAULT FALSE,
-            paid_date DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (expense_id) REFERENCES expenses(id) ON DELETE CASCADE,
-            FOREIGN KEY (month_id) REFERENCES months(id) ON DELETE CASCADE,
-            FOREIGN KEY (expense_type_id) REFERENCES expense_types(id),
-            UNIQUE(expense_id, month_id)
-        )
-    ''')
-    
-    # Create indexes for better performance
-    cursor.execute('CREATE INDEX idx_expenses_date ON expenses(date)')
-    cursor.execute('CREATE INDEX idx_expenses_type ON expenses(expense_type_id)')
-    cursor.execute('CREATE INDEX idx_expenses_recurring ON expenses(recurring_interval)')
-    cursor.execute('CREATE INDEX idx_months_date ON months(year, month)')
-    
-    # Create trigger to update updated_at timestamp
-    cursor.execute('''
-        CREATE TRIGGER update_expense_timestamp 
-        AFTER UPDATE ON expenses
-        BEGIN
-            UPDATE expenses SET updated_at = CURRENT_TIMESTAMP
-            WHERE id = NEW.id;
-        END
-    ''')
+    # Create the tables, rollups, revision counter and indexes
+    applied = migrate(conn)
     
     # Insert default expense types
     default_types = [
@@ -122,28 +62,36 @@ def create_database():
         'Other'
     ]
     
-    for expense_type in default_types:
-        cursor.execute('INSERT INTO expense_types (name) VALUES (?)', (expense_type,))
+    # Seed the defaults into a new database only
+    seed = not conn.execute('SELECT 1 FROM expense_types LIMIT 1').fetchone()
+    if seed:
+        for expense_type in default_types:
+            # OR IGNORE: another process may be creating the same new database
+            cursor.execute('INSERT OR IGNORE INTO expense_types (name) VALUES (?)', (expense_type,))
     
     # Insert current month record
     current_date = datetime.now()
     cursor.execute('''
-        INSERT INTO months (month, year, starting_bank_value, monthly_income)
-        VALUES (?, ?, 0.00, 0.00)
+        INSERT OR IGNORE INTO months (month, year, starting_bank_value, monthly_income)
+        VALUES (?, ?, 0, 0)
     ''', (current_date.month, current_date.year))
     
     # Commit changes and close connection
     conn.commit()
     conn.close()
     
-    print(f"Database created successfully at: {DB_PATH}")
-    print(f"Created tables: expense_types, months, expenses, recurring_expense_instances")
-    print(f"Inserted {len(default_types)} default expense types")
-    print(f"Initialized current month: {current_date.strftime('%B %Y')}")
+    if not verbose:
+        return
+    print(f"Database ready at: {db_path} (schema version {LATEST_VERSION})")
+    for migration in applied:
+        print(f"Applied migration {migration.version}: {migration.name}")
+    if seed:
+        print(f"Inserted {len(default_types)} default expense types")
+    print(f"Current month: {current_date.strftime('%B %Y')}")
 
-def verify_database():
+def verify_database(db_path=None):
     """Verify the database was created correctly"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path or DB_PATH)
     cursor = conn.cursor()
     
     # Check tables exist
@@ -168,7 +116,7 @@ if __name__ == "__main__":
     print("=" * 50)
     
     try:
-        create_database()
+        create_database(reset='--reset' in sys.argv[1:])
         verify_database()
         print("\nDatabase setup completed successfully!")
     except Exception as e:
@@ -0,0 +1,332 @@
+"""
+Per-tenant SQLite databases ("shards") and the router that picks one per request.
+
+With ``SPENDING_TRACKER_SHARD_DIR`` set, every user or household (a *tenant*) gets
+its own database file, ``<shard dir>/<tenant>.db``. Tenants then never wait on each
+other's write locks, and backing up or deleting one is a file copy or removal.
+The tenant of a request is ``session['tenant_id']`` (set through ``POST /tenant``),
+or ``DEFAULT_TENANT``. Without a shard directory the app uses its single database,
+as before.
+
+Tenants are created with ``python manage.py add-tenant``, never by a request. It
+creates the database and issues an access key, and only a hash of the key is kept,
+in ``<shard dir>/<tenant>.key``. A session is only bound to a tenant after it sends
+that key. Opening a tenant that has no database raises ``UnknownTenant``; the
+exception is ``DEFAULT_TENANT``, which is created on first use like the single
+database.
+
+``ShardRouter`` is installed with ``db.set_router`` and hands ``db`` the
+connection pools of the request's shard (a writer pool and a read-only pool, as for
+the single database). It keeps the pools of at most ``max_open`` shards in an LRU,
+so a process never holds more than ``max_open * (pool_size + write_pool_size)``
+open connections however many tenants there are; evicted pools close their
+connections. A shard is
+prepared the first time a process opens it and migrated to the latest schema.
+
+``run_maintenance`` runs a task (migrate, rebuild-totals, vacuum, ...) on every
+shard in parallel with a process pool; see ``python manage.py shards``.
+
+Environment variables:
+    SPENDING_TRACKER_SHARD_DIR        directory of the tenant databases (unset: one database)
+    SPENDING_TRACKER_MAX_OPEN_SHARDS  shards whose connections a process keeps open (default 32)
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+from flask import has_request_context, session
+
+import db
+import migrations
+import setup_db
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = os.environ.get('SPENDING_TRACKER_SHARD_DIR') or None
+MAX_OPEN_SHARDS = int(os.environ.get('SPENDING_TRACKER_MAX_OPEN_SHARDS', '32'))
+
+# Tenant of requests whose session doesn't name one
+DEFAULT_TENANT = 'default'
+
+# Tenant ids are file names, so only a safe set of characters is allowed
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+SHARD_SUFFIX = '.db'
+KEY_SUFFIX = '.key'
+
+ShardResult = namedtuple('ShardResult', ['tenant', 'ok', 'message', 'seconds'])
+
+
+def check_tenant_id(tenant_id):
+    """Validate a tenant id; returns it, or raises ValueError"""
+    tenant_id = str(tenant_id or '').strip()
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise ValueError('Tenant IDs are 1-64 letters, digits, "-" or "_", starting with a letter or digit')
+    return tenant_id
+
+
+def shard_path(shard_dir, tenant_id):
+    """The database file of a tenant"""
+    return os.path.join(shard_dir, check_tenant_id(tenant_id) + SHARD_SUFFIX)
+
+
+class UnknownTenant(LookupError):
+    """The tenant has no database (tenants are created with ``manage.py add-tenant``)"""
+
+
+def _key_path(shard_dir, tenant_id):
+    return os.path.join(shard_dir, check_tenant_id(tenant_id) + KEY_SUFFIX)
+
+
+def _hash_key(access_key):
+    return hashlib.sha256(access_key.encode('utf-8')).hexdigest()
+
+
+def create_tenant(shard_dir, tenant_id):
+    """Create a tenant's database if it has none, and issue it a new access key
+
+    Any earlier key of the tenant stops working. Returns the key, which is not
+    stored anywhere in clear.
+    """
+    path = shard_path(shard_dir, tenant_id)
+    os.makedirs(shard_dir, exist_ok=True)
+    if not os.path.exists(path):
+        logger.info("Creating shard %s", path)
+        setup_db.create_database(path, verbose=False)
+    access_key = secrets.token_urlsafe(24)
+    # Written under a temporary name first, so the key file is never half written
+    temporary = _key_path(shard_dir, tenant_id) + '.tmp'
+    with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        f.write(_hash_key(access_key) + '\n')
+    os.replace(temporary, _key_path(shard_dir, tenant_id))
+    return access_key
+
+
+def check_access_key(shard_dir, tenant_id, access_key):
+    """Whether the tenant exists and ``access_key`` is its current key"""
+    tenant_id = check_tenant_id(tenant_id)
+    if not access_key or not os.path.exists(shard_path(shard_dir, tenant_id)):
+        return False
+    try:
+        with open(_key_path(shard_dir, tenant_id)) as f:
+            stored = f.read().strip()
+    except FileNotFoundError:
+        return False
+    return hmac.compare_digest(stored, _hash_key(str(access_key)))
+
+
+def list_tenants(shard_dir):
+    """Tenants that have a database in shard_dir, sorted"""
+    try:
+        names = os.listdir(shard_dir)
+    except FileNotFoundError:
+        return []
+    tenants = [name[:-len(SHARD_SUFFIX)] for name in names if name.endswith(SHARD_SUFFIX)]
+    return sorted(tenant for tenant in tenants if TENANT_ID_PATTERN.match(tenant))
+
+
+class ShardRouter:
+    """Chooses the connection pool of the request's tenant, keeping an LRU of open shards"""
+
+    def __init__(self, shard_dir, max_open=MAX_OPEN_SHARDS, pool_size=db.POOL_SIZE, auto_migrate=True,
+                 write_pool_size=db.WRITE_POOL_SIZE):
+        self.shard_dir = shard_dir
+        self.max_open = max_open
+        self.pool_size = pool_size
+        self.write_pool_size = write_pool_size
+        self.auto_migrate = auto_migrate
+        os.makedirs(shard_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pools = OrderedDict()
+        # Per-shard locks, so only one thread prepares a shard while others wait for it
+        self._opening = {}
+        self._prepared = set()
+
+    def tenant_for_request(self):
+        """The current request's tenant, or DEFAULT_TENANT outside a request"""
+        if has_request_context():
+            return session.get('tenant_id') or DEFAULT_TENANT
+        return DEFAULT_TENANT
+
+    def pool_for_request(self, read_only=False):
+        return self.pool(self.tenant_for_request(), read_only)
+
+    def pool(self, tenant_id, read_only=False):
+        """The writer (or read-only) pool of a tenant's shard, preparing the shard on first use
+
+        Raises UnknownTenant if the tenant has no database; only DEFAULT_TENANT's
+        is created here.
+        """
+        path = shard_path(self.shard_dir, tenant_id)
+        if tenant_id != DEFAULT_TENANT and not os.path.exists(path):
+            raise UnknownTenant(f"Tenant '{tenant_id}' has no database")
+        return self._shard_pools(path)[1 if read_only else 0]
+
+    def _shard_pools(self, path):
+        """(writer pool, read pool) of a shard, opening it if it isn't open"""
+        with self._lock:
+            pools = self._pools.get(path)
+            if pools is not None:
+                self._pools.move_to_end(path)
+                return pools
+            opening = self._opening.setdefault(path, threading.Lock())
+
+        with opening:
+            with self._lock:
+                pools = self._pools.get(path)
+                if pools is not None:
+                    self._pools.move_to_end(path)
+                    return pools
+            if path not in self._prepared:
+                self._prepare(path)
+                self._prepared.add(path)
+
+            pools = (db.ConnectionPool(path, self.write_pool_size),
+                     db.ConnectionPool(path, self.pool_size, read_only=True))
+            with self._lock:
+                self._pools[path] = pools
+                self._opening.pop(path, None)
+                evicted = []
+                while len(self._pools) > self.max_open:
+                    evicted.extend(self._pools.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return pools
+
+    def _prepare(self, path):
+        """Create the default tenant's database, or bring an existing one's schema up to date"""
+        if not os.path.exists(path):
+            logger.info("Creating shard %s", path)
+            setup_db.create_database(path, verbose=False)
+        elif self.auto_migrate:
+            with closing(db.connect(path)) as conn:
+                migrations.migrate(conn)
+
+    def shard_paths(self):
+        """Database files of every tenant in the shard directory"""
+        return [shard_path(self.shard_dir, tenant) for tenant in list_tenants(self.shard_dir)]
+
+    def close_all(self):
+        with self._lock:
+            pools = [pool for shard_pools in self._pools.values() for pool in shard_pools]
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def reset_after_fork(self):
+        """Forget the parent's pools in a forked child; their connections must not be used"""
+        db._inherited_pools.extend(pool for shard_pools in self._pools.values() for pool in shard_pools)
+        self._lock = threading.Lock()
+        self._pools = OrderedDict()
+        self._opening = {}
+
+
+# Maintenance tasks, run on one shard's connection; each returns (ok, message)
+
+def _migrate(conn):
+    applied = migrations.migrate(conn)
+    return True, f'applied {len(applied)} migrations, at version {migrations.current_version(conn)}'
+
+
+def _check_totals(conn):
+    from rollups import check_month_totals
+    mismatches = check_month_totals(conn)
+    return not mismatches, f'{len(mismatches)} mismatched rollup rows'
+
+
+def _rebuild_totals(conn):
+    from rollups import create_month_totals, rebuild_month_totals
+    create_month_totals(conn)
+    rebuild_month_totals(conn)
+    return True, 'rebuilt month totals'
+
+
+def _rebuild_search(conn):
+    from search import create_search_index, rebuild_search_index
+    create_search_index(conn)
+    rebuild_search_index(conn)
+    return True, 'rebuilt the search index'
+
+
+def _archive(conn):
+    from retention import archive_deleted_expenses
+    return True, f'archived {archive_deleted_expenses(conn)} deleted expenses'
+
+
+def _sync_instances(conn):
+    from scheduler import sync_window
+    result = sync_window(conn, past_months=None, future_months=None)
+    return True, f'{result.inserted} instances inserted, {result.updated} updated, {result.deleted} deleted'
+
+
+def _integrity_check(conn):
+    problems = [row[0] for row in conn.execute('PRAGMA quick_check')]
+    return problems == ['ok'], '; '.join(problems[:5])
+
+
+def _optimize(conn):
+    conn.execute('PRAGMA optimize')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return True, 'optimized and checkpointed'
+
+
+def _vacuum(conn):
+    conn.execute('VACUUM')
+    return True, 'vacuumed'
+
+
+MAINTENANCE_TASKS = {
+    'migrate': _migrate,
+    'check-totals': _check_totals,
+    'rebuild-totals': _rebuild_totals,
+    'rebuild-search': _rebuild_search,
+    'archive': _archive,
+    'sync-instances': _sync_instances,
+    'integrity-check': _integrity_check,
+    'optimize': _optimize,
+    'vacuum': _vacuum,
+}
+
+
+def _run_task(task, shard_dir, tenant_id):
+    """Run one task on one shard (in a worker process)"""
+    started = time.perf_counter()
+    # Connecting would create an empty file for a tenant that doesn't exist
+    if not os.path.exists(shard_path(shard_dir, tenant_id)):
+        return ShardResult(tenant_id, False, 'no database for this tenant', 0.0)
+    try:
+        with closing(db.connect(shard_path(shard_dir, tenant_id))) as conn:
+            ok, message = MAINTENANCE_TASKS[task](conn)
+    except (sqlite3.Error, RuntimeError, ValueError) as e:
+        ok, message = False, f'{type(e).__name__}: {e}'
+    return ShardResult(tenant_id, ok, message, time.perf_counter() - started)
+
+
+def run_maintenance(shard_dir, task, tenants=None, jobs=None):
+    """Run a maintenance task on many shards in parallel worker processes
+
+    Args:
+        shard_dir: Directory of the tenant databases
+        task: Name of a task in MAINTENANCE_TASKS
+        tenants: Tenant ids to include (default: every shard in shard_dir)
+        jobs: Worker processes (default: one per CPU)
+
+    Returns:
+        List of ShardResult, in tenant order
+    """
+    if task not in MAINTENANCE_TASKS:
+        raise ValueError(f"Unknown maintenance task '{task}'")
+    tenants = [check_tenant_id(tenant) for tenant in tenants] if tenants else list_tenants(shard_dir)
+    if not tenants:
+        return []
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(tenants))) as executor:
+        return list(executor.map(_run_task, [task] * len(tenants), [shard_dir] * len(tenants), tenants))
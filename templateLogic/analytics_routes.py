@@ -0,0 +1,129 @@
+from flask import Blueprint, request, jsonify
+from datetime import date
+import logging
+import sqlite3
+from db import get_db_connection
+from metadata_cache import get_expense_type_names, get_latest_month
+from money import from_cents
+from months import parse_year_month
+from recurrence import index_to_month, month_index
+import analytics
+
+logger = logging.getLogger(__name__)
+
+# Create a Blueprint for the spending analytics API
+analytics_routes = Blueprint('analytics_routes', __name__)
+
+# Default number of categories in top_categories
+DEFAULT_TOP = 5
+
+
+def _month_label(year, month):
+    return f'{year:04d}-{month:02d}'
+
+
+def _default_end(conn):
+    """The most recent month in the database, or the current month"""
+    latest = get_latest_month(conn)
+    if latest:
+        return latest['year'], latest['month']
+    today = date.today()
+    return today.year, today.month
+
+
+def _expense_type_ids(args):
+    """expense_type_id may be repeated or comma separated; 'all' (the default) means no filter"""
+    ids = set()
+    for value in args.getlist('expense_type_id'):
+        for part in value.split(','):
+            part = part.strip()
+            if not part or part == 'all':
+                continue
+            if not part.isdigit():
+                raise ValueError(f"Invalid expense type '{part}'")
+            ids.add(int(part))
+    return sorted(ids)
+
+
+@analytics_routes.route('', methods=['GET'])
+def spending_analytics():
+    """Multi-year spending trends as JSON
+
+    Query parameters:
+        start, end: inclusive range as 'YYYY-MM' (default: the 12 months ending with
+            the most recent month)
+        window: months in the rolling totals, 12 by default (trailing 12 months)
+        expense_type_id: optional type filter, repeated or comma separated
+        by_type: 1 for one monthly series per expense type
+        top: number of top categories to return (default 5)
+
+    Every month carries its total, rolling total and average, and the values a
+    year earlier. Calendar years in the range get year-over-year totals.
+    """
+    conn = get_db_connection()
+
+    try:
+        end = parse_year_month(request.args['end']) if request.args.get('end') else _default_end(conn)
+        if request.args.get('start'):
+            start = parse_year_month(request.args['start'])
+        else:
+            start = index_to_month(month_index(*end) - 11)
+        window = int(request.args.get('window', 12))
+        top = int(request.args.get('top', DEFAULT_TOP))
+        by_type = request.args.get('by_type', '').lower() in ('1', 'true', 'yes')
+        expense_type_ids = _expense_type_ids(request.args)
+
+        monthly = analytics.monthly_trends(conn, start, end, window=window,
+                                           expense_type_ids=expense_type_ids, by_type=by_type)
+        categories = analytics.top_categories(conn, start, end, expense_type_ids=expense_type_ids,
+                                              limit=max(top, 0))
+        years = analytics.yearly_totals(conn, start[0], end[0], expense_type_ids=expense_type_ids)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except sqlite3.Error as e:
+        logger.exception("Error computing analytics for %s to %s", request.args.get('start'), request.args.get('end'))
+        return jsonify({'success': False, 'message': f'Database error: {e}'}), 500
+
+    type_names = get_expense_type_names(conn)
+
+    # Amounts leave the app in dollars
+    return jsonify({
+        'success': True,
+        'range': {
+            'start': _month_label(*start),
+            'end': _month_label(*end),
+            'months': month_index(*end) - month_index(*start) + 1,
+        },
+        'window': window,
+        'expense_type_ids': expense_type_ids or None,
+        'monthly': [{
+            'month': _month_label(row['year'], row['month']),
+            'expense_type_id': row['expense_type_id'],
+            'expense_type_name': type_names.get(row['expense_type_id']) if by_type else None,
+            'total': from_cents(row['total']),
+            'expense_count': row['expense_count'],
+            'rolling_total': from_cents(row['rolling_total']),
+            'rolling_average': from_cents(round(row['rolling_average'])),
+            'previous_year_total': from_cents(row['previous_year_total']),
+            'yoy_change': analytics.change(row['total'], row['previous_year_total']),
+            'rolling_yoy_change': analytics.change(row['rolling_total'], row['previous_year_rolling_total']),
+        } for row in monthly],
+        'top_categories': [{
+            'rank': row['rank'],
+            'expense_type_id': row['expense_type_id'],
+            'expense_type_name': type_names.get(row['expense_type_id'], 'Unknown'),
+            'total': from_cents(row['total']),
+            'expense_count': row['expense_count'],
+            'monthly_average': from_cents(round(row['monthly_average'])),
+            'share': row['share'],
+            'previous_year_total': from_cents(row['previous_year_total']),
+            'yoy_change': analytics.change(row['total'], row['previous_year_total']),
+        } for row in categories],
+        'years': [{
+            'year': row['year'],
+            'total': from_cents(row['total']),
+            'expense_count': row['expense_count'],
+            'previous_year_total': from_cents(row['previous_year_total']),
+            'yoy_change': analytics.change(row['total'], row['previous_year_total']),
+        } for row in years],
+    })
@@ -1,25 +1,79 @@
-from flask import Blueprint, request, redirect, url_for, render_template, flash, session
+from flask import Blueprint, request, redirect, url_for, render_template, flash, session, jsonify, Response, stream_with_context
+import io
+import logging
 import sqlite3
-import os
+from db import get_db_connection
+from metadata_cache import get_active_expense_types, get_expense_type_names, get_latest_month, get_month, get_months
 from datetime import datetime
+from importer import detect_format, import_stream
+from exporter import EXPORT_FORMATS, iter_export_rows, stream_export
+from response_cache import cached_page
+from money import from_cents, to_cents
+from search import MAX_PER_PAGE, search_expenses
+from retention import list_deleted_expenses, restore_expense
+from batch_writes import MAX_BATCH_OPERATIONS, NOT_APPLIED, apply_batch
+from scheduler import templates_changed
+
+logger = logging.getLogger(__name__)
 
 # Create a Blueprint for expense-related routes
 expense_routes = Blueprint('expense_routes', __name__)
 
-# Database configuration
-DB_NAME = 'spending_tracker.db'
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), DB_NAME)
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_recurring_expenses_for_months(conn, months):
+    """
+    Get the recurring expenses that appear in each of several months.
+    These are the instances the scheduler keeps materialized (see scheduler.py),
+    read with one query for all months; templates are never expanded here.
+    
+    Args:
+        conn: Database connection
+        months: Iterable of (year, month) pairs
+        
+    Returns:
+        Dict mapping (year, month) to the list of recurring expense dictionaries for that month
+    """
+    month_recurring_expenses = {(int(year), int(month)): [] for year, month in months}
+    if not month_recurring_expenses:
+        return month_recurring_expenses
+    first, last = min(month_recurring_expenses), max(month_recurring_expenses)
+    
+    # Expense type names come from the metadata cache instead of a join
+    expense_type_names = get_expense_type_names(conn)
+    
+    cursor = conn.cursor()
+    # Plain tuples are much cheaper to build than sqlite3.Row objects
+    cursor.row_factory = None
+    rows = cursor.execute('''
+        SELECT m.year, m.month, rei.expense_id, rei.amount, rei.description, rei.instance_date,
+               rei.expense_type_id, t.recurring_interval, t.recurring_day
+        FROM months m
+        JOIN recurring_expense_instances rei ON rei.month_id = m.id
+        JOIN expenses t ON t.id = rei.expense_id
+        WHERE (m.year, m.month) BETWEEN (?, ?) AND (?, ?)
+        ORDER BY rei.expense_id
+    ''', (*first, *last))
+    for year, month, expense_id, amount, description, date, expense_type_id, interval, day in rows:
+        if (year, month) not in month_recurring_expenses:
+            continue
+        
+        # Create a dictionary with expense details
+        month_recurring_expenses[(year, month)].append({
+            'id': expense_id,
+            'amount': amount,
+            'description': description,
+            'date': date,
+            'expense_type_id': expense_type_id,
+            'expense_type_name': expense_type_names.get(expense_type_id, 'Unknown'),
+            'recurring_interval': interval,
+            'recurring_day': day,
+            'is_recurring_instance': True  # Flag to indicate this is a recurring instance
+        })
+    
+    return month_recurring_expenses
 
 def get_recurring_expenses_for_month(conn, month_id, month, year):
     """
-    Get recurring expenses that should appear in the specified month.
-    This checks all active recurring expenses and determines which ones should appear
-    in the given month based on their recurring_interval.
+    Get the recurring expenses that appear in the specified month.
     
     Args:
         conn: Database connection
@@ -28,107 +82,79 @@ def get_recurring_expenses_for_month(conn, month_id, month, year):
         year: Year (e.g., 2025)
         
     Returns:
-        List of recurring expense dictionaries that should appear in this month
+        List of recurring expense dictionaries for this month
     """
-    # Get all active recurring expenses that are templates
-    recurring_expenses = conn.execute("""
-        SELECT id, amount, description, date, expense_type_id, recurring_interval, recurring_day
-        FROM expenses
-        WHERE is_active = 1 AND recurring_interval != 'none' AND is_recurring_template = TRUE
-    """).fetchall()
-    
-    # List to store recurring expenses for this month
-    month_recurring_expenses = []
-    
-    # Calculate the target date for the month
-    from datetime import date
-    from dateutil.relativedelta import relativedelta
+    return get_recurring_expenses_for_months(conn, [(year, month)])[(int(year), int(month))]
+
+# A month's expenses as one relation: active regular expenses dated in the month plus
+# the month's materialized recurring instances, with the template's id and schedule.
+# Bind with month_expense_params().
+MONTH_EXPENSES_CTE = '''
+    month_recurring AS (
+        SELECT rei.expense_id AS id, rei.amount, rei.description, rei.instance_date AS date,
+               t.recurring_interval, t.recurring_day,
+               COALESCE(et.name, 'Unknown') AS expense_type_name, rei.expense_type_id, 1 AS is_recurring_instance
+        FROM recurring_expense_instances rei
+        JOIN expenses t ON t.id = rei.expense_id
+        LEFT JOIN expense_types et ON rei.expense_type_id = et.id
+        WHERE rei.month_id = :month_id
+          AND (:expense_type_id IS NULL OR rei.expense_type_id = :expense_type_id)
+    ),
+    month_expenses AS (
+        SELECT e.id, e.amount, e.description, e.date, e.recurring_interval, e.recurring_day,
+               et.name AS expense_type_name, et.id AS expense_type_id, 0 AS is_recurring_instance
+        FROM expenses e
+        JOIN expense_types et ON e.expense_type_id = et.id
+        WHERE e.is_active = TRUE AND e.date >= :start_date AND e.date < :end_date
+          AND (:expense_type_id IS NULL OR e.expense_type_id = :expense_type_id)
+        UNION ALL
+        SELECT * FROM month_recurring
+    )
+'''
+
+def month_expense_params(month_data, expense_type_filter='all'):
+    """Named parameters for MONTH_EXPENSES_CTE for a months row and type filter"""
+    year, month = month_data['year'], month_data['month']
     
-    # Calculate start and end dates for the current month
+    # Calculate start and end dates for the month
     start_date = f"{year}-{month:02d}-01"
     if month == 12:
         end_date = f"{year + 1}-01-01"
     else:
         end_date = f"{year}-{month + 1:02d}-01"
     
-    for expense in recurring_expenses:
-        # Get the original expense date
-        original_date = datetime.strptime(expense['date'], '%Y-%m-%d').date()
-        expense_id = expense['id']
-        recurring_interval = expense['recurring_interval']
-        recurring_day = expense['recurring_day']
-        
-        # Skip if the original expense was created in the current month
-        # This prevents duplicate entries in the month the recurring expense was created
-        original_date_str = original_date.strftime('%Y-%m-%d')
-        if original_date_str >= start_date and original_date_str < end_date:
-            continue
-        
-        # Determine if this recurring expense should be included in this month
-        should_include = False
-        new_expense_date = None
-        
-        if recurring_interval == 'monthly':
-            # Monthly expenses recur every month on the specified day
-            should_include = True
-            
-            # Use the recurring_day if specified, otherwise use the day from the original date
-            day_to_use = int(recurring_day) if recurring_day is not None else original_date.day
-            
-            # Make sure the day is valid for the month (e.g., no February 30)
-            last_day_of_month = (date(year, month, 1) + relativedelta(months=1, days=-1)).day
-            day_to_use = min(day_to_use, last_day_of_month)
-            
-            new_expense_date = date(year, month, day_to_use)
-            
-        elif recurring_interval == 'biannual':
-            # Biannual expenses recur every 6 months
-            # Calculate months difference between original date and target date
-            months_diff = (year - original_date.year) * 12 + (month - original_date.month)
-            should_include = months_diff % 6 == 0
-            
-            if should_include:
-                # Use the same day of the month if possible
-                day_to_use = min(original_date.day, (date(year, month, 1) + relativedelta(months=1, days=-1)).day)
-                new_expense_date = date(year, month, day_to_use)
-            
-        elif recurring_interval == 'yearly':
-            # Yearly expenses recur every 12 months
-            # Check if month and day match (same month every year)
-            should_include = month == original_date.month
-            
-            if should_include:
-                # Use the same day of the month if possible
-                day_to_use = min(original_date.day, (date(year, month, 1) + relativedelta(months=1, days=-1)).day)
-                new_expense_date = date(year, month, day_to_use)
-        
-        # If this expense should be included in this month, add it to the list
-        if should_include and new_expense_date:
-            # Format the date as string
-            new_date_str = new_expense_date.strftime('%Y-%m-%d')
-            
-            # Get expense type name
-            expense_type = conn.execute('SELECT name FROM expense_types WHERE id = ?', (expense['expense_type_id'],)).fetchone()
-            expense_type_name = expense_type['name'] if expense_type else 'Unknown'
-            
-            # Create a dictionary with expense details
-            recurring_expense = {
-                'id': expense['id'],
-                'amount': expense['amount'],
-                'description': expense['description'],
-                'date': new_date_str,
-                'expense_type_id': expense['expense_type_id'],
-                'expense_type_name': expense_type_name,
-                'recurring_interval': recurring_interval,
-                'recurring_day': recurring_day,
-                'is_recurring_instance': True  # Flag to indicate this is a recurring instance
-            }
-            
-            month_recurring_expenses.append(recurring_expense)
+    # 'all' (or anything that is not a type id) means no type filter
+    try:
+        expense_type_id = int(expense_type_filter)
+    except (TypeError, ValueError):
+        expense_type_id = None
     
-    return month_recurring_expenses
+    return {'month_id': month_data['id'], 'start_date': start_date, 'end_date': end_date,
+            'expense_type_id': expense_type_id}
+
+def get_expense_type_summary(conn, month_data, expense_type_filter='all'):
+    """Per-type totals and counts for a month, regular and recurring amounts combined
+
+    One GROUP BY over MONTH_EXPENSES_CTE; the result has one row per expense type,
+    so its size depends on the number of types, not the number of expenses. Amounts
+    are integer cents; every row also carries the month's total_amount and total_count.
+    """
+    return conn.execute(f'''
+        WITH {MONTH_EXPENSES_CTE}
+        SELECT expense_type_id, expense_type_name,
+               SUM(amount) AS amount,
+               COUNT(*) AS expense_count,
+               SUM(CASE WHEN is_recurring_instance THEN 0 ELSE amount END) AS regular_amount,
+               SUM(CASE WHEN is_recurring_instance THEN amount ELSE 0 END) AS recurring_amount,
+               SUM(SUM(amount)) OVER () AS total_amount,
+               SUM(COUNT(*)) OVER () AS total_count
+        FROM month_expenses
+        GROUP BY expense_type_id
+        ORDER BY expense_type_name
+    ''', month_expense_params(month_data, expense_type_filter)).fetchall()
 
 @expense_routes.route('/view', methods=['GET'])
+@cached_page
 def view_expenses():
     """View expenses for a specific month"""
     conn = get_db_connection()
@@ -145,7 +171,7 @@ def view_expenses():
     
     # If still no month_id, get the most recent month
     if not month_id:
-        current_month = conn.execute('SELECT id FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+        current_month = get_latest_month(conn)
         if current_month:
             month_id = current_month['id']
             # Store in session
@@ -154,74 +180,35 @@ def view_expenses():
     # Get month details
     month_data = None
     if month_id:
-        month_data = conn.execute('SELECT * FROM months WHERE id = ?', (month_id,)).fetchone()
+        month_data = get_month(conn, month_id)
     
     # If no month found, redirect to index
     if not month_data:
-        conn.close()
         return redirect(url_for('index'))
     
     # Get all expense types for filtering
-    expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
+    expense_types = get_active_expense_types(conn)
     
     # Get filter parameters
     expense_type_filter = request.args.get('expense_type_id', 'all')
     sort_by = request.args.get('sort_by', 'date')
     sort_order = request.args.get('sort_order', 'desc')
+    if sort_order not in ('asc', 'desc'):
+        sort_order = 'desc'
     
     # Pagination parameters
     page = request.args.get('page', 1, type=int)
     per_page = 10  # Show 10 expenses per page
     
-    # Build the query based on filters
-    query = '''
-        SELECT e.id, e.amount, e.description, e.date, e.recurring_interval, e.recurring_day,
-               et.name as expense_type_name, et.id as expense_type_id
-        FROM expenses e
-        JOIN expense_types et ON e.expense_type_id = et.id
-        WHERE e.is_active = TRUE
-    '''
-    
-    # Build the count query to get total number of expenses
-    count_query = '''
-        SELECT COUNT(*) as total
-        FROM expenses e
-        JOIN expense_types et ON e.expense_type_id = et.id
-        WHERE e.is_active = TRUE
-    '''
-    
-    query_params = []
+    # Regular expenses and this month's recurring instances are merged inside SQLite,
+    # so filtering, sorting, counting and paging never touch rows outside the page
+    query_params = month_expense_params(month_data, expense_type_filter)
     
-    # Add date range filter for the selected month
-    start_date = f"{month_data['year']}-{month_data['month']:02d}-01"
-    
-    # Calculate end date based on month/year
-    if month_data['month'] == 12:
-        end_date = f"{month_data['year'] + 1}-01-01"
-    else:
-        end_date = f"{month_data['year']}-{month_data['month'] + 1:02d}-01"
-    
-    query += " AND e.date >= ? AND e.date < ?"
-    count_query += " AND e.date >= ? AND e.date < ?"
-    query_params.extend([start_date, end_date])
-    
-    # Add expense type filter if specified
-    if expense_type_filter != 'all':
-        query += " AND e.expense_type_id = ?"
-        count_query += " AND e.expense_type_id = ?"
-        query_params.append(expense_type_filter)
-    
-    # Add sorting
-    if sort_by == 'amount':
-        query += f" ORDER BY e.amount {sort_order}"
-    elif sort_by == 'expense_type':
-        query += f" ORDER BY et.name {sort_order}"
-    else:  # Default to date
-        query += f" ORDER BY e.date {sort_order}"
-    
-    # Get total count of expenses matching the filter
-    total_count_result = conn.execute(count_query, query_params).fetchone()
-    total_count = total_count_result['total'] if total_count_result else 0
+    # Per-type totals give the overall count and total amount (the chart itself
+    # fetches them from /expenses/api/summary)
+    type_summary = get_expense_type_summary(conn, month_data, expense_type_filter)
+    total_count = type_summary[0]['total_count'] if type_summary else 0
+    total_amount = type_summary[0]['total_amount'] if type_summary else 0
     
     # Calculate total pages
     total_pages = (total_count + per_page - 1) // per_page  # Ceiling division
@@ -232,71 +219,32 @@ def view_expenses():
     elif page > total_pages and total_pages > 0:
         page = total_pages
     
-    # Add pagination
-    offset = (page - 1) * per_page
-    query += f" LIMIT {per_page} OFFSET {offset}"
-    
-    # Execute the query
-    expenses = conn.execute(query, query_params).fetchall()
-    
-    # Get all expenses for chart data and total amount calculation
-    # We need all expenses for the chart, not just the paginated ones
-    chart_query = query.replace(f" LIMIT {per_page} OFFSET {offset}", "")
-    all_expenses = conn.execute(chart_query, query_params).fetchall()
-    
-    # Get recurring expenses for this month
-    recurring_expenses = get_recurring_expenses_for_month(
-        conn, 
-        month_id, 
-        month_data['month'], 
-        month_data['year']
-    )
-    
-    # Add recurring expenses to the list of expenses
-    # Note: These are not stored in the database yet, just calculated on-the-fly
-    all_expenses = list(all_expenses) + recurring_expenses
-    
-    # For pagination, we need to handle the combined list
-    # Sort the combined list according to the sort criteria
-    if sort_by == 'amount':
-        all_expenses.sort(key=lambda x: x['amount'], reverse=(sort_order == 'desc'))
-    elif sort_by == 'expense_type':
-        all_expenses.sort(key=lambda x: x['expense_type_name'], reverse=(sort_order == 'desc'))
-    else:  # Default to date
-        all_expenses.sort(key=lambda x: x['date'], reverse=(sort_order == 'desc'))
-    
-    # Apply expense type filter to the combined list if needed
-    if expense_type_filter != 'all':
-        all_expenses = [e for e in all_expenses if str(e['expense_type_id']) == str(expense_type_filter)]
-    
-    # Update total count for pagination
-    total_count = len(all_expenses)
-    
-    # Calculate total pages based on the new count
-    total_pages = (total_count + per_page - 1) // per_page  # Ceiling division
-    
-    # Ensure page is within valid range
-    if page < 1:
-        page = 1
-    elif page > total_pages and total_pages > 0:
-        page = total_pages
-    
-    # Apply pagination to the combined list
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    expenses = all_expenses[start_idx:end_idx] if start_idx < len(all_expenses) else []
-    
-    # Calculate total amount for filtered expenses (using all expenses, not just paginated ones)
-    total_amount = sum(expense['amount'] for expense in all_expenses)
+    # Add sorting (ties broken by id so pages never overlap)
+    sort_columns = {'amount': 'amount', 'expense_type': 'expense_type_name'}
+    sort_column = sort_columns.get(sort_by, 'date')
+    
+    # Fetch only the requested page
+    query_params.update(limit=per_page, offset=(page - 1) * per_page)
+    expenses = conn.execute(f'''
+        WITH {MONTH_EXPENSES_CTE}
+        SELECT * FROM month_expenses
+        ORDER BY {sort_column} {sort_order}, is_recurring_instance, id
+        LIMIT :limit OFFSET :offset
+    ''', query_params).fetchall()
+    
+    # Recurring expenses for the summary card
+    recurring_expenses = conn.execute(f'''
+        WITH {MONTH_EXPENSES_CTE}
+        SELECT * FROM month_recurring
+        ORDER BY {sort_column} {sort_order}, id
+    ''', query_params).fetchall()
     
     # Get all available months for the month selector
-    all_months = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC').fetchall()
-    
-    conn.close()
+    all_months = get_months(conn)
     
     return render_template('view_expenses.html', 
                           expenses=expenses,
-                          all_expenses=all_expenses,  # For chart data
+                          recurring_expenses=recurring_expenses,
                           month_data=month_data,
                           expense_types=expense_types,
                           all_months=all_months,
@@ -308,6 +256,41 @@ def view_expenses():
                           per_page=per_page,
                           total_pages=total_pages)
 
+@expense_routes.route('/api/summary', methods=['GET'])
+def expense_summary():
+    """Per-type expense totals for a month as JSON (used by the pie chart)
+
+    Query parameters:
+        month_id: month to summarize (defaults to the current or most recent month)
+        expense_type_id: optional type filter, 'all' by default
+    """
+    conn = get_db_connection()
+    
+    month_id = request.args.get('month_id') or session.get('current_month_id')
+    month_data = get_month(conn, month_id) if month_id else get_latest_month(conn)
+    if not month_data:
+        return jsonify({'success': False, 'message': 'Month not found'}), 404
+    
+    type_summary = get_expense_type_summary(conn, month_data, request.args.get('expense_type_id', 'all'))
+    
+    # Amounts leave the app in dollars
+    types = [{
+        'expense_type_id': row['expense_type_id'],
+        'expense_type_name': row['expense_type_name'],
+        'amount': from_cents(row['amount']),
+        'expense_count': row['expense_count'],
+        'regular_amount': from_cents(row['regular_amount']),
+        'recurring_amount': from_cents(row['recurring_amount']),
+    } for row in type_summary]
+    
+    return jsonify({
+        'success': True,
+        'month': {'id': month_data['id'], 'year': month_data['year'], 'month': month_data['month']},
+        'total_amount': from_cents(type_summary[0]['total_amount'] if type_summary else 0),
+        'total_count': type_summary[0]['total_count'] if type_summary else 0,
+        'types': types,
+    })
+
 @expense_routes.route('/edit', methods=['POST'])
 def edit_expense():
     """Edit an existing expense"""
@@ -337,44 +320,16 @@ def edit_expense():
                 except ValueError:
                     pass
         
+        # Amounts are stored as integer cents
+        try:
+            amount = to_cents(amount) if amount else None
+        except ValueError:
+            amount = None
+        
         # Basic validation
-        if not expense_id or not amount or not expense_type_id or not date:
-            # Get month details for redirect
-            month_data = conn.execute('SELECT * FROM months WHERE id = ?', (month_id,)).fetchone()
-            expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
-            all_months = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC').fetchall()
-            
-            # Get expenses for the current month to redisplay
-            start_date = f"{month_data['year']}-{month_data['month']:02d}-01"
-            
-            # Calculate end date based on month/year
-            if month_data['month'] == 12:
-                end_date = f"{month_data['year'] + 1}-01-01"
-            else:
-                end_date = f"{month_data['year']}-{month_data['month'] + 1:02d}-01"
-            
-            expenses = conn.execute('''
-                SELECT e.id, e.amount, e.description, e.date, e.is_recurring, e.recurring_day,
-                       et.name as expense_type_name, et.id as expense_type_id
-                FROM expenses e
-                JOIN expense_types et ON e.expense_type_id = et.id
-                WHERE e.is_active = TRUE AND e.date >= ? AND e.date < ?
-                ORDER BY e.date DESC
-            ''', (start_date, end_date)).fetchall()
-            
-            total_amount = sum(expense['amount'] for expense in expenses)
-            
-            conn.close()
-            return render_template('view_expenses.html',
-                                  expenses=expenses,
-                                  month_data=month_data,
-                                  expense_types=expense_types,
-                                  all_months=all_months,
-                                  expense_type_filter='all',
-                                  sort_by='date',
-                                  sort_order='desc',
-                                  total_amount=total_amount,
-                                  edit_error='Missing required fields')
+        if not expense_id or amount is None or not expense_type_id or not date:
+            flash('Missing required fields', 'danger')
+            return redirect(url_for('expense_routes.view_expenses', month_id=month_id))
         
         try:
             # Update the expense in the database
@@ -385,19 +340,18 @@ def edit_expense():
                 WHERE id = ?
             ''', (amount, description, expense_type_id, date, recurring_interval, recurring_day, expense_id))
             conn.commit()
+            # Recurring instances follow the template from the current month on
+            templates_changed(conn, [expense_id])
             flash('Expense updated successfully', 'success')
         except sqlite3.Error as e:
             # Handle database error
             conn.rollback()
             flash(f'Error updating expense: {str(e)}', 'danger')
-        finally:
-            conn.close()
         
         # Redirect back to view expenses page with the same month
         return redirect(url_for('expense_routes.view_expenses', month_id=month_id))
     
     # If not POST, redirect to view expenses
-    conn.close()
     return redirect(url_for('expense_routes.view_expenses'))
 
 @expense_routes.route('/delete', methods=['POST'])
@@ -413,7 +367,6 @@ def delete_expense():
         # Basic validation
         if not expense_id:
             flash('Missing expense ID', 'danger')
-            conn.close()
             return redirect(url_for('expense_routes.view_expenses', month_id=month_id))
         
         try:
@@ -426,17 +379,280 @@ def delete_expense():
                 WHERE id = ?
             ''', (expense_id,))
             conn.commit()
+            # A deleted template's instances leave the current and future months
+            templates_changed(conn, [expense_id])
             flash('Expense deleted successfully', 'success')
         except sqlite3.Error as e:
             # Handle database error
             conn.rollback()
             flash(f'Error deleting expense: {str(e)}', 'danger')
-        finally:
-            conn.close()
         
         # Redirect back to view expenses page with the same month
         return redirect(url_for('expense_routes.view_expenses', month_id=month_id))
     
     # If not POST, redirect to view expenses
-    conn.close()
     return redirect(url_for('expense_routes.view_expenses'))
+
+@expense_routes.route('/deleted', methods=['GET'])
+def deleted_expenses():
+    """List deleted expenses as JSON, most recently deleted first
+
+    Query parameters:
+        limit: number of expenses to return (default 50, at most 500)
+
+    Expenses that were deleted long ago have been moved to the archive; they are
+    listed with ``archived: true`` and can still be undeleted.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+
+    conn = get_db_connection()
+    expense_type_names = get_expense_type_names(conn)
+    rows = list_deleted_expenses(conn, limit)
+    return jsonify({
+        'success': True,
+        'expenses': [{
+            'id': row['id'],
+            'date': row['date'],
+            'amount': from_cents(row['amount']),
+            'description': row['description'],
+            'expense_type_id': row['expense_type_id'],
+            'expense_type_name': expense_type_names.get(row['expense_type_id'], 'Unknown'),
+            'deleted_at': row['deleted_at'],
+            'archived': bool(row['archived']),
+        } for row in rows],
+    })
+
+@expense_routes.route('/undelete', methods=['POST'])
+def undelete_expense():
+    """Bring back a deleted expense, including one already moved to the archive
+
+    The expense id comes from the form field or JSON key ``expense_id``.
+    """
+    data = request.get_json(silent=True) or request.form
+    try:
+        expense_id = int(data.get('expense_id'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Missing or invalid expense ID'}), 400
+
+    conn = get_db_connection()
+    try:
+        restored = restore_expense(conn, expense_id)
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.exception("Error undeleting expense %s", expense_id)
+        return jsonify({'success': False, 'message': f'Error undeleting expense: {str(e)}'}), 500
+
+    if restored is None:
+        return jsonify({'success': False, 'message': f'No deleted expense with ID {expense_id}'}), 404
+    templates_changed(conn, [expense_id])
+    return jsonify({'success': True, 'message': 'Expense restored', 'expense_id': expense_id,
+                    'from_archive': restored == 'restored'})
+
+@expense_routes.route('/api/batch', methods=['POST'])
+def batch_expenses():
+    """Create, update and delete many expenses in one request and one transaction
+
+    The JSON body is a list of operations, or an object with an ``operations`` list:
+        {"op": "create", "amount": 12.5, "expense_type_id": 3, "date": "2024-05-01",
+         "description": "Lunch", "recurring_interval": "none"}
+        {"op": "update", "id": 42, "amount": 13.0}
+        {"op": "delete", "id": 43}
+
+    Every operation is validated first; if any is invalid nothing is applied and the
+    response (400) gives each operation's error. Otherwise all of them are written
+    in one transaction and each result carries the expense id (new ids for creates).
+    """
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'message': 'Send a JSON list of operations'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'success': False,
+                        'message': f'At most {MAX_BATCH_OPERATIONS} operations can be sent at once'}), 413
+
+    conn = get_db_connection()
+    try:
+        batch = apply_batch(conn, operations)
+    except sqlite3.Error as e:
+        logger.exception("Error applying a batch of %d expense operations", len(operations))
+        return jsonify({'success': False, 'message': f'Error applying batch: {str(e)}'}), 500
+
+    if not batch.applied:
+        invalid = sum(1 for result in batch.results if result['error'] != NOT_APPLIED)
+        return jsonify({'success': False,
+                        'message': f'{invalid} of {len(operations)} operations are invalid; nothing was applied',
+                        'results': batch.results}), 400
+
+    templates_changed(conn, [result['id'] for result in batch.results])
+    counts = {op: sum(1 for result in batch.results if result['op'] == op) for op in ('create', 'update', 'delete')}
+    logger.info("Applied expense batch: %(create)d created, %(update)d updated, %(delete)d deleted", counts)
+    return jsonify({
+        'success': True,
+        'message': f'Applied {len(operations)} operations',
+        'created': counts['create'],
+        'updated': counts['update'],
+        'deleted': counts['delete'],
+        'results': batch.results,
+    })
+
+@expense_routes.route('/import', methods=['POST'])
+def import_expenses():
+    """Bulk import expenses from an uploaded CSV or OFX file
+
+    The file is sent either as the multipart field ``file`` or as the raw request body
+    (e.g. ``curl --data-binary @export.csv -H 'Content-Type: text/csv'``) and is read as
+    a stream. Options come from form fields or query parameters:
+        format: 'csv', 'ofx' or 'qfx' (guessed from the file name if omitted)
+        date_column, amount_column, description_column, type_column: CSV column names
+        date_format: strptime format of the dates (common formats are tried otherwise)
+        default_type: expense type for rows without a known type (default 'Other')
+        create_types: '1' to create unknown expense types instead of using the default
+        map: 'CATEGORY=TYPE' to import a category in the file as another type (repeatable)
+    """
+    options = request.values
+    upload = request.files.get('file')
+    if upload is not None:
+        binary, filename = upload.stream, upload.filename
+    elif request.content_length or request.headers.get('Transfer-Encoding') == 'chunked':
+        binary, filename = request.stream, None
+    else:
+        return jsonify({'success': False, 'message': 'No file uploaded'}), 400
+
+    file_format = options.get('format') or detect_format(filename)
+    columns = {
+        field: options[f'{field}_column']
+        for field in ('date', 'amount', 'description')
+        if options.get(f'{field}_column')
+    }
+    if options.get('type_column'):
+        columns['expense_type'] = options['type_column']
+    type_map = dict(
+        (category.strip(), type_name.strip())
+        for category, _, type_name in (mapping.partition('=') for mapping in options.getlist('map'))
+    )
+
+    conn = get_db_connection()
+    stream = io.TextIOWrapper(binary, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        result = import_stream(
+            conn, stream, file_format, columns,
+            type_map=type_map,
+            default_type=options.get('default_type', 'Other') or None,
+            create_types=options.get('create_types') in ('1', 'true', 'on'),
+            date_format=options.get('date_format') or None,
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'success': False, 'message': f'Error importing expenses: {str(e)}'}), 500
+    finally:
+        # Don't let the wrapper close the upload stream; werkzeug cleans it up
+        stream.detach()
+
+    summary = result.to_dict()
+    logger.info("Imported %d of %d rows (%s rows/sec, %d errors)",
+                result.rows_imported, result.rows_read, summary['rows_per_second'], result.error_count)
+    return jsonify(dict(summary, success=True,
+                        message=f'Imported {result.rows_imported} expenses'))
+
+@expense_routes.route('/export', methods=['GET'])
+def export_expenses():
+    """Stream expenses and recurring instances as CSV or NDJSON
+
+    Query parameters:
+        format: 'csv' (default) or 'ndjson'
+        start_date, end_date: inclusive YYYY-MM-DD range (open-ended if omitted)
+        expense_type_id: type id to include (repeatable; all types if omitted)
+        include_recurring: '0' to leave out generated recurring instances
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f"Unsupported export format '{export_format}'"}), 400
+
+    try:
+        start_date, end_date = (
+            datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else None
+            for value in (request.args.get('start_date'), request.args.get('end_date'))
+        )
+        expense_type_ids = [int(value) for value in request.args.getlist('expense_type_id') if value != 'all']
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date or expense type filter'}), 400
+
+    conn = get_db_connection()
+    rows = iter_export_rows(
+        conn, start_date, end_date, expense_type_ids,
+        include_recurring=request.args.get('include_recurring', '1') != '0',
+    )
+
+    filename = f"expenses_{start_date or 'start'}_{end_date or 'end'}.{export_format}"
+    return Response(
+        # Keeps the request (and its pooled connection) alive while the body streams
+        stream_with_context(stream_export(rows, export_format)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Ask proxies not to buffer the whole export before forwarding it
+            'X-Accel-Buffering': 'no',
+        },
+    )
+
+@expense_routes.route('/search', methods=['GET'])
+def expense_search():
+    """Full-text search over descriptions and type names, as JSON
+
+    Query parameters:
+        q: search text; every term of 3+ characters must appear as a substring
+        start_date, end_date: inclusive YYYY-MM-DD range (open-ended if omitted)
+        expense_type_id: type id to include (repeatable; all types if omitted)
+        min_amount, max_amount: inclusive amount range in dollars
+        page, per_page: 1-based page and page size (default 25, at most 100)
+    """
+    try:
+        start_date, end_date = (
+            datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else None
+            for value in (request.args.get('start_date'), request.args.get('end_date'))
+        )
+        expense_type_ids = [int(value) for value in request.args.getlist('expense_type_id') if value != 'all']
+        min_amount, max_amount = (
+            to_cents(value) if value else None
+            for value in (request.args.get('min_amount'), request.args.get('max_amount'))
+        )
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 25))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid date, expense type, amount or page'}), 400
+
+    conn = get_db_connection()
+    try:
+        results = search_expenses(conn, request.args.get('q', ''), start_date, end_date, expense_type_ids,
+                                  min_amount, max_amount, page=page, per_page=per_page)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    type_names = get_expense_type_names(conn)
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    return jsonify({
+        'success': True,
+        'query': request.args.get('q', ''),
+        'page': max(page, 1),
+        'per_page': per_page,
+        'total': results.total,
+        # Only the newest MAX_RANKED_MATCHES matches are ranked; narrow the search for older ones
+        'capped': results.capped,
+        'pages': -(-results.total // per_page),
+        'results': [{
+            'kind': row['kind'],
+            'id': row['id'],
+            'date': row['date'],
+            'amount': from_cents(row['amount']),
+            'description': row['description'],
+            'expense_type_id': row['expense_type_id'],
+            'expense_type_name': type_names.get(row['expense_type_id'], 'Unknown'),
+            'recurring_interval': row['recurring_interval'],
+            'month_id': row['month_id'],
+        } for row in results.rows],
+    })
@@ -1,25 +1,16 @@
 from flask import Blueprint, request, redirect, url_for, render_template, flash
 import sqlite3
-import os
+from db import get_db_connection
+from metadata_cache import get_all_expense_types, get_expense_type_names, invalidate as invalidate_metadata
 
 # Create a Blueprint for expense-type-related routes
 expense_type_routes = Blueprint('expense_type_routes', __name__)
 
-# Database configuration
-DB_NAME = 'spending_tracker.db'
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), DB_NAME)
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 @expense_type_routes.route('/', methods=['GET'])
 def manage_expense_types():
     """Display the expense types management page"""
     conn = get_db_connection()
-    expense_types = conn.execute('SELECT * FROM expense_types ORDER BY name').fetchall()
-    conn.close()
+    expense_types = get_all_expense_types(conn)
     
     return render_template('manage_expense_types.html', expense_types=expense_types, error=None)
 
@@ -44,35 +35,52 @@ def add_expense_type():
         # Add the new expense type
         conn.execute('INSERT INTO expense_types (name) VALUES (?)', (name,))
         conn.commit()
+        invalidate_metadata(conn)
         
         # Success - redirect back to manage page
         return redirect(url_for('expense_type_routes.manage_expense_types'))
         
     except ValueError as e:
         # Handle validation errors
-        expense_types = conn.execute('SELECT * FROM expense_types ORDER BY name').fetchall()
+        expense_types = get_all_expense_types(conn)
         return render_template('manage_expense_types.html', expense_types=expense_types, error=str(e))
     
     except sqlite3.Error as e:
         # Handle database errors
-        expense_types = conn.execute('SELECT * FROM expense_types ORDER BY name').fetchall()
+        expense_types = get_all_expense_types(conn)
         return render_template('manage_expense_types.html', expense_types=expense_types, error=f"Database error: {e}")
-    
-    finally:
-        conn.close()
 
 @expense_type_routes.route('/delete/<int:type_id>', methods=['POST'])
 def delete_expense_type(type_id):
-    """Delete an expense type (always hard delete from DB, regardless of usage)"""
+    """Delete an expense type that no expense uses
+
+    Connections enforce foreign keys, so a type still referenced by an expense
+    (deleted and archived ones included, since they can be restored) or by a
+    recurring instance can't be deleted; the page says how many use it instead.
+    """
     conn = get_db_connection()
     try:
-        # Always perform a hard delete, even if there are expenses referencing this type
+        usage = conn.execute('''
+            SELECT (SELECT COUNT(*) FROM expenses WHERE expense_type_id = :id)
+                 + (SELECT COUNT(*) FROM expenses_archive WHERE expense_type_id = :id),
+                   (SELECT COUNT(*) FROM recurring_expense_instances WHERE expense_type_id = :id)
+        ''', {'id': type_id}).fetchone()
+        expense_count, instance_count = usage
+        if expense_count or instance_count:
+            name = get_expense_type_names(conn).get(type_id, f'#{type_id}')
+            raise ValueError(f"Expense type '{name}' is used by {expense_count} expenses and "
+                             f"{instance_count} recurring instances; change their type before deleting it")
+        
         conn.execute('DELETE FROM expense_types WHERE id = ?', (type_id,))
         conn.commit()
+        invalidate_metadata(conn)
         return redirect(url_for('expense_type_routes.manage_expense_types'))
+    except ValueError as e:
+        # Handle a type that is still in use
+        expense_types = get_all_expense_types(conn)
+        return render_template('manage_expense_types.html', expense_types=expense_types, error=str(e))
     except sqlite3.Error as e:
         # Handle database errors
-        expense_types = conn.execute('SELECT * FROM expense_types ORDER BY name').fetchall()
+        conn.rollback()
+        expense_types = get_all_expense_types(conn)
         return render_template('manage_expense_types.html', expense_types=expense_types, error=f"Database error: {e}")
-    finally:
-        conn.close()
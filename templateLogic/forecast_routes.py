@@ -0,0 +1,101 @@
+from flask import Blueprint, request, jsonify
+import logging
+import sqlite3
+import numpy as np
+from db import get_db_connection
+from metadata_cache import get_expense_type_names
+from money import to_cents
+import forecast
+
+logger = logging.getLogger(__name__)
+
+# Create a Blueprint for the cash-flow forecast API
+forecast_routes = Blueprint('forecast_routes', __name__)
+
+
+def _month_label(year, month):
+    return f'{year:04d}-{month:02d}'
+
+
+def _dollars(cents):
+    """Cents (a number or array) as dollar amounts rounded to the cent, for JSON"""
+    return (np.round(cents) / 100).tolist()
+
+
+@forecast_routes.route('', methods=['GET'])
+def cash_flow_forecast():
+    """Projected spending and balances for the months after the latest month, as JSON
+
+    Query parameters:
+        months: number of months to forecast (default 12, at most 600)
+        history: months of past non-recurring spending to average (default 12)
+        confidence: probability covered by the low/high bands (default 0.8)
+        income: income per month in dollars (default: the latest month's)
+
+    Each month has its income, expected spending (recurring, scheduled and
+    discretionary) and end balance with low/high bands; each expense type has its
+    expected spending per month with its bands.
+    """
+    conn = get_db_connection()
+
+    try:
+        months = int(request.args.get('months', 12))
+        history = int(request.args.get('history', 12))
+        confidence = float(request.args.get('confidence', 0.8))
+        income = to_cents(request.args['income']) if request.args.get('income') else None
+        forecast.check_parameters(months, history, confidence)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # Any other error is a bug, not bad input, and is left to the 500 handler
+    try:
+        result = forecast.forecast(conn, months=months, history=history, confidence=confidence, income=income)
+    except sqlite3.Error as e:
+        logger.exception("Error computing the forecast")
+        return jsonify({'success': False, 'message': f'Database error: {e}'}), 500
+
+    if result is None:
+        return jsonify({'success': False, 'message': 'Create a month before forecasting'}), 404
+
+    type_names = get_expense_type_names(conn)
+    labels = [_month_label(year, month) for year, month in result.months]
+    recurring = _dollars(result.recurring.sum(axis=0))
+    scheduled = _dollars(result.scheduled.sum(axis=0))
+    spending, spending_low, spending_high = (
+        _dollars(values) for values in (result.spending, result.spending_low, result.spending_high)
+    )
+    balance, balance_low, balance_high = (
+        _dollars(values) for values in (result.balance, result.balance_low, result.balance_high)
+    )
+
+    # Amounts leave the app in dollars
+    return jsonify({
+        'success': True,
+        'base': {
+            'month': _month_label(*result.base),
+            'balance': _dollars(result.base_balance),
+        },
+        'income': _dollars(result.income),
+        'history_months': result.history_months,
+        'confidence': confidence,
+        'months': [{
+            'month': labels[i],
+            'recurring': recurring[i],
+            'scheduled': scheduled[i],
+            'spending': spending[i],
+            'spending_low': spending_low[i],
+            'spending_high': spending_high[i],
+            'balance': balance[i],
+            'balance_low': balance_low[i],
+            'balance_high': balance_high[i],
+        } for i in range(len(labels))],
+        'by_type': [{
+            'expense_type_id': expense_type_id,
+            'expense_type_name': type_names.get(expense_type_id, 'Unknown'),
+            'discretionary_average': _dollars(result.discretionary[row]),
+            'total': _dollars(result.expected[row].sum()),
+            'expected': _dollars(result.expected[row]),
+            'expected_low': _dollars(result.expected_low[row]),
+            'expected_high': _dollars(result.expected_high[row]),
+        } for row, expense_type_id in enumerate(result.expense_type_ids.tolist())],
+    })
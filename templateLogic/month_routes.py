@@ -1,22 +1,18 @@
-from flask import Blueprint, request, redirect, url_for, render_template, flash, session
+from flask import Blueprint, request, redirect, url_for, render_template, flash, session, jsonify
+import logging
 import sqlite3
-import os
-from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
+from db import get_db_connection
+from metadata_cache import get_active_expense_types, get_latest_month, get_month, get_months, invalidate as invalidate_metadata
+from money import to_cents
+from months import create_months, generate_recurring_instances, month_range, parse_year_month
+from response_cache import cached_page
 from utils import calculate_total_expenses
 
+logger = logging.getLogger(__name__)
+
 # Create a Blueprint for month-related routes
 month_routes = Blueprint('month_routes', __name__)
 
-# Database configuration
-DB_NAME = 'spending_tracker.db'
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), DB_NAME)
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 @month_routes.route('/update_month', methods=['POST'])
 def update_month():
     """Update month details"""
@@ -32,6 +28,7 @@ def update_month():
         # Basic validation
         if not month or not year or not monthly_income:
             raise ValueError("All fields are required")
+        monthly_income = to_cents(monthly_income)
             
         # Check if month/year combination already exists (for a different month_id)
         existing = conn.execute(
@@ -50,18 +47,19 @@ def update_month():
         ''', (month, year, monthly_income, month_id))
         
         conn.commit()
+        invalidate_metadata(conn)
         
         # Success - redirect to index
         return redirect(url_for('index'))
         
     except ValueError as e:
         # Handle validation errors
-        expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
-        current_month_data = conn.execute('SELECT * FROM months WHERE id = ?', (month_id,)).fetchone()
+        expense_types = get_active_expense_types(conn)
+        current_month_data = get_month(conn, month_id)
         
         # Calculate total expenses for the current month
                 # Calculate total expenses for the current month using the consistent calculation function
-        total_amount = 0.0
+        total_amount = 0
         if current_month_data:
             total_amount = calculate_total_expenses(current_month_data['month'], current_month_data['year'], conn)
         # total_amount = 0.0
@@ -93,12 +91,12 @@ def update_month():
     
     except sqlite3.Error as e:
         # Handle database errors
-        expense_types = conn.execute('SELECT * FROM expense_types WHERE is_active = TRUE ORDER BY name').fetchall()
-        current_month_data = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+        expense_types = get_active_expense_types(conn)
+        current_month_data = get_latest_month(conn)
         
         # Calculate total expenses for the current month
         # Calculate total expenses for the current month using the consistent calculation function
-        total_amount = 0.0
+        total_amount = 0
         if current_month_data:
             total_amount = calculate_total_expenses(current_month_data['month'], current_month_data['year'], conn)
         
@@ -119,22 +117,20 @@ def update_month():
                               show_month_modal=True,
                               total_amount=total_amount,
                               recent_expenses=recent_expenses)
-    
-    finally:
-        conn.close()
 
 @month_routes.route('/months', methods=['GET'])
+@cached_page
 def list_months():
     """List all months"""
     conn = get_db_connection()
-    months = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC').fetchall()
-    # For each month, calculate total expenses using the consistent calculation function
-    months_with_expenses = []
-    for month in months:
-        total_expenses = calculate_total_expenses(month['month'], month['year'], conn)
-        month_dict = dict(month)
-        month_dict['total_expenses'] = total_expenses
-        months_with_expenses.append(month_dict)
+    # Read every month's total from the month_totals rollup in the same query
+    months = conn.execute('''
+        SELECT m.*, COALESCE(mt.total, 0) AS total_expenses
+        FROM months m
+        LEFT JOIN month_totals mt ON mt.year = m.year AND mt.month = m.month
+        ORDER BY m.year DESC, m.month DESC
+    ''').fetchall()
+    months_with_expenses = [dict(month) for month in months]
     
     # Get current month from session or default to most recent
     current_month_id = None
@@ -142,7 +138,7 @@ def list_months():
         current_month_id = session['current_month_id']
     else:
         # Get the most recent month if no session data
-        current_month = conn.execute('SELECT id FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+        current_month = get_latest_month(conn)
         if current_month:
             current_month_id = current_month['id']
             # Store in session
@@ -150,12 +146,10 @@ def list_months():
     
     # Get latest monthly income for pre-filling the form
     latest_monthly_income = None
-    latest_month = conn.execute('SELECT monthly_income FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+    latest_month = get_latest_month(conn)
     if latest_month:
         latest_monthly_income = latest_month['monthly_income']
     
-    conn.close()
-    
     # Return a dedicated months selection page
     return render_template('select_month.html', months=months_with_expenses, current_month_id=current_month_id, latest_monthly_income=latest_monthly_income)
 
@@ -173,6 +167,7 @@ def add_month():
         # Basic validation
         if not month or not year or not monthly_income:
             raise ValueError("All fields are required")
+        monthly_income = to_cents(monthly_income)
             
         # Check if month/year combination already exists
         existing = conn.execute(
@@ -192,22 +187,21 @@ def add_month():
         
         conn.commit()
         new_month_id = cursor.lastrowid
+        invalidate_metadata(conn)
         
         # Process recurring expenses for the new month
         process_recurring_expenses(conn, int(month), int(year), new_month_id)
         
         # Store the new month in session and redirect to index
         session['current_month_id'] = new_month_id
-        conn.close()
         return redirect(url_for('index', current_month_id=new_month_id))
         
     except ValueError as e:
         # Handle validation errors
-        months = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC').fetchall()
-        current_month = conn.execute('SELECT id FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+        months = get_months(conn)
+        current_month = get_latest_month(conn)
         current_month_id = current_month['id'] if current_month else None
         
-        conn.close()
         # Return to select_month with error
         return render_template('select_month.html', 
                               months=months, 
@@ -216,16 +210,58 @@ def add_month():
     
     except sqlite3.Error as e:
         # Handle database errors
-        months = conn.execute('SELECT * FROM months ORDER BY year DESC, month DESC').fetchall()
-        current_month = conn.execute('SELECT id FROM months ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+        months = get_months(conn)
+        current_month = get_latest_month(conn)
         current_month_id = current_month['id'] if current_month else None
         
-        conn.close()
         return render_template('select_month.html', 
                               months=months, 
                               current_month_id=current_month_id,
                               month_error=f"Database error: {e}")
 
+@month_routes.route('/add_month_range', methods=['POST'])
+def add_month_range():
+    """Create every month in a range, with their recurring expenses, in one transaction
+    
+    Accepts form fields or a JSON body with either start/end as 'YYYY-MM' or
+    start_month/start_year/end_month/end_year, plus optional monthly_income and
+    starting_bank_value for the new months. Months that already exist are kept and
+    only get their missing recurring instances, so repeating a request is harmless.
+    """
+    data = request.get_json(silent=True) or request.form
+    conn = get_db_connection()
+    
+    try:
+        if data.get('start') or data.get('end'):
+            start = parse_year_month(data.get('start', ''))
+            end = parse_year_month(data.get('end', ''))
+        else:
+            start = (int(data['start_year']), int(data['start_month']))
+            end = (int(data['end_year']), int(data['end_month']))
+        monthly_income = to_cents(data.get('monthly_income') or 0)
+        starting_bank_value = to_cents(data.get('starting_bank_value') or 0)
+        
+        result = create_months(conn, month_range(*start, *end),
+                               monthly_income=monthly_income, starting_bank_value=starting_bank_value)
+    except KeyError as e:
+        return jsonify({'success': False, 'message': f'Missing field: {e.args[0]}'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except sqlite3.Error as e:
+        logger.exception("Error creating months %s to %s", start, end)
+        return jsonify({'success': False, 'message': f'Database error: {e}'}), 500
+    
+    logger.info("Created %d months and %d recurring instances for %s to %s",
+                result.months_created, result.instances_created, start, end)
+    return jsonify({
+        'success': True,
+        'message': f'Created {result.months_created} of {len(result.months)} months '
+                   f'and {result.instances_created} recurring expenses',
+        'months_created': result.months_created,
+        'instances_created': result.instances_created,
+        'months': [{'id': month_id, 'year': year, 'month': month} for year, month, month_id in result.months],
+    })
+
 def process_recurring_expenses(conn, new_month, new_year, new_month_id):
     """Process recurring expenses for a newly created month
     
@@ -235,108 +271,18 @@ def process_recurring_expenses(conn, new_month, new_year, new_month_id):
     - 'biannual': Creates an instance every 6 months
     - 'yearly': Creates an instance every 12 months
     """
-    print(f"\n\n==== Processing recurring expenses for {new_month}/{new_year} (Month ID: {new_month_id}) ====")
+    logger.info("Processing recurring expenses for %s/%s (month id %s)", new_month, new_year, new_month_id)
     try:
-        # Get all active recurring expenses
-        cursor = conn.cursor()
-        recurring_expenses = cursor.execute("""
-            SELECT id, amount, description, date, expense_type_id, recurring_interval, recurring_day
-            FROM expenses
-            WHERE is_active = 1 AND recurring_interval != 'none'
-        """).fetchall()
-        
-        print(f"Found {len(recurring_expenses)} active recurring expenses")
-        for idx, expense in enumerate(recurring_expenses):
-            print(f"\nExpense #{idx+1}:")
-            print(f"  ID: {expense['id']}")
-            print(f"  Description: {expense['description']}")
-            print(f"  Amount: ${expense['amount']}")
-            print(f"  Date: {expense['date']}")
-            print(f"  Recurring Interval: {expense['recurring_interval']}")
-            print(f"  Recurring Day: {expense['recurring_day']}")
-        
-        # Calculate the target date for the new month
-        target_date = date(new_year, new_month, 1)
-        
-        for expense in recurring_expenses:
-            # Get the original expense date
-            original_date = datetime.strptime(expense['date'], '%Y-%m-%d').date()
-            expense_id = expense['id']
-            recurring_interval = expense['recurring_interval']
-            recurring_day = expense['recurring_day']
-            
-            # Determine if this recurring expense should be included in the new month
-            should_include = False
-            new_expense_date = None
-            
-            if recurring_interval == 'monthly':
-                # Monthly expenses recur every month on the specified day
-                should_include = True
-                
-                # Use the recurring_day if specified, otherwise use the day from the original date
-                day_to_use = int(recurring_day) if recurring_day is not None else original_date.day
-                print(f"  Monthly expense - using day: {day_to_use} (from recurring_day: {recurring_day}, type: {type(recurring_day)})")
-                print(f"  Original date: {original_date}, day: {original_date.day}")
-                
-                # Make sure the day is valid for the month (e.g., no February 30)
-                last_day_of_month = (date(new_year, new_month, 1) + relativedelta(months=1, days=-1)).day
-                day_to_use = min(day_to_use, last_day_of_month)
-                print(f"  Adjusted day for month length: {day_to_use}")
-                
-                new_expense_date = date(new_year, new_month, day_to_use)
-                print(f"  New expense date: {new_expense_date}")
-                
-            elif recurring_interval == 'biannual':
-                # Biannual expenses recur every 6 months
-                # Calculate months difference between original date and target date
-                months_diff = (new_year - original_date.year) * 12 + (new_month - original_date.month)
-                should_include = months_diff % 6 == 0
-                
-                if should_include:
-                    # Use the same day of the month if possible
-                    day_to_use = min(original_date.day, (date(new_year, new_month, 1) + relativedelta(months=1, days=-1)).day)
-                    new_expense_date = date(new_year, new_month, day_to_use)
-                
-            elif recurring_interval == 'yearly':
-                # Yearly expenses recur every 12 months
-                # Check if month and day match (same month every year)
-                should_include = new_month == original_date.month
-                
-                if should_include:
-                    # Use the same day of the month if possible
-                    day_to_use = min(original_date.day, (date(new_year, new_month, 1) + relativedelta(months=1, days=-1)).day)
-                    new_expense_date = date(new_year, new_month, day_to_use)
-            
-            # If this expense should be included in the new month, create a recurring instance
-            if should_include and new_expense_date:
-                # Format the date as string for database
-                new_date_str = new_expense_date.strftime('%Y-%m-%d')
-                
-                print(f"  Creating recurring instance for {new_date_str}")
-                
-                # Create a new recurring expense instance
-                cursor.execute("""
-                    INSERT INTO recurring_expense_instances 
-                    (expense_id, month_id, instance_date, amount, description, expense_type_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    expense_id, 
-                    new_month_id, 
-                    new_date_str,
-                    expense['amount'],
-                    expense['description'],
-                    expense['expense_type_id']
-                ))
+        # Same batched, duplicate-safe insert the bulk month-range creation uses
+        created = generate_recurring_instances(conn, {(new_year, new_month): new_month_id})
         
         # Commit all changes
         conn.commit()
-        print("\n==== Successfully processed recurring expenses ====\n")
+        logger.info("Created %d recurring instances for %s/%s", created, new_month, new_year)
         
     except Exception as e:
         # Log the error but don't fail the month creation
-        print(f"\n==== ERROR processing recurring expenses: {e} ====\n")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing recurring expenses for %s/%s: %s", new_month, new_year, e)
         # Roll back any changes made
         conn.rollback()
 
@@ -346,17 +292,14 @@ def set_current_month(month_id):
     conn = get_db_connection()
     
     # Verify the month exists
-    month = conn.execute('SELECT * FROM months WHERE id = ?', (month_id,)).fetchone()
+    month = get_month(conn, month_id)
     
     if not month:
         # Month not found, redirect to index
-        conn.close()
         return redirect(url_for('index'))
     
     # Store the selected month in the session
     session['current_month_id'] = month_id
     
-    conn.close()
-    
     # Redirect back to the index page, which will now show the selected month as current
     return redirect(url_for('index', current_month_id=month_id))
@@ -0,0 +1,64 @@
+from flask import Blueprint, request, jsonify, session
+import logging
+import sqlite3
+import db
+from shards import DEFAULT_TENANT, UnknownTenant, check_access_key, check_tenant_id
+
+logger = logging.getLogger(__name__)
+
+# Create a Blueprint for choosing the tenant (and so the database) of a session
+tenant_routes = Blueprint('tenant_routes', __name__)
+
+
+@tenant_routes.app_errorhandler(UnknownTenant)
+def unknown_tenant(e):
+    """The session's tenant was removed; go back to the default one"""
+    session.pop('tenant_id', None)
+    session.pop('current_month_id', None)
+    return jsonify({'success': False, 'message': 'Your tenant no longer exists; switched back to the default'}), 404
+
+
+@tenant_routes.route('', methods=['GET'])
+def current_tenant():
+    """The session's tenant, and whether tenants have separate databases"""
+    router = db.get_router()
+    return jsonify({'success': True,
+                    'tenant_id': session.get('tenant_id') or DEFAULT_TENANT,
+                    'sharded': router is not None})
+
+
+@tenant_routes.route('', methods=['POST'])
+def switch_tenant():
+    """Use another tenant's database for the rest of the session
+
+    The tenant id and its access key come from the form fields or JSON keys
+    ``tenant_id`` and ``access_key``. Tenants and their keys are created with
+    ``python manage.py add-tenant``; the default tenant needs no key.
+    """
+    router = db.get_router()
+    if router is None:
+        return jsonify({'success': False,
+                        'message': 'Tenants are not enabled; set SPENDING_TRACKER_SHARD_DIR'}), 400
+
+    data = request.get_json(silent=True) or request.form
+    try:
+        tenant_id = check_tenant_id(data.get('tenant_id'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # Unknown tenants and wrong keys get the same answer, so ids can't be probed
+    if tenant_id != DEFAULT_TENANT and not check_access_key(router.shard_dir, tenant_id, data.get('access_key')):
+        logger.warning("Refused to switch a session to tenant %s", tenant_id)
+        return jsonify({'success': False, 'message': 'Unknown tenant or wrong access key'}), 403
+
+    try:
+        # Migrates the tenant's database now rather than on its first page
+        router.pool(tenant_id)
+    except (sqlite3.Error, UnknownTenant) as e:
+        logger.exception("Error opening the database of tenant %s", tenant_id)
+        return jsonify({'success': False, 'message': f'Error opening tenant database: {str(e)}'}), 500
+
+    session['tenant_id'] = tenant_id
+    # The selected month belongs to the previous tenant's database
+    session.pop('current_month_id', None)
+    return jsonify({'success': True, 'message': f'Switched to tenant {tenant_id}', 'tenant_id': tenant_id})
@@ -0,0 +1,125 @@
+"""
+Template compilation and fragment caching.
+
+Bytecode cache: Jinja compiles every template to Python source and then to
+bytecode, which is most of a worker's start-up time (``view_expenses.html`` alone is
+44 KB). The compiled code is kept in a ``FileSystemBytecodeCache`` shared by all
+workers and restarts; Jinja checks each entry against the template source, so an
+edited template is simply compiled again.
+
+Fragment cache: a ``{% cache %}`` block in a template stores its rendered output
+and reuses it on later requests until the database changes:
+
+    {% cache 'month_selector', month_data.id %} ... {% endcache %}
+
+Fragments are keyed on the database revision (see revision.py), the block's
+position in its template and the values after its name, which must include
+everything the block reads that is not stored in the database (request
+parameters, the selected month, ...). Entries for older revisions are never read
+again and age out of the bounded LRU. Blocks render normally outside a request and
+while templates are auto-reloaded (debug mode), when a template may change under a
+cached fragment.
+
+Environment variables:
+    SPENDING_TRACKER_BYTECODE_CACHE          set to 0 to compile templates in memory only
+    SPENDING_TRACKER_BYTECODE_CACHE_DIR      where compiled templates are kept (default:
+                                             a per-user directory under the temp dir)
+    SPENDING_TRACKER_FRAGMENT_CACHE          set to 0 to turn fragment caching off
+    SPENDING_TRACKER_FRAGMENT_CACHE_ENTRIES  most fragments kept (default 512)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from flask import g, has_request_context
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from db import get_db_connection
+from revision import get_revision
+
+BYTECODE_CACHE_ENABLED = os.environ.get('SPENDING_TRACKER_BYTECODE_CACHE', '1') != '0'
+BYTECODE_CACHE_DIR = os.environ.get('SPENDING_TRACKER_BYTECODE_CACHE_DIR') or None
+FRAGMENT_CACHE_ENABLED = os.environ.get('SPENDING_TRACKER_FRAGMENT_CACHE', '1') != '0'
+MAX_FRAGMENTS = int(os.environ.get('SPENDING_TRACKER_FRAGMENT_CACHE_ENTRIES', '512'))
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered template fragments"""
+
+    def __init__(self, max_entries=MAX_FRAGMENTS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragments = FragmentCache()
+
+
+def _request_revision():
+    """The database revision, read once per request; None outside a request"""
+    if not has_request_context():
+        return None
+    if 'fragment_revision' not in g:
+        g.fragment_revision = get_revision(get_db_connection())
+    return g.fragment_revision
+
+
+class FragmentCacheExtension(Extension):
+    """The ``{% cache name, value, ... %}`` ... ``{% endcache %}`` template tag"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        # Where the block is, so blocks with the same name never share entries
+        location = nodes.Const(f'{parser.name}:{lineno}')
+        return nodes.CallBlock(
+            self.call_method('_render', [location, nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, location, key_values, caller):
+        revision = _request_revision() if FRAGMENT_CACHE_ENABLED else None
+        if revision is None or self.environment.auto_reload:
+            return caller()
+
+        key = (location, revision, repr(key_values))
+        value = fragments.get(key)
+        if value is None:
+            value = caller()
+            fragments.put(key, value)
+        return value
+
+
+def init_app(app):
+    """Set up the bytecode cache and the ``{% cache %}`` tag on the app's templates"""
+    if BYTECODE_CACHE_ENABLED:
+        if BYTECODE_CACHE_DIR:
+            os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            BYTECODE_CACHE_DIR, pattern='spending-tracker-%s.cache'
+        )
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,50 @@
+"""
+Shared fixtures: every test gets its own database file and app.
+
+Run with ``python -m pytest`` from the repository root.
+"""
+
+import os
+import sys
+from contextlib import closing
+
+import pytest
+
+# The app is a set of top-level modules; make them importable from here
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A new database as setup_db.py creates it: the schema, the default expense
+    types and the current month"""
+    import setup_db
+
+    path = str(tmp_path / 'spending_tracker.db')
+    setup_db.create_database(path, verbose=False)
+    return path
+
+
+@pytest.fixture
+def app(db_path):
+    """The app on ``db_path``. The instance scheduler is not started, so template
+    changes are synced inside the request that makes them"""
+    from app import create_app
+
+    return create_app({'DATABASE': db_path, 'SECRET_KEY': 'test', 'TESTING': True, 'SHARD_DIR': None})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def conn(db_path):
+    """A connection of the test's own, outside the app's pools"""
+    from db import connect
+
+    with closing(connect(db_path)) as connection:
+        yield connection
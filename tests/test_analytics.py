@@ -0,0 +1,84 @@
+import pytest
+
+import analytics
+
+
+@pytest.fixture
+def spending(conn):
+    """Type 1 in January 2023, January and March 2024; type 2 in February 2024"""
+    conn.executemany('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, is_active)
+        VALUES (?, 'Test', ?, ?, ?)
+    ''', [
+        (10000, 1, '2023-01-15', True),
+        (15000, 1, '2024-01-15', True),
+        (5000, 2, '2024-02-15', True),
+        (3000, 1, '2024-03-15', True),
+        (99999, 1, '2024-02-20', False),
+    ])
+    conn.commit()
+
+
+def _column(rows, key):
+    return [row[key] for row in rows]
+
+
+def test_monthly_trends(conn, spending):
+    rows = analytics.monthly_trends(conn, (2024, 1), (2024, 3), window=3)
+    assert [(row['year'], row['month']) for row in rows] == [(2024, 1), (2024, 2), (2024, 3)]
+    assert _column(rows, 'total') == [15000, 5000, 3000]
+    # Months without spending count as 0 in the rolling sums
+    assert _column(rows, 'rolling_total') == [15000, 20000, 23000]
+    assert _column(rows, 'previous_year_total') == [10000, 0, 0]
+    assert _column(rows, 'previous_year_rolling_total') == [10000, 10000, 10000]
+    assert rows[1]['rolling_average'] == 20000 / 3
+
+
+def test_monthly_trends_by_type_and_filtered(conn, spending):
+    rows = analytics.monthly_trends(conn, (2024, 1), (2024, 3), window=1, by_type=True)
+    series = {}
+    for row in rows:
+        series.setdefault(row['expense_type_id'], []).append(row['total'])
+    assert series == {1: [15000, 0, 3000], 2: [0, 5000, 0]}
+
+    rows = analytics.monthly_trends(conn, (2024, 1), (2024, 3), window=1, expense_type_ids=[2])
+    assert _column(rows, 'total') == [0, 5000, 0]
+
+
+def test_top_categories(conn, spending):
+    rows = analytics.top_categories(conn, (2024, 1), (2024, 12))
+    assert [(row['rank'], row['expense_type_id'], row['total']) for row in rows] == [(1, 1, 18000), (2, 2, 5000)]
+    assert rows[0]['share'] == 18000 / 23000
+    assert rows[0]['previous_year_total'] == 10000
+    assert rows[0]['monthly_average'] == 1500
+    assert len(analytics.top_categories(conn, (2024, 1), (2024, 12), limit=1)) == 1
+
+
+def test_yearly_totals(conn, spending):
+    rows = analytics.yearly_totals(conn, 2023, 2024)
+    assert [(row['year'], row['total'], row['previous_year_total']) for row in rows] == [
+        (2023, 10000, 0), (2024, 23000, 10000),
+    ]
+
+
+@pytest.mark.parametrize('current, previous, expected', [(150, 100, 0.5), (50, 100, -0.5), (10, 0, None)])
+def test_change(current, previous, expected):
+    assert analytics.change(current, previous) == expected
+
+
+def test_analytics_route(client, spending):
+    result = client.get('/analytics?start=2024-01&end=2024-03&window=3&top=1').get_json()
+    assert result['success'], result
+    assert result['range'] == {'start': '2024-01', 'end': '2024-03', 'months': 3}
+    assert _column(result['monthly'], 'total') == [150.0, 50.0, 30.0]
+    assert result['monthly'][0]['yoy_change'] == 0.5
+    assert [row['expense_type_id'] for row in result['top_categories']] == [1]
+    assert _column(result['years'], 'year') == [2024]
+
+
+@pytest.mark.parametrize('query', ['start=2024-03&end=2024-01', 'window=0', 'start=2024-13', 'expense_type_id=x',
+                                   'start=1900-01&end=2024-01'])
+def test_analytics_route_rejects_bad_parameters(client, query):
+    response = client.get(f'/analytics?{query}')
+    assert response.status_code == 400
+    assert not response.get_json()['success']
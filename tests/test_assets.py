@@ -0,0 +1,50 @@
+import logging
+import os
+
+import pytest
+from flask import Flask
+
+import assets
+import manage
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    """A static folder with only the first vendored library downloaded"""
+    present = next(iter(assets.VENDOR_ASSETS))
+    path = tmp_path / present
+    path.parent.mkdir(parents=True)
+    path.write_text('/* vendored */')
+    return str(tmp_path)
+
+
+def test_missing_vendor_assets(static_dir):
+    assert assets.missing_vendor_assets(static_dir) == list(assets.VENDOR_ASSETS)[1:]
+
+
+def test_startup_warns_about_missing_vendor_assets(static_dir, caplog):
+    with caplog.at_level(logging.WARNING, logger='assets'):
+        assets.init_app(Flask(__name__, static_folder=static_dir))
+    warnings = [record for record in caplog.records if record.name == 'assets']
+    assert len(warnings) == 1
+    assert all(path in warnings[0].getMessage() for path in list(assets.VENDOR_ASSETS)[1:])
+
+
+def test_asset_url_falls_back_to_the_cdn(app, static_dir):
+    app.static_folder = static_dir
+    present, missing = list(assets.VENDOR_ASSETS)[:2]
+    with app.test_request_context():
+        assert assets.asset_url(present) == f'/static/{present}'
+        assert assets.asset_url(missing) == assets.VENDOR_ASSETS[missing]
+
+
+def test_vendor_assets_check(static_dir, monkeypatch, capsys):
+    find_missing = assets.missing_vendor_assets
+    monkeypatch.setattr(assets, 'missing_vendor_assets', lambda: find_missing(static_dir))
+    assert manage.main(['vendor-assets', '--check']) == 1
+    assert 'missing: static/' + list(assets.VENDOR_ASSETS)[1] in capsys.readouterr().out
+
+    for path in list(assets.VENDOR_ASSETS)[1:]:
+        os.makedirs(os.path.dirname(os.path.join(static_dir, path)), exist_ok=True)
+        open(os.path.join(static_dir, path), 'w').close()
+    assert manage.main(['vendor-assets', '--check']) == 0
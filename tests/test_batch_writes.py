@@ -0,0 +1,93 @@
+import pytest
+
+from batch_writes import MAX_BATCH_OPERATIONS, NOT_APPLIED, apply_batch
+
+
+def _add(conn, description='Existing', amount=1000):
+    cursor = conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date)
+        VALUES (?, ?, 1, '2024-03-10')
+    ''', (amount, description))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _expense(conn, expense_id):
+    return conn.execute('SELECT * FROM expenses WHERE id = ?', (expense_id,)).fetchone()
+
+
+def test_create_update_delete(conn):
+    kept, deleted = _add(conn), _add(conn)
+    batch = apply_batch(conn, [
+        {'op': 'create', 'amount': '12.50', 'expense_type_id': 2, 'date': '2024-03-01', 'description': 'Lunch'},
+        {'op': 'update', 'id': kept, 'amount': 7},
+        {'op': 'delete', 'id': str(deleted)},
+        {'op': 'create', 'amount': 3, 'expense_type_id': 1, 'date': '2024-03-31', 'recurring_interval': 'monthly'},
+    ])
+    assert batch.applied
+    first, _, _, second = batch.results
+    assert second['id'] == first['id'] + 1
+
+    created = _expense(conn, first['id'])
+    assert (created['amount'], created['description'], created['recurring_interval']) == (1250, 'Lunch', 'none')
+    template = _expense(conn, second['id'])
+    assert (template['is_recurring_template'], template['recurring_day']) == (1, 31)
+    # Fields an update doesn't name keep their values
+    assert (_expense(conn, kept)['amount'], _expense(conn, kept)['description']) == (700, 'Existing')
+    assert _expense(conn, deleted)['is_active'] == 0
+
+
+@pytest.mark.parametrize('operation, error', [
+    ({'op': 'upsert'}, "Unknown operation 'upsert'"),
+    ('create', 'Each operation must be an object'),
+    ({'op': 'create', 'amount': 1, 'date': '2024-03-01'}, 'Missing required fields: expense_type_id'),
+    ({'op': 'create', 'amount': 'abc', 'expense_type_id': 1, 'date': '2024-03-01'}, None),
+    ({'op': 'create', 'amount': 1, 'expense_type_id': 999, 'date': '2024-03-01'}, "Unknown expense type '999'"),
+    ({'op': 'create', 'amount': 1, 'expense_type_id': 1, 'date': '2024-02-30'}, "Invalid date '2024-02-30'"),
+    ({'op': 'update', 'id': 1, 'recurring_interval': 'weekly'}, "Invalid recurring interval 'weekly'"),
+    ({'op': 'update', 'id': 1, 'recurring_interval': 'monthly', 'recurring_day': 32}, 'Recurring day must be'),
+    ({'op': 'update', 'id': 1}, 'Nothing to update'),
+    ({'op': 'delete', 'id': True}, "Invalid expense ID 'True'"),
+    ({'op': 'delete', 'id': 12345}, 'No active expense with ID 12345'),
+])
+def test_one_invalid_operation_rejects_the_batch(conn, operation, error):
+    _add(conn)
+    before = conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+    batch = apply_batch(conn, [
+        {'op': 'create', 'amount': 1, 'expense_type_id': 1, 'date': '2024-03-01'},
+        operation,
+    ])
+    assert not batch.applied
+    valid, invalid = batch.results
+    assert (valid['success'], valid['error']) == (False, NOT_APPLIED)
+    assert not invalid['success'] and invalid['error'] != NOT_APPLIED
+    if error:
+        assert invalid['error'].startswith(error), invalid['error']
+    assert conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0] == before
+    assert not conn.in_transaction
+
+
+def test_an_expense_may_appear_once(conn):
+    expense = _add(conn)
+    batch = apply_batch(conn, [{'op': 'update', 'id': expense, 'amount': 2}, {'op': 'delete', 'id': expense}])
+    assert not batch.applied
+    assert batch.results[1]['error'] == f'Expense {expense} appears more than once in the batch'
+    assert _expense(conn, expense)['amount'] == 1000
+
+
+def test_batch_route(client, conn):
+    expense = _add(conn)
+    response = client.post('/expenses/api/batch', json={'operations': [
+        {'op': 'update', 'id': expense, 'description': 'Renamed'},
+        {'op': 'create', 'amount': 5, 'expense_type_id': 1, 'date': '2024-03-02'},
+    ]})
+    result = response.get_json()
+    assert result['success'] and (result['created'], result['updated'], result['deleted']) == (1, 1, 0)
+
+    response = client.post('/expenses/api/batch', json=[{'op': 'delete', 'id': 'x'}])
+    assert response.status_code == 400
+    assert response.get_json()['results'][0]['error'] == "Invalid expense ID 'x'"
+
+    assert client.post('/expenses/api/batch', json=[]).status_code == 400
+    too_many = [{'op': 'delete', 'id': expense}] * (MAX_BATCH_OPERATIONS + 1)
+    assert client.post('/expenses/api/batch', json=too_many).status_code == 413
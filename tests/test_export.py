@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+
+import pytest
+
+import migrations
+from exporter import _EXPENSES_QUERY, iter_export_rows, stream_csv
+
+
+@pytest.fixture
+def expenses(conn):
+    """Expenses over two months, entered out of date order, and one recurring instance"""
+    conn.executemany('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                              is_recurring_template, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (2500, 'Second', 2, '2024-02-10', 'none', False, True),
+        (1000, 'First', 1, '2024-01-05', 'none', False, True),
+        (999, 'Same day, cheaper', 2, '2024-02-10', 'none', False, True),
+        (5000, 'Deleted', 1, '2024-01-06', 'none', False, False),
+        (120000, 'Rent', 3, '2024-01-01', 'monthly', True, True),
+    ])
+    conn.execute('INSERT INTO months (month, year) VALUES (2, 2024)')
+    conn.execute('''
+        INSERT INTO recurring_expense_instances
+        (expense_id, month_id, instance_date, amount, description, expense_type_id)
+        VALUES (5, (SELECT id FROM months WHERE year = 2024 AND month = 2), '2024-02-01', 120000, 'Rent', 3)
+    ''')
+    conn.commit()
+
+
+def _csv(response):
+    assert response.status_code == 200
+    return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_csv_export_in_date_order(client, expenses):
+    response = client.get('/expenses/export')
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    rows = _csv(response)
+    assert [(row['kind'], row['date'], row['description']) for row in rows] == [
+        ('expense', '2024-01-01', 'Rent'),
+        ('expense', '2024-01-05', 'First'),
+        ('recurring_instance', '2024-02-01', 'Rent'),
+        ('expense', '2024-02-10', 'Same day, cheaper'),
+        ('expense', '2024-02-10', 'Second'),
+    ]
+    assert rows[1]['amount'] == '10.00' and rows[0]['amount'] == '1200.00'
+
+
+def test_filters(client, expenses):
+    rows = _csv(client.get('/expenses/export?start_date=2024-01-02&end_date=2024-02-01'))
+    assert [row['description'] for row in rows] == ['First', 'Rent']
+
+    rows = _csv(client.get('/expenses/export?expense_type_id=2&expense_type_id=3&include_recurring=0'))
+    assert [row['description'] for row in rows] == ['Rent', 'Same day, cheaper', 'Second']
+
+
+def test_ndjson_export(client, expenses):
+    response = client.get('/expenses/export?format=ndjson&start_date=2024-02-01')
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(record['kind'], record['amount']) for record in records] == [
+        ('recurring_instance', 1200.0), ('expense', 9.99), ('expense', 25.0),
+    ]
+
+
+@pytest.mark.parametrize('query', ['format=xml', 'start_date=2024-13-01', 'expense_type_id=abc'])
+def test_bad_parameters(client, query):
+    response = client.get(f'/expenses/export?{query}')
+    assert response.status_code == 400
+    assert not response.get_json()['success']
+
+
+def test_csv_chunks_per_batch(conn, expenses):
+    chunks = list(stream_csv(iter_export_rows(conn, batch_size=2), batch_size=2))
+    # The header, then batches of two rows
+    assert len(chunks) == 1 + 3
+    assert chunks[0].startswith('kind,id,date,amount')
+
+
+@pytest.mark.parametrize('filters', ['', " AND e.date >= '2024-01-01'", ' AND +e.expense_type_id IN (1, 2)'])
+def test_expenses_are_read_without_a_sort(conn, filters):
+    plan = migrations.explain(conn, _EXPENSES_QUERY.format(filters=filters))
+    assert not any('TEMP B-TREE' in step for step in plan), plan
@@ -0,0 +1,80 @@
+from datetime import date
+
+import pytest
+
+from recurrence import index_to_month, month_index
+
+TODAY = date.today()
+CURRENT = month_index(TODAY.year, TODAY.month)
+
+
+def _day(offset, day=1):
+    year, month = index_to_month(CURRENT + offset)
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+
+@pytest.fixture
+def income(conn):
+    """The current month (the one setup_db creates) with $1,000 income"""
+    conn.execute('UPDATE months SET monthly_income = 100000')
+    conn.commit()
+
+
+def _add(conn, amount, expense_date, expense_type_id=1, interval='none'):
+    conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                              is_recurring_template)
+        VALUES (?, 'Test', ?, ?, ?, ?)
+    ''', (amount, expense_type_id, expense_date, interval, interval != 'none'))
+    conn.commit()
+
+
+def test_forecast_empty_database(client):
+    response = client.get('/forecast?months=3')
+    assert response.status_code == 200, response.get_json()
+    result = response.get_json()
+    assert result['success']
+    assert [month['month'] for month in result['months']] == [_day(offset)[:7] for offset in (1, 2, 3)]
+    assert all(month['spending'] == 0 and month['balance'] == 0 for month in result['months'])
+    assert result['by_type'] == []
+
+
+def test_forecast_one_off_expenses_only(client, conn, income):
+    _add(conn, 10000, _day(0, 5))
+    # Already entered for next month
+    _add(conn, 5000, _day(1, 10), expense_type_id=2)
+
+    result = client.get('/forecast?months=2').get_json()
+    assert result['success'], result
+    assert result['base']['balance'] == 900.0
+    first, second = result['months']
+    assert (first['recurring'], first['scheduled'], first['spending']) == (0, 50.0, 150.0)
+    assert (second['scheduled'], second['spending']) == (0, 100.0)
+    assert (first['balance'], second['balance']) == (1750.0, 2650.0)
+    assert {row['expense_type_id']: row['discretionary_average'] for row in result['by_type']} == {1: 100.0, 2: 0}
+
+
+def test_forecast_recurring_template(client, conn, income):
+    # The template's own row counts in its month, but is not discretionary spending
+    _add(conn, 2000, _day(0, 3), interval='monthly')
+    _add(conn, 3000, _day(0, 4))
+
+    result = client.get('/forecast?months=3').get_json()
+    assert result['success'], result
+    assert [month['recurring'] for month in result['months']] == [20.0, 20.0, 20.0]
+    assert [month['spending'] for month in result['months']] == [50.0, 50.0, 50.0]
+
+
+@pytest.mark.parametrize('query', ['months=0', 'months=abc', 'history=121', 'confidence=1'])
+def test_forecast_rejects_bad_parameters(client, query):
+    response = client.get(f'/forecast?{query}')
+    assert response.status_code == 400
+    assert not response.get_json()['success']
+
+
+def test_forecast_is_computed_per_request(client, conn, income):
+    before = client.get('/forecast?months=1')
+    assert 'ETag' not in before.headers
+    _add(conn, 4000, _day(1, 1))
+    after = client.get('/forecast?months=1').get_json()
+    assert after['months'][0]['scheduled'] == before.get_json()['months'][0]['scheduled'] + 40.0
@@ -0,0 +1,79 @@
+import io
+
+import pytest
+
+from importer import ImportRowError, import_stream, is_credit, parse_amount
+
+CSV = '''date,amount,description,expense_type
+2024-03-01,"1,234.56",Rent,Rent/Mortgage
+2024-03-02,-20.00,Refund,Groceries
+2024-03-03,(15.00),Deposit,
+2024-03-04,$45.10,Groceries,Groceries
+2024-03-05,abc,Broken,Groceries
+'''
+
+OFX = '''OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240301<TRNAMT>-1234.56<NAME>Rent<CATEGORY>Rent/Mortgage</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240302<TRNAMT>20.00<NAME>Refund<CATEGORY>Groceries</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240303<TRNAMT>15.00<NAME>Deposit</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240304<TRNAMT>-45.10<NAME>Groceries<CATEGORY>Groceries</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+'''
+
+
+@pytest.mark.parametrize('value, cents', [('12', 1200), ('1,234.56', 123456), ('$0.125', 13)])
+def test_parse_amount(value, cents):
+    assert parse_amount(value) == cents
+
+
+@pytest.mark.parametrize('value', ['', 'abc', '0', '0.00', '-5'])
+def test_parse_amount_rejects(value):
+    with pytest.raises(ImportRowError):
+        parse_amount(value)
+
+
+@pytest.mark.parametrize('value, credit', [
+    ('-20.00', True), ('(15.00)', True), ('-$1,000', True),
+    ('20.00', False), ('$1,000', False), ('abc', False), ('', False),
+])
+def test_is_credit(value, credit):
+    assert is_credit(value) is credit
+
+
+def _imported(conn):
+    return [tuple(row) for row in conn.execute(
+        'SELECT date, amount, description FROM expenses ORDER BY date')]
+
+
+def test_csv_skips_credits(conn):
+    result = import_stream(conn, io.StringIO(CSV), 'csv')
+    assert (result.rows_read, result.rows_imported, result.rows_skipped, result.error_count) == (5, 2, 2, 1)
+    assert result.errors == [{'line': 6, 'error': "Invalid amount 'abc'"}]
+    assert _imported(conn) == [('2024-03-01', 123456, 'Rent'), ('2024-03-04', 4510, 'Groceries')]
+
+
+def test_csv_and_ofx_import_the_same_statement_alike(db_path, tmp_path):
+    import setup_db
+    from contextlib import closing
+    from db import connect
+
+    imported = []
+    for file_format, text in (('csv', CSV), ('ofx', OFX)):
+        path = str(tmp_path / f'{file_format}.db')
+        setup_db.create_database(path, verbose=False)
+        with closing(connect(path)) as conn:
+            result = import_stream(conn, io.StringIO(text), file_format)
+            assert (result.rows_imported, result.rows_skipped) == (2, 2)
+            imported.append(_imported(conn))
+    assert imported[0] == imported[1]
+
+
+def test_import_creates_months_and_keeps_totals(conn):
+    from rollups import check_month_totals
+
+    months_before = conn.execute('SELECT COUNT(*) FROM months').fetchone()[0]
+    result = import_stream(conn, io.StringIO(CSV), 'csv')
+    assert result.months_created == 1
+    assert conn.execute('SELECT COUNT(*) FROM months').fetchone()[0] == months_before + 1
+    assert check_month_totals(conn) == []
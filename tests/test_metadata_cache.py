@@ -0,0 +1,56 @@
+from contextlib import closing
+
+import pytest
+
+import metadata_cache
+import setup_db
+from db import connect
+
+
+@pytest.fixture
+def other_conn(tmp_path):
+    """A connection to a second database, as another shard would have"""
+    path = str(tmp_path / 'other.db')
+    setup_db.create_database(path, verbose=False)
+    with closing(connect(path)) as connection:
+        yield connection
+
+
+def _cached(conn):
+    return metadata_cache.cache._entries.get(conn.db_path, {})
+
+
+def test_results_are_cached_per_database(conn, other_conn):
+    conn.execute("UPDATE expense_types SET name = 'Food' WHERE name = 'Groceries'")
+    conn.commit()
+    names = metadata_cache.get_expense_type_names(conn)
+    assert 'Food' in names.values()
+    assert 'Food' not in metadata_cache.get_expense_type_names(other_conn).values()
+    assert metadata_cache.get_expense_type_names(conn) is names
+
+
+def test_invalidate_drops_only_that_database(conn, other_conn):
+    metadata_cache.get_months(conn)
+    metadata_cache.get_months(other_conn)
+    metadata_cache.invalidate(conn)
+    assert 'months' not in _cached(conn)
+    assert 'months' in _cached(other_conn)
+
+    metadata_cache.invalidate()
+    assert 'months' not in _cached(other_conn)
+
+
+def test_commit_on_another_connection_invalidates(conn, db_path):
+    months = metadata_cache.get_months(conn)
+    with closing(connect(db_path)) as writer:
+        writer.execute('INSERT INTO months (month, year) VALUES (1, 2020)')
+        writer.commit()
+    assert len(metadata_cache.get_months(conn)) == len(months) + 1
+
+
+def test_route_invalidates_its_own_database(client, conn, other_conn):
+    metadata_cache.get_all_expense_types(other_conn)
+    response = client.post('/expense-types/add', data={'name': 'Pets'})
+    assert response.status_code == 302
+    assert 'Pets' in [row['name'] for row in metadata_cache.get_all_expense_types(conn)]
+    assert 'all_expense_types' in _cached(other_conn)
@@ -0,0 +1,120 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import migrations
+from rollups import check_month_totals
+
+
+def _schema(conn):
+    """sqlite_master without the planner statistics, whitespace normalized"""
+    return sorted(
+        (row[0], row[1], ' '.join((row[2] or '').split()))
+        for row in conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_stat%'")
+    )
+
+
+@pytest.fixture
+def baseline_conn(tmp_path):
+    """A database in the shape the app had before migrations existed: the original
+    tables with REAL dollar amounts and no schema_version table"""
+    with closing(sqlite3.connect(str(tmp_path / 'baseline.db'), isolation_level=None)) as conn:
+        for statement in migrations.BASELINE_SCHEMA:
+            conn.execute(statement)
+        conn.execute("INSERT INTO expense_types (name) VALUES ('Rent'), ('Groceries')")
+        conn.execute('''
+            INSERT INTO months (month, year, monthly_income, starting_bank_value)
+            VALUES (1, 2024, 4000.50, 1234.56), (2, 2024, 3999.99, 0)
+        ''')
+        conn.executemany('''
+            INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                                  is_recurring_template, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (4000.50, 'Big one', 2, '2024-01-05', 'none', False, True),
+            (0.1, 'Small one', 2, '2024-01-06', 'none', False, True),
+            (19.99, 'Deleted one', 2, '2024-02-07', 'none', False, False),
+            (1500.25, 'Rent', 1, '2024-01-01', 'monthly', True, True),
+        ])
+        # The instance month creation used to add in February
+        conn.execute('''
+            INSERT INTO recurring_expense_instances
+            (expense_id, month_id, instance_date, amount, description, expense_type_id)
+            VALUES (4, 2, '2024-02-01', 1500.25, 'Rent', 1)
+        ''')
+        assert conn.execute('SELECT typeof(amount) FROM expenses WHERE id = 1').fetchone()[0] == 'real'
+        yield conn
+
+
+def test_integer_cents_on_baseline_database(baseline_conn):
+    conn = baseline_conn
+    applied = migrations.migrate(conn)
+
+    assert [migration.version for migration in applied] == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.current_version(conn) == migrations.LATEST_VERSION
+
+    expenses = conn.execute('SELECT id, amount, typeof(amount) FROM expenses ORDER BY id').fetchall()
+    assert expenses == [(1, 400050, 'integer'), (2, 10, 'integer'), (3, 1999, 'integer'),
+                        (4, 150025, 'integer')]
+    months = conn.execute('SELECT monthly_income, starting_bank_value FROM months ORDER BY id').fetchall()
+    assert months == [(400050, 123456), (399999, 0)]
+    instances = conn.execute('SELECT month_id, amount FROM recurring_expense_instances').fetchall()
+    assert instances == [(2, 150025)]
+
+    assert check_month_totals(conn) == []
+    totals = conn.execute('SELECT year, month, total FROM month_totals ORDER BY year, month').fetchall()
+    assert totals == [(2024, 1, 400050 + 10 + 150025), (2024, 2, 150025)]
+
+
+def test_migrations_are_not_applied_twice(baseline_conn):
+    migrations.migrate(baseline_conn)
+    assert migrations.migrate(baseline_conn) == []
+    assert baseline_conn.execute('SELECT amount FROM expenses WHERE id = 1').fetchone()[0] == 400050
+
+
+def test_upgraded_baseline_matches_new_database(baseline_conn, conn):
+    migrations.migrate(baseline_conn)
+    assert _schema(baseline_conn) == _schema(conn)
+
+
+def test_materialized_instances_fill_months_created_before_the_template(baseline_conn):
+    conn = baseline_conn
+    # A template added after its months existed, which had no instances yet
+    conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                              recurring_day, is_recurring_template)
+        VALUES (9.99, 'Streaming', 2, '2023-12-31', 'monthly', 31, TRUE)
+    ''')
+    migrations.migrate(conn)
+
+    instances = conn.execute('''
+        SELECT month_id, instance_date, amount FROM recurring_expense_instances
+        WHERE expense_id = 5 ORDER BY month_id
+    ''').fetchall()
+    # Day 31 is clamped to the end of February (2024 is a leap year)
+    assert instances == [(1, '2024-01-31', 999), (2, '2024-02-29', 999)]
+    assert check_month_totals(conn) == []
+
+
+def test_hot_queries_use_an_index(conn):
+    for check in migrations.check_query_plans(conn):
+        assert check.ok, (check.name, check.plan)
+
+
+def test_hot_queries_use_an_index_on_upgraded_database(tmp_path):
+    with closing(sqlite3.connect(str(tmp_path / 'empty.db'), isolation_level=None)) as conn:
+        for statement in migrations.BASELINE_SCHEMA:
+            conn.execute(statement)
+        migrations.migrate(conn)
+        for check in migrations.check_query_plans(conn):
+            assert check.ok, (check.name, check.plan)
+
+
+def test_hot_query_fails_when_its_index_is_missing(conn):
+    conn.execute('DROP INDEX idx_expenses_active_date')
+    checks = {check.name: check for check in migrations.check_query_plans(conn)}
+    # SQLite falls back to another index, which is not one the query allows
+    assert checks['month expenses by date'].indexes
+    assert not checks['month expenses by date'].ok
+    assert all(check.ok for name, check in checks.items() if name != 'month expenses by date')
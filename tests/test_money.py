@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+import pytest
+
+from money import format_money, from_cents, to_cents
+
+
+@pytest.mark.parametrize('value, cents', [
+    ('12.34', 1234),
+    (12.5, 1250),
+    (0.1, 10),
+    (Decimal('7'), 700),
+    (' $3.50 ', 350),
+])
+def test_to_cents(value, cents):
+    assert to_cents(value) == cents
+
+
+@pytest.mark.parametrize('value, cents', [
+    ('-12.34', -1234),
+    (-0.5, -50),
+    ('-$1,234.56', -123456),
+    ('-0.001', 0),
+])
+def test_to_cents_negative(value, cents):
+    assert to_cents(value) == cents
+
+
+@pytest.mark.parametrize('value, cents', [
+    ('1.004', 100),
+    ('1.005', 101),
+    ('-1.005', -101),
+    ('0.125', 13),
+    # As a float 2.675 is 2.67499999..., but it is read as the 2.675 it was written as
+    (2.675, 268),
+])
+def test_to_cents_rounds_half_cents_away_from_zero(value, cents):
+    assert to_cents(value) == cents
+
+
+@pytest.mark.parametrize('value, cents', [
+    ('1,234.56', 123456),
+    ('$1,234,567.89', 123456789),
+    ('4,000.50', 400050),
+])
+def test_to_cents_thousands_separators(value, cents):
+    assert to_cents(value) == cents
+
+
+@pytest.mark.parametrize('value', ['', 'abc', '12.3.4', 'nan', 'inf', '-Infinity', True, None])
+def test_to_cents_rejects_non_numbers(value):
+    with pytest.raises(ValueError):
+        to_cents(value)
+
+
+@pytest.mark.parametrize('cents, text', [
+    (0, '0.00'),
+    (5, '0.05'),
+    (-5, '-0.05'),
+    (400050, '4000.50'),
+    (-123456, '-1234.56'),
+    (None, '0.00'),
+])
+def test_format_money(cents, text):
+    assert format_money(cents) == text
+
+
+def test_from_cents():
+    assert from_cents(400050) == 4000.5
+    assert from_cents(None) == 0
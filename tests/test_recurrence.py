@@ -0,0 +1,90 @@
+import pytest
+
+from recurrence import (RECURRING_TEMPLATES_SQL, expand_occurrences, index_to_month, load_templates, month_index,
+                        occurrence_date, parse_template)
+
+YEAR_2024 = [(2024, month) for month in range(1, 13)]
+
+
+def _template(date, interval='monthly', recurring_day=None, template_id=1):
+    return parse_template({
+        'id': template_id, 'amount': 1000, 'description': 'Test', 'expense_type_id': 1, 'date': date,
+        'recurring_interval': interval, 'recurring_day': recurring_day,
+    })
+
+
+def _dates(occurrences):
+    return [occurrence.date for months in occurrences.values() for occurrence in months]
+
+
+def test_month_index_round_trip():
+    for year, month in [(2024, 1), (2024, 12), (1, 1)]:
+        assert index_to_month(month_index(year, month)) == (year, month)
+    assert month_index(2025, 1) - month_index(2024, 12) == 1
+
+
+@pytest.mark.parametrize('year, month, day, expected', [
+    (2024, 2, 31, '2024-02-29'),
+    (2023, 2, 30, '2023-02-28'),
+    (2024, 4, 31, '2024-04-30'),
+    (2024, 5, 31, '2024-05-31'),
+])
+def test_occurrence_date_clamps_to_the_month(year, month, day, expected):
+    assert occurrence_date(year, month, day) == expected
+
+
+def test_parse_template():
+    assert _template('2024-01-15', interval='none') is None
+    template = _template('2024-01-15', recurring_day=31)
+    assert (template.origin_index, template.interval_months, template.day) == (month_index(2024, 1), 1, 31)
+    # Only monthly templates use recurring_day
+    assert _template('2024-01-15', interval='yearly', recurring_day=31).day == 15
+
+
+def test_monthly_on_recurring_day():
+    occurrences = expand_occurrences([_template('2024-01-31', recurring_day=31)], YEAR_2024[:4])
+    assert _dates(occurrences) == ['2024-01-31', '2024-02-29', '2024-03-31', '2024-04-30']
+
+
+def test_biannual_and_yearly_count_from_the_template_month():
+    templates = [_template('2023-03-10', 'biannual'), _template('2022-11-05', 'yearly', template_id=2)]
+    occurrences = expand_occurrences(templates, YEAR_2024)
+    assert [(ym, [occ.template.id for occ in months]) for ym, months in occurrences.items() if months] == [
+        ((2024, 3), [1]), ((2024, 9), [1]), ((2024, 11), [2]),
+    ]
+
+
+def test_origin_month_and_months_before_it():
+    template = _template('2024-03-05')
+    months = [(2024, 2), (2024, 3), (2024, 4)]
+    assert _dates(expand_occurrences([template], months)) == ['2024-02-05', '2024-03-05', '2024-04-05']
+    assert _dates(expand_occurrences([template], months, skip_origin_month=True)) == ['2024-02-05', '2024-04-05']
+
+
+def test_every_requested_month_is_in_the_result():
+    occurrences = expand_occurrences([_template('2024-01-01', 'yearly')], [(2024, 6), (2025, 1)])
+    assert occurrences == {(2024, 6): [], (2025, 1): [occurrences[(2025, 1)][0]]}
+    assert expand_occurrences([_template('2024-01-01')], []) == {}
+
+
+def test_load_templates_matches_the_sql_version(conn):
+    conn.executemany('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval, recurring_day,
+                              is_recurring_template, is_active)
+        VALUES (1000, 'Test', 1, ?, ?, ?, ?, ?)
+    ''', [
+        ('2024-01-31', 'monthly', 15, True, True),
+        ('2023-07-20', 'biannual', None, True, True),
+        ('2022-02-28', 'yearly', None, True, True),
+        ('2024-01-01', 'monthly', None, True, False),
+        ('2024-01-01', 'monthly', None, False, True),
+        ('2024-01-01', 'none', None, False, True),
+    ])
+    conn.commit()
+    templates = load_templates(conn)
+    assert [template.date for template in templates] == ['2024-01-31', '2023-07-20', '2022-02-28']
+    assert len(load_templates(conn, templates_only=False)) == 4
+    rows = conn.execute(RECURRING_TEMPLATES_SQL + ' ORDER BY id').fetchall()
+    assert [(row['day'], row['origin_index'], row['interval_months']) for row in rows] == [
+        (template.day, template.origin_index, template.interval_months) for template in templates
+    ]
@@ -0,0 +1,88 @@
+import pytest
+
+import response_cache
+from response_cache import PageCache, PageEntry
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    response_cache.cache.clear()
+    response_cache._renders_flashes.clear()
+
+
+@pytest.fixture
+def client(client):
+    """A client whose session already remembers the default month, which the first
+    page it loads would otherwise set (and so change the next page's key)"""
+    client.get('/month/months')
+    response_cache.cache.clear()
+    return client
+
+
+def test_etag_and_not_modified(client):
+    first = client.get('/month/months')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert 'Cookie' in first.headers['Vary']
+
+    repeat = client.get('/month/months', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304 and repeat.data == b''
+    assert repeat.headers['ETag'] == etag
+
+
+def test_cached_body_is_reused_until_a_write(client, conn):
+    first = client.get('/month/months')
+    assert len(response_cache.cache._entries) == 1
+    second = client.get('/month/months')
+    assert (second.headers['ETag'], second.data) == (first.headers['ETag'], first.data)
+
+    # Any write, even from another connection, changes the page's ETag
+    conn.execute('UPDATE months SET monthly_income = 123456')
+    conn.commit()
+    third = client.get('/month/months', headers={'If-None-Match': first.headers['ETag']})
+    assert third.status_code == 200
+    assert third.headers['ETag'] != first.headers['ETag']
+
+
+def test_query_args_and_session_month_are_part_of_the_key(client, conn):
+    month_id = conn.execute('SELECT id FROM months').fetchone()[0]
+    plain = client.get('/expenses/view').headers['ETag']
+    assert client.get(f'/expenses/view?current_month_id={month_id}').headers['ETag'] != plain
+
+    other_month = conn.execute('INSERT INTO months (month, year) VALUES (1, 2020)').lastrowid
+    conn.commit()
+    plain = client.get('/expenses/view').headers['ETag']
+    with client.session_transaction() as session:
+        session['current_month_id'] = other_month
+    assert client.get('/expenses/view').headers['ETag'] != plain
+
+
+def test_session_updates_are_replayed_on_cache_hits(app, conn):
+    month_id = conn.execute('SELECT id FROM months').fetchone()[0]
+    app.test_client().get(f'/?current_month_id={month_id}')
+
+    other = app.test_client()
+    assert other.get(f'/?current_month_id={month_id}').status_code == 200
+    with other.session_transaction() as session:
+        assert str(session['current_month_id']) == str(month_id)
+
+
+def test_pending_flashes_are_left_for_the_page_that_shows_them(client):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'Saved')]
+    assert client.get('/month/months').status_code == 200
+    with client.session_transaction() as session:
+        assert session['_flashes'] == [('message', 'Saved')]
+
+
+def test_page_cache_is_bounded():
+    cache = PageCache(max_entries=2, max_bytes=10)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, PageEntry(b'1234', 'text/html', key, {}))
+    assert cache.get('a') is None and cache.get('c') is not None
+
+    cache.put('big', PageEntry(b'x' * 11, 'text/html', 'big', {}))
+    assert cache.get('big') is None
+    cache.put('d', PageEntry(b'123456789', 'text/html', 'd', {}))
+    assert list(cache._entries) == ['d']
@@ -0,0 +1,105 @@
+import pytest
+
+from retention import archive_deleted_expenses, list_deleted_expenses, restore_expense
+from rollups import check_month_totals
+
+
+def _add(conn, description, interval='none'):
+    cursor = conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                              is_recurring_template)
+        VALUES (1000, ?, 1, '2024-01-10', ?, ?)
+    ''', (description, interval, interval != 'none'))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _delete(conn, expense_id, days_ago=0):
+    conn.execute('UPDATE expenses SET is_active = FALSE WHERE id = ?', (expense_id,))
+    conn.execute("UPDATE expenses SET deleted_at = datetime('now', ?) WHERE id = ?",
+                 (f'-{days_ago} days', expense_id))
+    conn.commit()
+
+
+def _archived_ids(conn):
+    return [row[0] for row in conn.execute('SELECT id FROM expenses_archive ORDER BY id')]
+
+
+def test_deleted_at_follows_is_active(conn):
+    expense = _add(conn, 'Coffee')
+    conn.execute('UPDATE expenses SET is_active = FALSE WHERE id = ?', (expense,))
+    assert conn.execute('SELECT deleted_at FROM expenses WHERE id = ?', (expense,)).fetchone()[0] is not None
+    conn.execute('UPDATE expenses SET is_active = TRUE WHERE id = ?', (expense,))
+    assert conn.execute('SELECT deleted_at FROM expenses WHERE id = ?', (expense,)).fetchone()[0] is None
+
+
+def test_archive_moves_only_long_deleted_expenses(conn):
+    old, recent, live = _add(conn, 'Old'), _add(conn, 'Recent'), _add(conn, 'Live')
+    _delete(conn, old, days_ago=40)
+    _delete(conn, recent, days_ago=5)
+
+    assert archive_deleted_expenses(conn, older_than_days=30) == 1
+    assert _archived_ids(conn) == [old]
+    remaining = [row[0] for row in conn.execute('SELECT id FROM expenses ORDER BY id')]
+    assert remaining == [recent, live]
+    assert check_month_totals(conn) == []
+
+
+def test_archive_in_batches(conn):
+    expenses = [_add(conn, f'Old {n}') for n in range(5)]
+    for expense in expenses:
+        _delete(conn, expense, days_ago=40)
+    assert archive_deleted_expenses(conn, older_than_days=30, batch_size=2, max_batches=2) == 4
+    assert archive_deleted_expenses(conn, older_than_days=30, batch_size=2) == 1
+    assert _archived_ids(conn) == expenses
+
+
+def test_templates_with_instances_are_kept(conn):
+    template = _add(conn, 'Rent', interval='monthly')
+    month_id = conn.execute('SELECT id FROM months').fetchone()[0]
+    conn.execute('''
+        INSERT INTO recurring_expense_instances
+        (expense_id, month_id, instance_date, amount, description, expense_type_id)
+        VALUES (?, ?, '2024-02-10', 1000, 'Rent', 1)
+    ''', (template, month_id))
+    conn.commit()
+    _delete(conn, template, days_ago=40)
+    assert archive_deleted_expenses(conn, older_than_days=30) == 0
+
+
+def test_archive_needs_no_open_transaction(conn):
+    conn.execute("UPDATE months SET monthly_income = 1")
+    with pytest.raises(RuntimeError):
+        archive_deleted_expenses(conn)
+    conn.rollback()
+
+
+def test_restore(conn):
+    soft, archived = _add(conn, 'Soft'), _add(conn, 'Archived')
+    _delete(conn, soft)
+    _delete(conn, archived, days_ago=40)
+    archive_deleted_expenses(conn, older_than_days=30)
+    assert [(row['id'], row['archived']) for row in list_deleted_expenses(conn)] == [(soft, 0), (archived, 1)]
+
+    assert restore_expense(conn, soft) == 'reactivated'
+    assert restore_expense(conn, archived) == 'restored'
+    assert restore_expense(conn, archived) is None
+    row = conn.execute('SELECT description, is_active, deleted_at FROM expenses WHERE id = ?', (archived,)).fetchone()
+    assert tuple(row) == ('Archived', 1, None)
+    assert _archived_ids(conn) == []
+    assert check_month_totals(conn) == []
+
+
+def test_deleted_and_undelete_routes(client, conn):
+    expense = _add(conn, 'Archived')
+    _delete(conn, expense, days_ago=40)
+    archive_deleted_expenses(conn, older_than_days=30)
+
+    listed = client.get('/expenses/deleted').get_json()['expenses']
+    assert [(row['id'], row['archived'], row['amount']) for row in listed] == [(expense, True, 10.0)]
+
+    response = client.post('/expenses/undelete', json={'expense_id': expense})
+    assert response.get_json() == {'success': True, 'message': 'Expense restored', 'expense_id': expense,
+                                   'from_archive': True}
+    assert client.post('/expenses/undelete', json={'expense_id': expense}).status_code == 404
+    assert client.post('/expenses/undelete', json={'expense_id': 'x'}).status_code == 400
@@ -0,0 +1,98 @@
+import time
+from datetime import date
+
+import pytest
+
+from revision import get_revision
+from scheduler import InstanceScheduler, sync_window
+
+# June 2024 is the current month of these tests
+TODAY = date(2024, 6, 15)
+
+
+@pytest.fixture
+def template(conn):
+    """Every month of 2024 (and no others), and a monthly template from January with
+    no instances yet"""
+    conn.execute('DELETE FROM months')
+    conn.executemany('INSERT INTO months (month, year) VALUES (?, 2024)', [(month,) for month in range(1, 13)])
+    cursor = conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                              recurring_day, is_recurring_template)
+        VALUES (10000, 'Gym', 1, '2024-01-05', 'monthly', 5, TRUE)
+    ''')
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _instances(conn, expense_id):
+    return {row[0]: row[1] for row in conn.execute('''
+        SELECT m.month, rei.amount FROM recurring_expense_instances rei
+        JOIN months m ON m.id = rei.month_id
+        WHERE rei.expense_id = ?
+    ''', (expense_id,))}
+
+
+def test_window_around_the_current_month(conn, template):
+    result = sync_window(conn, past_months=1, future_months=2, today=TODAY)
+    assert result.inserted == 4
+    assert sorted(_instances(conn, template)) == [5, 6, 7, 8]
+
+
+def test_idle_sync_leaves_the_revision_alone(conn, template):
+    sync_window(conn, today=TODAY)
+    revision = get_revision(conn)
+    assert tuple(sync_window(conn, today=TODAY)) == (0, 0, 0)
+    assert get_revision(conn) == revision
+
+
+def test_edits_and_deletes_only_rewrite_current_and_future_months(conn, template):
+    sync_window(conn, past_months=None, future_months=None, today=TODAY)
+    conn.execute('UPDATE expenses SET amount = 12000 WHERE id = ?', (template,))
+    conn.commit()
+    result = sync_window(conn, past_months=None, future_months=None, today=TODAY)
+    assert (result.inserted, result.updated, result.deleted) == (0, 7, 0)
+    amounts = _instances(conn, template)
+    assert [amounts[month] for month in (5, 6, 12)] == [10000, 12000, 12000]
+
+    conn.execute('UPDATE expenses SET is_active = FALSE WHERE id = ?', (template,))
+    conn.commit()
+    assert sync_window(conn, past_months=None, future_months=None, today=TODAY).deleted == 7
+    assert sorted(_instances(conn, template)) == [2, 3, 4, 5]
+
+
+def test_only_the_given_templates(conn, template):
+    assert tuple(sync_window(conn, template_ids=[template + 1], today=TODAY)) == (0, 0, 0)
+    assert sync_window(conn, template_ids=[template], today=TODAY).inserted > 0
+
+
+def test_needs_no_open_transaction(conn, template):
+    conn.execute('UPDATE months SET monthly_income = 1')
+    with pytest.raises(RuntimeError):
+        sync_window(conn)
+    conn.rollback()
+
+
+def test_queued_jobs_are_merged_per_database():
+    scheduler = InstanceScheduler(interval=3600)
+    scheduler.submit('a.db', [2])
+    scheduler.submit('b.db', [3])
+    scheduler.submit('a.db', [4])
+    scheduler.submit('b.db')
+    assert scheduler._merge(('a.db', {1})) == {'a.db': {1, 2, 4}, 'b.db': None}
+
+
+def test_scheduler_thread(app, conn, template, db_path):
+    # The full sync at start covers the window around the real current month, which
+    # 2024 is outside of; the queued job covers every month
+    scheduler = InstanceScheduler(interval=3600)
+    scheduler.start()
+    scheduler.submit(db_path, [template])
+    deadline = time.monotonic() + 10
+    while len(_instances(conn, template)) < 11 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    scheduler.join(timeout=10)
+    assert not scheduler.is_alive()
+    # The template's own row stands for January
+    assert sorted(_instances(conn, template)) == list(range(2, 13))
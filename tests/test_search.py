@@ -0,0 +1,85 @@
+import pytest
+
+import search
+from search import search_expenses
+
+
+def _add(conn, description, amount=1000, expense_date='2024-03-10', expense_type_id=1, is_active=True):
+    conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, is_active)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (amount, description, expense_type_id, expense_date, is_active))
+    conn.commit()
+
+
+def _descriptions(results):
+    return [row['description'] for row in results.rows]
+
+
+def test_substring_match(conn):
+    _add(conn, 'Weekly groceries at Aldi')
+    _add(conn, 'Coffee')
+    _add(conn, 'Deleted groceries', is_active=False)
+    results = search_expenses(conn, 'ROCER')
+    assert _descriptions(results) == ['Weekly groceries at Aldi']
+    assert (results.total, results.capped) == (1, False)
+
+
+def test_description_matches_rank_before_type_name_matches(conn):
+    groceries = conn.execute("SELECT id FROM expense_types WHERE name = 'Groceries'").fetchone()[0]
+    _add(conn, 'Market run', expense_type_id=groceries)
+    _add(conn, 'Groceries and more, a long description')
+    _add(conn, 'Groceries')
+    assert _descriptions(search_expenses(conn, 'groceries')) == [
+        'Groceries', 'Groceries and more, a long description', 'Market run',
+    ]
+
+
+def test_filters(conn):
+    _add(conn, 'Gas station', amount=4000, expense_date='2024-01-05')
+    _add(conn, 'Gas station', amount=6000, expense_date='2024-02-05', expense_type_id=2)
+    _add(conn, 'Gas station', amount=8000, expense_date='2024-03-05')
+    assert search_expenses(conn, 'gas', start_date='2024-02-01').total == 2
+    assert search_expenses(conn, 'gas', end_date='2024-02-05').total == 2
+    assert search_expenses(conn, 'gas', expense_type_ids=[2]).total == 1
+    assert [row['amount'] for row in search_expenses(conn, 'gas', min_amount=5000, max_amount=7000).rows] == [6000]
+
+
+def test_every_term_must_match(conn):
+    _add(conn, 'Train ticket')
+    _add(conn, 'Plane ticket')
+    assert _descriptions(search_expenses(conn, 'ticket train')) == ['Train ticket']
+
+
+def test_short_terms_are_rejected(conn):
+    with pytest.raises(ValueError):
+        search_expenses(conn, 'ab c')
+
+
+@pytest.mark.parametrize('matches, total, capped', [(3, 3, False), (4, 3, True), (5, 3, True)])
+def test_capped_only_when_matches_were_cut_off(conn, monkeypatch, matches, total, capped):
+    monkeypatch.setattr(search, 'MAX_RANKED_MATCHES', 3)
+    for day in range(1, matches + 1):
+        _add(conn, f'Lunch {day}', expense_date=f'2024-03-{day:02d}')
+    results = search_expenses(conn, 'lunch', per_page=10)
+    assert (results.total, results.capped) == (total, capped)
+    # Only the newest matches are ranked
+    assert sorted(_descriptions(results)) == [f'Lunch {day}' for day in range(matches - 2, matches + 1)]
+
+
+def test_pages(conn):
+    for day in range(1, 6):
+        _add(conn, f'Bus fare {day}', expense_date=f'2024-03-{day:02d}')
+    results = search_expenses(conn, 'fare', page=2, per_page=2)
+    assert (len(results.rows), results.total) == (2, 5)
+    assert search_expenses(conn, 'fare', page=4, per_page=2).total == 5
+
+
+def test_search_route(client, conn):
+    _add(conn, 'Cinema tickets', amount=2450)
+    result = client.get('/expenses/search?q=cinema').get_json()
+    assert result['success'] and (result['total'], result['capped'], result['pages']) == (1, False, 1)
+    assert result['results'][0]['amount'] == 24.5
+
+    response = client.get('/expenses/search?q=ab')
+    assert response.status_code == 400
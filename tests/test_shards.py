@@ -0,0 +1,123 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import db
+import shards
+
+
+@pytest.fixture
+def shard_dir(tmp_path):
+    return str(tmp_path / 'shards')
+
+
+@pytest.fixture
+def sharded_client(db_path, shard_dir):
+    """A client of an app with one database per tenant; the router is process-wide,
+    so it is removed again afterwards"""
+    from app import create_app
+
+    app = create_app({'DATABASE': db_path, 'SECRET_KEY': 'test', 'TESTING': True, 'SHARD_DIR': shard_dir})
+    yield app.test_client()
+    db.set_router(None)
+
+
+def _type_names(path):
+    with closing(sqlite3.connect(path)) as conn:
+        return {name for (name,) in conn.execute('SELECT name FROM expense_types')}
+
+
+@pytest.mark.parametrize('tenant_id', ['', '../etc', 'a/b', '-leading', 'x' * 65, 'with space'])
+def test_invalid_tenant_ids(tenant_id):
+    with pytest.raises(ValueError):
+        shards.check_tenant_id(tenant_id)
+
+
+def test_create_tenant_and_access_keys(shard_dir):
+    key = shards.create_tenant(shard_dir, 'alice')
+    assert os.path.exists(shards.shard_path(shard_dir, 'alice'))
+    assert shards.check_access_key(shard_dir, 'alice', key)
+    assert not shards.check_access_key(shard_dir, 'alice', key + 'x')
+    assert not shards.check_access_key(shard_dir, 'bob', key)
+    # Only a hash of the key is kept, readable by its owner alone
+    key_path = os.path.join(shard_dir, 'alice' + shards.KEY_SUFFIX)
+    with open(key_path) as f:
+        assert key not in f.read()
+    assert os.stat(key_path).st_mode & 0o777 == 0o600
+
+    # A new key replaces the old one
+    new_key = shards.create_tenant(shard_dir, 'alice')
+    assert shards.check_access_key(shard_dir, 'alice', new_key)
+    assert not shards.check_access_key(shard_dir, 'alice', key)
+    assert shards.list_tenants(shard_dir) == ['alice']
+
+
+def test_router_never_creates_unknown_tenants(shard_dir):
+    router = shards.ShardRouter(shard_dir)
+    with pytest.raises(shards.UnknownTenant):
+        router.pool('mallory')
+    assert not os.path.exists(shards.shard_path(shard_dir, 'mallory'))
+    # Only the default tenant is created on first use
+    router.pool(shards.DEFAULT_TENANT)
+    assert shards.list_tenants(shard_dir) == [shards.DEFAULT_TENANT]
+    router.close_all()
+
+
+def test_router_keeps_at_most_max_open_shards(shard_dir):
+    for tenant in ('alice', 'bob'):
+        shards.create_tenant(shard_dir, tenant)
+    router = shards.ShardRouter(shard_dir, max_open=1)
+    alice = router.pool('alice')
+    assert router.pool('alice') is alice
+    bob = router.pool('bob', read_only=True)
+    assert alice.closed and not bob.closed
+    assert router.pool('alice') is not alice
+    router.close_all()
+
+
+def test_switch_tenant(sharded_client, shard_dir):
+    key = shards.create_tenant(shard_dir, 'alice')
+    for data in ({'tenant_id': 'alice', 'access_key': 'wrong'}, {'tenant_id': 'bob', 'access_key': key}):
+        response = sharded_client.post('/tenant', json=data)
+        assert response.status_code == 403
+    assert shards.list_tenants(shard_dir) == ['alice', shards.DEFAULT_TENANT]
+    assert sharded_client.post('/tenant', json={'tenant_id': '../x'}).status_code == 400
+
+    response = sharded_client.post('/tenant', json={'tenant_id': 'alice', 'access_key': key})
+    assert response.get_json()['success']
+    assert sharded_client.get('/tenant').get_json() == {'success': True, 'tenant_id': 'alice', 'sharded': True}
+
+    # Writes go to the tenant's own database
+    sharded_client.post('/expense-types/add', data={'name': 'Only Alice'})
+    assert 'Only Alice' in _type_names(shards.shard_path(shard_dir, 'alice'))
+    assert 'Only Alice' not in _type_names(shards.shard_path(shard_dir, shards.DEFAULT_TENANT))
+
+
+def test_removed_tenant_goes_back_to_the_default(sharded_client, shard_dir):
+    key = shards.create_tenant(shard_dir, 'alice')
+    sharded_client.post('/tenant', json={'tenant_id': 'alice', 'access_key': key})
+    db.get_router().close_all()
+    os.remove(shards.shard_path(shard_dir, 'alice'))
+
+    response = sharded_client.get('/')
+    assert response.status_code == 404
+    assert sharded_client.get('/tenant').get_json()['tenant_id'] == shards.DEFAULT_TENANT
+
+
+def test_switch_tenant_without_shards(client):
+    assert client.post('/tenant', json={'tenant_id': 'alice'}).status_code == 400
+
+
+def test_run_maintenance(shard_dir):
+    for tenant in ('alice', 'bob'):
+        shards.create_tenant(shard_dir, tenant)
+    results = shards.run_maintenance(shard_dir, 'check-totals', jobs=1)
+    assert [(result.tenant, result.ok) for result in results] == [('alice', True), ('bob', True)]
+
+    missing, = shards.run_maintenance(shard_dir, 'integrity-check', tenants=['carol'], jobs=1)
+    assert not missing.ok
+    assert not os.path.exists(shards.shard_path(shard_dir, 'carol'))
+    with pytest.raises(ValueError):
+        shards.run_maintenance(shard_dir, 'drop-everything')
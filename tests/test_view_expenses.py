@@ -0,0 +1,72 @@
+import re
+
+import pytest
+
+ITEM = re.compile(r'Item-\d\d')
+
+
+@pytest.fixture
+def month(conn):
+    """The month setup_db created, with 12 one-off expenses over two types and one
+    recurring instance"""
+    row = conn.execute('SELECT id, year, month FROM months').fetchone()
+    prefix = f"{row['year']:04d}-{row['month']:02d}"
+    conn.executemany('''
+        INSERT INTO expenses (amount, description, expense_type_id, date)
+        VALUES (?, ?, ?, ?)
+    ''', [(100 * (n % 5 + 1), f'Item-{n:02d}', 1 + n % 2, f'{prefix}-{n % 4 + 1:02d}') for n in range(12)])
+    template = conn.execute('''
+        INSERT INTO expenses (amount, description, expense_type_id, date, recurring_interval,
+                              is_recurring_template)
+        VALUES (5000, 'Template', 3, '2000-01-01', 'monthly', TRUE)
+    ''').lastrowid
+    conn.execute('''
+        INSERT INTO recurring_expense_instances
+        (expense_id, month_id, instance_date, amount, description, expense_type_id)
+        VALUES (?, ?, ?, 5000, 'Rent', 3)
+    ''', (template, row['id'], f'{prefix}-01'))
+    conn.commit()
+    return row['id']
+
+
+def _items(client, **args):
+    response = client.get('/expenses/view', query_string=args)
+    assert response.status_code == 200
+    return set(ITEM.findall(response.get_data(as_text=True)))
+
+
+@pytest.mark.parametrize('sort_by, sort_order', [('date', 'desc'), ('amount', 'asc'), ('expense_type', 'desc')])
+def test_pages_cover_every_expense_once(client, month, sort_by, sort_order):
+    # 13 rows (12 expenses and the instance) make two pages of 10
+    pages = [_items(client, month_id=month, page=page, sort_by=sort_by, sort_order=sort_order) for page in (1, 2)]
+    assert not pages[0] & pages[1]
+    assert pages[0] | pages[1] == {f'Item-{n:02d}' for n in range(12)}
+    assert len(pages[0]) + len(pages[1]) == 12
+
+
+def test_out_of_range_pages_are_clamped(client, month):
+    assert _items(client, month_id=month, page=99) == _items(client, month_id=month, page=2)
+    assert _items(client, month_id=month, page=-1) == _items(client, month_id=month, page=1)
+
+
+def test_type_filter(client, month):
+    assert _items(client, month_id=month, expense_type_id=2) == {f'Item-{n:02d}' for n in range(1, 12, 2)}
+
+
+def test_summary(client, month):
+    result = client.get(f'/expenses/api/summary?month_id={month}').get_json()
+    assert result['success'] and result['month']['id'] == month
+    # Amounts 1-5 dollars for n % 5 over 12 expenses: 3 * (1+2) + 2 * (3+4+5) dollars, plus $50 rent
+    assert (result['total_amount'], result['total_count']) == (83.0, 13)
+    by_type = {row['expense_type_id']: row for row in result['types']}
+    assert (by_type[3]['regular_amount'], by_type[3]['recurring_amount'], by_type[3]['expense_count']) == (0, 50.0, 1)
+    assert sum(row['amount'] for row in result['types']) == result['total_amount']
+
+    filtered = client.get(f'/expenses/api/summary?month_id={month}&expense_type_id=3').get_json()
+    assert [row['expense_type_id'] for row in filtered['types']] == [3]
+    assert filtered['total_amount'] == 50.0
+
+
+def test_summary_defaults_to_the_latest_month(client, month):
+    assert client.get('/expenses/api/summary').get_json()['month']['id'] == month
+    assert client.get('/expenses/api/summary?month_id=9999').status_code == 404
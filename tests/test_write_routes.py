@@ -0,0 +1,202 @@
+"""
+Every route that writes expenses, months or types must leave the month totals
+rollup equal to the raw tables (rollups.check_month_totals() finds nothing).
+"""
+
+import calendar
+import io
+from datetime import date
+
+import pytest
+
+from recurrence import index_to_month, month_index
+from rollups import check_month_totals
+
+TODAY = date.today()
+CURRENT = month_index(TODAY.year, TODAY.month)
+
+
+def _month(offset):
+    """(year, month) ``offset`` months from the current one"""
+    return index_to_month(CURRENT + offset)
+
+
+def _day(offset, day=1):
+    year, month = _month(offset)
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+
+def _month_id(conn, offset):
+    year, month = _month(offset)
+    return conn.execute('SELECT id FROM months WHERE year = ? AND month = ?', (year, month)).fetchone()[0]
+
+
+def _last_expense_id(conn):
+    return conn.execute('SELECT MAX(id) FROM expenses').fetchone()[0]
+
+
+def _instances(conn, expense_id):
+    return [tuple(row) for row in conn.execute('''
+        SELECT m.year, m.month, rei.amount
+        FROM recurring_expense_instances rei
+        JOIN months m ON m.id = rei.month_id
+        WHERE rei.expense_id = ?
+        ORDER BY m.year, m.month
+    ''', (expense_id,))]
+
+
+def _add_expense(client, conn, amount, expense_date, interval='none', expense_type_id=1, description='Test',
+                 **fields):
+    response = client.post('/add_expense', data=dict(
+        fields, amount=amount, description=description, expense_type_id=expense_type_id,
+        date=expense_date, recurring_interval=interval,
+    ))
+    assert response.status_code == 302
+    return _last_expense_id(conn)
+
+
+@pytest.fixture
+def months(client):
+    """Two months before the current one to three after it"""
+    (start_year, start_month), (end_year, end_month) = _month(-2), _month(3)
+    response = client.post('/month/add_month_range', json={
+        'start': f'{start_year}-{start_month:02d}', 'end': f'{end_year}-{end_month:02d}',
+        'monthly_income': '4,000.50',
+    })
+    assert response.get_json()['success']
+
+
+@pytest.fixture
+def template(client, conn, months):
+    """A monthly template dated two months ago, with instances in the later months"""
+    return _add_expense(client, conn, '1,500.25', _day(-2, 5), interval='monthly', description='Rent')
+
+
+def test_add_month_range(conn, months):
+    assert conn.execute('SELECT COUNT(*) FROM months').fetchone()[0] == 6
+    assert check_month_totals(conn) == []
+
+
+def test_add_month(client, conn, template):
+    year, month = _month(4)
+    response = client.post('/month/add_month', data={'month': month, 'year': year, 'monthly_income': '3000'})
+    assert response.status_code == 302
+    assert (year, month, 150025) in _instances(conn, template)
+    assert check_month_totals(conn) == []
+
+
+def test_add_expense(client, conn, months):
+    _add_expense(client, conn, '12.34', _day(0, 10))
+    template = _add_expense(client, conn, '99.99', _day(-2, 28), interval='monthly', recurring_day=31)
+    # Every other month gets an instance, on its last day
+    assert len(_instances(conn, template)) == 5
+    for (year, month), (instance_date,) in zip(
+            (_month(offset) for offset in range(-1, 4)),
+            conn.execute('SELECT instance_date FROM recurring_expense_instances WHERE expense_id = ? '
+                         'ORDER BY instance_date', (template,))):
+        assert instance_date == f'{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}'
+    assert check_month_totals(conn) == []
+
+
+def test_edit_expense(client, conn, template):
+    expense = _add_expense(client, conn, '10', _day(0, 3))
+    # Move a one-off expense into another month and change its type
+    response = client.post('/expenses/edit', data={
+        'expense_id': expense, 'amount': '20.50', 'description': 'Moved', 'expense_type_id': 2,
+        'date': _day(1, 3), 'recurring_interval': 'none',
+    })
+    assert response.status_code == 302
+    # The template's instances follow its new amount from the current month on
+    response = client.post('/expenses/edit', data={
+        'expense_id': template, 'amount': '1,600', 'description': 'Rent', 'expense_type_id': 1,
+        'date': _day(-2, 5), 'recurring_interval': 'monthly',
+    })
+    assert response.status_code == 302
+    amounts = [amount for _, _, amount in _instances(conn, template)]
+    assert amounts == [150025, 160000, 160000, 160000, 160000]
+    assert check_month_totals(conn) == []
+
+
+def test_delete_and_undelete_expense(client, conn, template):
+    expense = _add_expense(client, conn, '42', _day(0, 7))
+    for expense_id in (expense, template):
+        response = client.post('/expenses/delete', data={'expense_id': expense_id})
+        assert response.status_code == 302
+        assert check_month_totals(conn) == []
+    # Only the past month keeps its instance
+    assert len(_instances(conn, template)) == 1
+
+    for expense_id in (expense, template):
+        response = client.post('/expenses/undelete', json={'expense_id': expense_id})
+        assert response.get_json()['success']
+        assert check_month_totals(conn) == []
+    assert len(_instances(conn, template)) == 5
+
+
+def test_batch(client, conn, template):
+    expense = _add_expense(client, conn, '5', _day(0, 1))
+    response = client.post('/expenses/api/batch', json=[
+        {'op': 'create', 'amount': '1,000.01', 'expense_type_id': 2, 'date': _day(1, 2), 'description': 'New'},
+        {'op': 'create', 'amount': 3.5, 'expense_type_id': 3, 'date': _day(0, 2),
+         'recurring_interval': 'monthly'},
+        {'op': 'update', 'id': expense, 'amount': 6.25, 'date': _day(-1, 2)},
+        {'op': 'delete', 'id': template},
+    ])
+    assert response.get_json()['success'], response.get_json()
+    assert check_month_totals(conn) == []
+
+
+def test_import(client, conn, months):
+    csv = (
+        'date,amount,description,expense_type\n'
+        f'{_day(0, 1)},"1,234.56",Imported,Groceries\n'
+        f'{_day(-1, 15)},-20.00,Refund,Groceries\n'
+        f'{_day(2, 28)},0.125,Rounded,Unknown category\n'
+    )
+    response = client.post('/expenses/import', data={'file': (io.BytesIO(csv.encode()), 'upload.csv')},
+                           content_type='multipart/form-data')
+    result = response.get_json()
+    # The refund is a credit, not an expense
+    assert result['success'] and (result['rows_imported'], result['rows_skipped']) == (2, 1), result
+    assert conn.execute("SELECT COUNT(*) FROM expenses WHERE description = 'Refund'").fetchone()[0] == 0
+    assert check_month_totals(conn) == []
+
+
+def test_update_month(client, conn, template):
+    # Re-dating a month moves its instances' totals with it
+    month_id = _month_id(conn, 1)
+    response = client.post('/month/update_month', data={
+        'month_id': month_id, 'month': 1, 'year': TODAY.year + 5, 'monthly_income': '1,000',
+    })
+    assert response.status_code == 302
+    assert check_month_totals(conn) == []
+
+
+def test_seed_data(client, conn, template):
+    with client.session_transaction() as session:
+        session['current_month_id'] = _month_id(conn, 0)
+    response = client.post('/seed_data')
+    assert response.get_json()['success']
+    assert check_month_totals(conn) == []
+
+
+def test_delete_expense_type(client, conn, template):
+    response = client.post('/expense-types/add', data={'name': 'Unused'})
+    assert response.status_code == 302
+    unused = conn.execute("SELECT id FROM expense_types WHERE name = 'Unused'").fetchone()[0]
+    client.post(f'/expense-types/delete/{unused}')
+    assert conn.execute('SELECT COUNT(*) FROM expense_types WHERE id = ?', (unused,)).fetchone()[0] == 0
+
+    # A type still in use is kept
+    client.post('/expense-types/delete/1')
+    assert conn.execute('SELECT COUNT(*) FROM expense_types WHERE id = 1').fetchone()[0] == 1
+    assert check_month_totals(conn) == []
+
+
+def test_reset_data(client, conn, template):
+    _add_expense(client, conn, '10', _day(0, 1))
+    response = client.post('/reset_data')
+    assert response.get_json()['success']
+    assert conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM recurring_expense_instances').fetchone()[0] == 0
+    assert check_month_totals(conn) == []